@@ -20,6 +20,7 @@ import optparse
 import dbus
 import dbus.service
 import sys
+import time
 from wicd import misc
 from wicd.translations import _
 
@@ -80,12 +81,15 @@ parser.add_option('--wired', '-z', default=False, action='store_true')
 parser.add_option('--load-profile', '-o', default=False, action='store_true')
 parser.add_option('--status', '-i', default=False,
     action='store_true') # -i(nfo)
+parser.add_option('--command-stats', default=False, action='store_true')
+parser.add_option('--connect-trace', default=False, action='store_true')
 
 options, arguments = parser.parse_args()
 
 op_performed = False
 
-if not (options.wireless or options.wired) and not options.status:
+if not (options.wireless or options.wired) and not options.status and \
+    not (options.command_stats or options.connect_trace):
     print "Please use --wireless or --wired to specify " + \
     "the type of connection to operate on."
 
@@ -160,11 +164,12 @@ if options.load_profile and options.wired:
 if options.list_networks:
     if options.wireless:
         print '#\tBSSID\t\t\tChannel\tESSID'
-        for network_id in range(0, wireless.GetNumberOfNetworks()):
+        networks = wireless.GetScanResults(['bssid', 'channel', 'essid'])
+        for network_id, network in enumerate(networks):
             print '%s\t%s\t%s\t%s' % (network_id,
-                wireless.GetWirelessProperty(network_id, 'bssid'),
-                wireless.GetWirelessProperty(network_id, 'channel'),
-                wireless.GetWirelessProperty(network_id, 'essid'))
+                network.get('bssid'),
+                network.get('channel'),
+                network.get('essid'))
     elif options.wired:
         print '#\tProfile name'
         i = 0
@@ -184,22 +189,22 @@ if options.network_details:
             # we're connected to a network, print IP
             print "IP: %s" % wireless.GetWirelessIP(0)
 
-        print "Essid: %s" % wireless.GetWirelessProperty(network_id, "essid")
-        print "Bssid: %s" % wireless.GetWirelessProperty(network_id, "bssid")
-        if wireless.GetWirelessProperty(network_id, "encryption"):
+        network = wireless.GetScanResults(['essid', 'bssid', 'encryption',
+                                           'encryption_method', 'quality',
+                                           'mode', 'channel',
+                                           'bitrates'])[network_id]
+        print "Essid: %s" % network.get("essid")
+        print "Bssid: %s" % network.get("bssid")
+        if network.get("encryption"):
             print "Encryption: On"
             print "Encryption Method: %s" % \
-                wireless.GetWirelessProperty(network_id, "encryption_method")
+                network.get("encryption_method")
         else:
             print "Encryption: Off"
-        print "Quality: %s" % \
-            wireless.GetWirelessProperty(network_id, "quality")
-        print "Mode: %s" % \
-            wireless.GetWirelessProperty(network_id, "mode")
-        print "Channel: %s" % \
-            wireless.GetWirelessProperty(network_id, "channel")
-        print "Bit Rates: %s" % \
-            wireless.GetWirelessProperty(network_id, "bitrates")
+        print "Quality: %s" % network.get("quality")
+        print "Mode: %s" % network.get("mode")
+        print "Channel: %s" % network.get("channel")
+        print "Bit Rates: %s" % network.get("bitrates")
     op_performed = True
 
 # network properties
@@ -289,7 +294,7 @@ def str_properties(prop):
         return ', '.join("%s (%s)" % (x, y) for x, y in tmp)
 
 if options.wireless and options.list_encryption_types:
-    et = misc.LoadEncryptionMethods()
+    et = wireless.GetEncryptionMethods()
     # print 'Installed encryption templates:'
     print '%s\t%-20s\t%s' % ('#', 'Name', 'Description')
     i = 0
@@ -310,6 +315,37 @@ if options.save and options.network > -1:
         config.SaveWiredNetworkProfile(options.name)
     op_performed = True
 
+if options.command_stats:
+    buckets, stats = daemon.GetCommandStats()
+    labels = ['<=%dms' % bound for bound in buckets] + \
+        ['>%dms' % buckets[-1]]
+    print '%-16s %6s %6s %10s %8s %8s %10s' % ('Command', 'Calls',
+        'Failed', 'Total ms', 'Avg ms', 'Max ms', 'Output')
+    for name, entry in sorted(stats.items(),
+                              key=lambda item: -item[1]['total_ms']):
+        timed = entry['calls'] - entry['untimed']
+        if timed:
+            avg = entry['total_ms'] / timed
+        else:
+            avg = 0
+        print '%-16s %6d %6d %10.1f %8.1f %8.1f %10d' % (name,
+            entry['calls'], entry['failures'], entry['total_ms'], avg,
+            entry['max_ms'], entry['output_bytes'])
+        print '  ' + ' '.join(['%s:%d' % (label, count) for label, count
+                               in zip(labels, entry['histogram']) if count])
+    op_performed = True
+
+if options.connect_trace:
+    for trace in daemon.GetConnectTraces():
+        print '%s %s (%s): %s in %.2f s' % (
+            time.strftime('%Y-%m-%d %H:%M:%S',
+                          time.localtime(trace['started'])),
+            trace['network'], trace['bssid'], trace['result'],
+            trace['duration'])
+        for phase, duration in zip(trace['phases'], trace['durations']):
+            print '  %-28s %8.3f s' % (phase, duration)
+    op_performed = True
+
 if not op_performed:
     print "No operations performed."
 
@@ -23,7 +23,6 @@
 
 import urwid
 from curses_misc import DynWrap, MaskingEdit, ComboBox, error
-import wicd.misc as misc
 from wicd.misc import noneToString, stringToNone, noneToBlankString, to_bool
 
 from wicd.translations import language, _
@@ -336,7 +335,7 @@ class WiredSettingsDialog(AdvancedSettingsDialog):
         self._listbox.body.append(self.encryption_chkbox)
         # pylint: disable-msg=E1103
         self._listbox.body.append(self.encryption_combo)
-        self.encrypt_types = misc.LoadEncryptionMethods(wired=True)
+        self.encrypt_types = wired.GetEncryptionMethods()
         self.set_values()
 
         self.prof_name = name
@@ -499,7 +498,7 @@ class WirelessSettingsDialog(AdvancedSettingsDialog):
         self._listbox.body.append(self.encryption_chkbox)
         # pylint: disable-msg=E1103
         self._listbox.body.append(self.encryption_combo)
-        self.encrypt_types = misc.LoadEncryptionMethods()
+        self.encrypt_types = wireless.GetEncryptionMethods()
         self.set_values()
 
         title = _('Configuring preferences for wireless network "$A" ($B)'). \
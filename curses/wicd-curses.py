@@ -137,9 +137,10 @@ def wrap_exceptions(func):
 # Look familiar?  These two functions are clones of functions found in wicd's
 # gui.py file, except that now set_status is a function passed to them.
 @wrap_exceptions
-def check_for_wired(wired_ip, set_status):
+def check_for_wired(snapshot, set_status):
     """ Determine if wired is active, and if yes, set the status. """
-    if wired_ip and wired.CheckPluggedIn():
+    wired_ip = snapshot.get('wired_ip')
+    if wired_ip and snapshot.get('plugged_in'):
         set_status(
             _('Connected to wired network (IP: $A)').replace('$A',wired_ip)
         )
@@ -149,21 +150,18 @@ def check_for_wired(wired_ip, set_status):
 
 
 @wrap_exceptions
-def check_for_wireless(iwconfig, wireless_ip, set_status):
+def check_for_wireless(snapshot, set_status):
     """ Determine if wireless is active, and if yes, set the status. """
+    wireless_ip = snapshot.get('wireless_ip')
     if not wireless_ip:
         return False
 
-    network = wireless.GetCurrentNetwork(iwconfig)
+    network = snapshot.get('essid')
     if not network:
         return False
 
     network = misc.to_unicode(network)
-    if daemon.GetSignalDisplayType() == 0:
-        strength = wireless.GetCurrentSignalStrength(iwconfig)
-    else:
-        strength = wireless.GetCurrentDBMStrength(iwconfig)
-
+    strength = snapshot.get('signal')
     if strength is None:
         return False
     strength = misc.to_unicode(daemon.FormatSignalForPrinting(strength))
@@ -179,18 +177,27 @@ def check_for_wireless(iwconfig, wireless_ip, set_status):
 # Mostly borrowed/stolen from wpa_cli, since I had no clue what all of those
 # DBUS interfaces do. :P
 # Whatever calls this must be exception-wrapped if it is run if the UI is up
-def gen_network_list():
-    """ Generate the list of networks. """
+def gen_network_list(wlessL=None):
+    """ Generate the list of networks.
+
+    If wlessL is given, it is the list of the NetLabels of the last
+    scan, which is used instead of fetching the scan again.
+
+    """
     wiredL = wired.GetWiredProfileList()
+    if wlessL is not None:
+        return (wiredL, wlessL)
     wlessL = []
+    networks = wireless.GetScanResults(NetLabel.PROPERTIES)
+    # Figure out which network is the active one only once, rather than
+    # once per network.
+    active_id = -1
+    if networks and wireless.GetCurrentSignalStrength("") != 0 and \
+       wireless.GetWirelessIP('') is not None:
+        active_id = wireless.GetCurrentNetworkID(wireless.GetIwconfig())
     # This one makes a list of NetLabels
-    for network_id in range(0, wireless.GetNumberOfNetworks()):
-        is_active = \
-            wireless.GetCurrentSignalStrength("") != 0 and \
-            wireless.GetCurrentNetworkID(wireless.GetIwconfig()) == network_id \
-            and wireless.GetWirelessIP('') is not None
-
-        label = NetLabel(network_id, is_active)
+    for network_id, network in enumerate(networks):
+        label = NetLabel(network_id, network_id == active_id, network)
         wlessL.append(label)
     return (wiredL, wlessL)
 
@@ -367,8 +374,12 @@ def gen_list_header():
 
 class NetLabel(urwid.WidgetWrap):
     """ Wireless network label. """
+    # Properties needed to draw the label, fetched in bulk.
+    PROPERTIES = ['quality', 'strength', 'essid', 'bssid', 'encryption',
+                  'encryption_method', 'mode', 'channel', 'handle']
+
     # pylint: disable-msg=W0231
-    def __init__(self, i, is_active):
+    def __init__(self, i, is_active, network):
         # Pick which strength measure to use based on what the daemon says
         # gap allocates more space to the first module
         if daemon.GetSignalDisplayType() == 0:
@@ -378,21 +389,22 @@ class NetLabel(urwid.WidgetWrap):
             strenstr = 'strength'
             gap = 7  # -XX dbm = 7
         self.id = i
+        self.is_active = is_active
+        self.network = network
         # All of that network property stuff
         self.stren = daemon.FormatSignalForPrinting(
-                str(wireless.GetWirelessProperty(self.id, strenstr)))
-        self.essid = wireless.GetWirelessProperty(self.id, 'essid')
-        self.bssid = wireless.GetWirelessProperty(self.id, 'bssid')
+                str(network.get(strenstr)))
+        self.essid = network.get('essid')
+        self.bssid = network.get('bssid')
+        self.handle = network.get('handle')
 
-        if wireless.GetWirelessProperty(self.id, 'encryption'):
-            self.encrypt = \
-                wireless.GetWirelessProperty(self.id, 'encryption_method')
+        if network.get('encryption'):
+            self.encrypt = network.get('encryption_method')
         else:
             self.encrypt = _('Unsecured')
 
-        self.mode = \
-            wireless.GetWirelessProperty(self.id, 'mode')  # Master, Ad-Hoc
-        self.channel = wireless.GetWirelessProperty(self.id, 'channel')
+        self.mode = network.get('mode')  # Master, Ad-Hoc
+        self.channel = network.get('channel')
         theString = '  %-*s %25s %9s %17s %6s %4s' % \
             (gap, self.stren, self.essid, self.encrypt, self.bssid, self.mode,
                 self.channel)
@@ -419,7 +431,30 @@ class NetLabel(urwid.WidgetWrap):
 
     def connect(self):
         """ Execute connection. """
-        wireless.ConnectWireless(self.id)
+        if self.handle:
+            wireless.ConnectWirelessByHandle(self.handle)
+        else:
+            wireless.ConnectWireless(self.id)
+
+    def update(self, i, changed):
+        """ Return the label for the network in a new scan.
+
+        The label is reused unless a displayed property changed.
+
+        Keyword arguments:
+        i -- the id of the network in the new scan
+        changed -- dict of the properties that changed since the
+                   previous scan
+
+        """
+        fields = dict([(prop, value) for prop, value in changed.iteritems()
+                       if prop in self.PROPERTIES])
+        if not fields:
+            self.id = i
+            return self
+        network = dict(self.network)
+        network.update(fields)
+        return NetLabel(i, self.is_active, network)
 
 
 class WiredComboBox(ComboBox):
@@ -703,6 +738,8 @@ class appGUI():
 
         self.wiredCB = urwid.Filler(WiredComboBox(wiredL))
         self.wlessLB = urwid.ListBox(wlessL)
+        # The NetLabels of the last scan, None if they need to be fetched.
+        self.wless_labels = None
         self.update_netlist(force_check=True, firstrun=True)
 
         # Keymappings proposed by nanotube in #wicd
@@ -780,7 +817,7 @@ class appGUI():
         if self.do_diag_lock:
             self.do_diag_lock = False
             return True
-        self.update_netlist(force_check=True)
+        self.update_netlist(force_check=True, after_scan=True)
         if not self.diag:
             self.frame.set_body(self.thePile)
         self.screen_locked = False
@@ -820,12 +857,30 @@ class appGUI():
                 #where = self.wlessLB.get_focus()[1]
         self.focusloc = [wlessorwired, where]
 
+    def remap_wireless_focus(self, wlessL):
+        """ Keep the focus on the same wireless network after a scan. """
+        where = self.focusloc[1]
+        if self.focusloc[0] != self.WLESS_IDX or where is None or \
+           self.wlessLB == self.no_wlan or not wlessL:
+            return
+        bssid = self.wlessLB.body[where].bssid
+        for pos, label in enumerate(wlessL):
+            if label.bssid == bssid:
+                self.focusloc[1] = pos
+                return
+        self.focusloc[1] = min(where, len(wlessL) - 1)
+
     # Be clunky until I get to a later stage of development.
     # Update the list of networks.  Usually called by DBus.
     @wrap_exceptions
     def update_netlist(self, state=None, x=None, force_check=False,
-      firstrun=False):
-        """ Update the list of networks. """
+      firstrun=False, after_scan=False):
+        """ Update the list of networks.
+
+        If after_scan is True, the wireless networks are taken from the
+        NetLabels dbus_scan_delta updated, if they are up to date.
+
+        """
         # Don't even try to do this if we are running a dialog
         if self.diag:
             return
@@ -838,7 +893,12 @@ class appGUI():
         if not state:
             state, trash = daemon.GetConnectionStatus()
         if force_check or self.prev_state != state:
-            wiredL, wlessL = gen_network_list()
+            if after_scan and not firstrun and self.wless_labels is not None:
+                wiredL, wlessL = gen_network_list(self.wless_labels)
+                self.remap_wireless_focus(wlessL)
+            else:
+                wiredL, wlessL = gen_network_list()
+                self.wless_labels = wlessL
 
             self.wiredCB.get_body().set_list(wiredL)
             self.wiredCB.get_body().build_combobox(self.frame, ui, 3)
@@ -894,9 +954,8 @@ class appGUI():
     @wrap_exceptions
     def update_status(self):
         """ Update the footer / statusbar. """
-        wired_connecting = wired.CheckIfWiredConnecting()
-        wireless_connecting = wireless.CheckIfWirelessConnecting()
-        self.connecting = wired_connecting or wireless_connecting
+        snapshot = daemon.GetLinkSnapshot()
+        self.connecting = bool(snapshot.get('connecting'))
 
         fast = not daemon.NeedsExternalCalls()
         if self.connecting:
@@ -905,14 +964,9 @@ class appGUI():
                 gobject.timeout_add(250, self.set_connecting_status, fast)
             return True
         else:
-            if check_for_wired(wired.GetWiredIP(''), self.set_status):
+            if check_for_wired(snapshot, self.set_status):
                 return True
-            if not fast:
-                iwconfig = wireless.GetIwconfig()
-            else:
-                iwconfig = ''
-            if check_for_wireless(iwconfig, wireless.GetWirelessIP(""),
-                    self.set_status):
+            if check_for_wireless(snapshot, self.set_status):
                 return True
             else:
                 self.set_status(_('Not connected'))
@@ -973,6 +1027,39 @@ class appGUI():
         self.unlock_screen()
         self.scanning = False
 
+    @wrap_exceptions
+    def dbus_scan_delta(self, added, removed, changed, order):
+        """ Apply the differences from the previous scan to the NetLabels.
+
+        Only the labels of networks that were added or whose displayed
+        properties changed are built again.  The list is shown when
+        the scan is over.
+
+        """
+        if self.wless_labels is None:
+            return
+        labels = dict([(str(label.bssid), label)
+                       for label in self.wless_labels])
+        new_networks = dict([(str(network.get('bssid')), network)
+                             for network in added])
+        if set(removed) - set(labels) or set(changed) - set(labels):
+            self.wless_labels = None
+            return
+        for bssid in removed:
+            del labels[bssid]
+        if set(order) != set(labels) | set(new_networks):
+            self.wless_labels = None
+            return
+        wlessL = []
+        for network_id, bssid in enumerate(order):
+            if bssid in new_networks:
+                label = NetLabel(network_id, False, new_networks[bssid])
+            else:
+                label = labels[bssid].update(network_id,
+                                             changed.get(bssid, {}))
+            wlessL.append(label)
+        self.wless_labels = wlessL
+
     def dbus_scan_started(self):
         """ Handle DBus scan start. """
         self.scanning = True
@@ -1039,7 +1126,7 @@ class appGUI():
                         # wless list only other option, if it is around
                         if self.wlessLB != self.no_wlan:
                             wid, pos = self.thePile.get_focus().get_focus()
-                            self.connect("wireless", pos)
+                            self.connect("wireless", pos, wid)
             if "esc" in keys:
                 # Force disconnect here if connection in progress
                 if self.connecting:
@@ -1157,7 +1244,10 @@ class appGUI():
     def connect(self, nettype, networkid, networkentry=None):
         """ Initiates the connection process in the daemon. """
         if nettype == "wireless":
-            wireless.ConnectWireless(networkid)
+            if networkentry is not None:
+                networkentry.connect()
+            else:
+                wireless.ConnectWireless(networkid)
         elif nettype == "wired":
             wired.ConnectWired()
         self.update_status()
@@ -1224,6 +1314,8 @@ def run():
                             'org.wicd.daemon.wireless')
     bus.add_signal_receiver(app.dbus_scan_started, 'SendStartScanSignal',
                             'org.wicd.daemon.wireless')
+    bus.add_signal_receiver(app.dbus_scan_delta, 'ScanDelta',
+                            'org.wicd.daemon.wireless')
     # I've left this commented out many times.
     bus.add_signal_receiver(app.update_netlist, 'StatusChanged',
                             'org.wicd.daemon')
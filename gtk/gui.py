@@ -162,10 +162,6 @@ class WiredProfileChooser:
         dialog.destroy()
 
 
-def get_wireless_prop(net_id, prop):
-    """ Get wireless property. """
-    return wireless.GetWirelessProperty(net_id, prop)
-
 class appGui(object):
     """ The main wicd GUI class. """
     def __init__(self, standalone=False, tray=None):
@@ -246,6 +242,11 @@ class appGui(object):
         self.prev_state = None
         self.update_cb = None
         self._wired_showing = False
+        # The properties of the networks of the last scan, and the
+        # entries showing them, by BSSID.  wireless_entries is None
+        # when the list has to be rebuilt from scratch.
+        self.wireless_networks = {}
+        self.wireless_entries = None
         self.network_list.set_sensitive(False)
         label = gtk.Label("%s..." % _('Scanning'))
         self.network_list.pack_start(label)
@@ -258,6 +259,8 @@ class appGui(object):
                         'org.wicd.daemon.wireless')
         bus.add_signal_receiver(self.dbus_scan_started, 'SendStartScanSignal',
                         'org.wicd.daemon.wireless')
+        bus.add_signal_receiver(self.dbus_scan_delta, 'ScanDelta',
+                        'org.wicd.daemon.wireless')
         bus.add_signal_receiver(self.update_connect_buttons, 'StatusChanged',
                         'org.wicd.daemon')
         bus.add_signal_receiver(self.handle_connection_results,
@@ -632,7 +635,15 @@ class appGui(object):
         """
         if not DBUS_AVAIL:
             return
-        gobject.idle_add(self.refresh_networks, None, False, None)
+        gobject.idle_add(self._scan_finished)
+
+    def _scan_finished(self):
+        """ Brings the network list up to date after a scan. """
+        if self.wireless_entries is None:
+            self.refresh_networks(None, False, None)
+        else:
+            self.network_list.set_sensitive(True)
+            self.refreshing = False
 
     def dbus_scan_started(self):
         """ Called when a wireless scan starts. """
@@ -640,6 +651,110 @@ class appGui(object):
             return
         self.network_list.set_sensitive(False)
 
+    def dbus_scan_delta(self, added, removed, changed, order):
+        """ Called with the differences between the last two scans. """
+        if not DBUS_AVAIL:
+            return
+        gobject.idle_add(self.update_networks, added, removed, changed, order)
+
+    def update_networks(self, added, removed, changed, order):
+        """ Updates the network list with the changes of a scan.
+
+        Only the entries of the networks that were added, removed or
+        changed are touched.  If the list doesn't match the previous
+        scan, it is rebuilt once the scan is over.
+
+        """
+        if self.wireless_entries is None:
+            return
+        networks = self.wireless_networks
+        if set(removed) - set(networks) or set(changed) - set(networks):
+            self.wireless_entries = None
+            return
+        for bssid in removed:
+            del networks[bssid]
+        for network in added:
+            networks[str(network.get('bssid'))] = \
+                self._filter_props(network)
+        updated = {}
+        for bssid, fields in changed.iteritems():
+            fields = self._filter_props(fields)
+            if fields:
+                networks[bssid].update(fields)
+                updated[bssid] = fields
+        if not order or set(order) != set(networks):
+            self.wireless_entries = None
+            return
+        self._sync_wireless_entries(order, updated)
+
+    def _filter_props(self, network):
+        """ Keeps only the properties wireless entries use. """
+        return dict([(prop, value) for prop, value in network.iteritems()
+                     if prop in WirelessNetworkEntry.PROPERTIES])
+
+    def _sync_wireless_entries(self, order, updated):
+        """ Makes the wireless entries match the networks of a scan.
+
+        Keyword arguments:
+        order -- the BSSIDs of the networks, in network id order
+        updated -- dict of the properties that changed for each BSSID
+
+        """
+        skip_never_connect = not daemon.GetShowNeverConnect()
+        entries = self.wireless_entries
+        shown = []
+        new_entries = []
+        for x, bssid in enumerate(order):
+            network = self.wireless_networks[bssid]
+            if skip_never_connect and misc.to_bool(network.get('never')):
+                continue
+            shown.append(bssid)
+            if bssid in entries:
+                entries[bssid][1].update(x, updated.get(bssid))
+                continue
+            sep = gtk.HSeparator()
+            self.network_list.pack_start(sep, padding=10, fill=False,
+                                         expand=False)
+            tempnet = WirelessNetworkEntry(x, dict(network))
+            self.network_list.pack_start(tempnet, False, False)
+            tempnet.connect_button.connect("clicked",
+                                           self._wireless_entry_clicked,
+                                           self.connect, tempnet)
+            tempnet.disconnect_button.connect("clicked",
+                                              self._wireless_entry_clicked,
+                                              self.disconnect, tempnet)
+            tempnet.advanced_button.connect("clicked",
+                                            self._wireless_entry_clicked,
+                                            self.edit_advanced, tempnet)
+            entries[bssid] = (sep, tempnet)
+            new_entries.append(tempnet)
+
+        for bssid in set(entries) - set(shown):
+            for widget in entries.pop(bssid):
+                self.network_list.remove(widget)
+                widget.destroy()
+
+        # Every entry comes after its separator.  The first separator
+        # is only needed to set the list apart from the wired network.
+        for pos, bssid in enumerate(shown):
+            sep, entry = entries[bssid]
+            self.network_list.reorder_child(sep, 2 * pos)
+            self.network_list.reorder_child(entry, 2 * pos + 1)
+            if pos or self._wired_showing:
+                sep.show()
+            else:
+                sep.hide()
+
+        if new_entries:
+            state, x = daemon.GetConnectionStatus()
+            apbssid = wireless.GetApBssid()
+            for entry in new_entries:
+                entry.update_connect_button(state, apbssid)
+
+    def _wireless_entry_clicked(self, widget, action, entry):
+        """ Runs action for a wireless entry and its current network id. """
+        action(widget, "wireless", entry.networkID, entry)
+
     def _remove_items_from_vbox(self, vbox):
         """ Remove items fro a VBox. """
         for z in vbox:
@@ -656,6 +771,7 @@ class appGui(object):
         # Remove stuff already in there.
         self._remove_items_from_vbox(self.wired_network_box)
         self._remove_items_from_vbox(self.network_list)
+        self.wireless_entries = None
         label = gtk.Label("%s..." % _('Scanning'))
         self.network_list.pack_start(label)
         self.network_list.show_all()
@@ -697,37 +813,20 @@ class appGui(object):
         print "refreshing..."
         self.network_list.set_sensitive(False)
         self._remove_items_from_vbox(self.network_list)
+        self.wireless_entries = None
         self.wait_for_events()
-        printLine = False  # We don't print a separator by default.
-        if self._wired_showing:
-            printLine = True
-        num_networks = wireless.GetNumberOfNetworks()
+        networks = wireless.GetScanResults(WirelessNetworkEntry.PROPERTIES)
         instruct_label = self.wTree.get_object("label_instructions")
-        if num_networks > 0:
-            skip_never_connect = not daemon.GetShowNeverConnect()
+        if networks:
             instruct_label.show()
-            for x in xrange(0, num_networks):
-                if skip_never_connect and \
-                  misc.to_bool(get_wireless_prop(x, 'never')):
-                    continue
-                if printLine:
-                    sep = gtk.HSeparator()
-                    self.network_list.pack_start(sep, padding=10, fill=False,
-                                                 expand=False)
-                    sep.show()
-                else:
-                    printLine = True
-                tempnet = WirelessNetworkEntry(x)
-                self.network_list.pack_start(tempnet, False, False)
-                tempnet.connect_button.connect("clicked",
-                                               self.connect, "wireless", x,
-                                               tempnet)
-                tempnet.disconnect_button.connect("clicked",
-                                                  self.disconnect, "wireless",
-                                                  x, tempnet)
-                tempnet.advanced_button.connect("clicked",
-                                                self.edit_advanced, "wireless",
-                                                x, tempnet)
+            self.wireless_networks = {}
+            order = []
+            for network in networks:
+                bssid = str(network.get('bssid'))
+                self.wireless_networks[bssid] = dict(network)
+                order.append(bssid)
+            self.wireless_entries = {}
+            self._sync_wireless_entries(order, {})
         else:
             instruct_label.hide()
             if wireless.GetKillSwitchEnabled():
@@ -875,8 +974,13 @@ class appGui(object):
                 self.edit_advanced(None, nettype, networkid, networkentry)
                 return False
             setup_interface_for_connection()
-            wireless.ConnectWireless(networkid, reply_handler=handler,
-                                     error_handler=handler)
+            if networkentry.handle:
+                wireless.ConnectWirelessByHandle(networkentry.handle,
+                                                 reply_handler=handler,
+                                                 error_handler=handler)
+            else:
+                wireless.ConnectWireless(networkid, reply_handler=handler,
+                                         error_handler=handler)
         elif nettype == "wired":
             setup_interface_for_connection()
             wired.ConnectWired(reply_handler=handler, error_handler=handler)
@@ -383,7 +383,7 @@ class WiredSettingsDialog(AdvancedSettingsDialog):
         self.chkbox_encryption.set_active(
             bool(wired.GetWiredProperty('encryption_enabled')))
         self.combo_encryption.set_sensitive(False)
-        self.encrypt_types = misc.LoadEncryptionMethods(wired=True)
+        self.encrypt_types = wired.GetEncryptionMethods()
 
         # Build the encryption menu
         for x, enc_type in enumerate(self.encrypt_types):
@@ -541,7 +541,7 @@ class WirelessSettingsDialog(AdvancedSettingsDialog):
         self.toggle_encryption()
         self.chkbox_encryption.set_active(False)
         self.combo_encryption.set_sensitive(False)
-        self.encrypt_types = misc.LoadEncryptionMethods()
+        self.encrypt_types = wireless.GetEncryptionMethods()
 
         information_button = gtk.Button(stock=gtk.STOCK_INFO)
         self.button_hbox.pack_start(information_button, False, False)
@@ -995,17 +995,32 @@ class WiredNetworkEntry(NetworkEntry):
 
 class WirelessNetworkEntry(NetworkEntry):
     """ Wireless network entry. """
-    def __init__(self, networkID):
-        """ Build the wireless network entry. """
+    # Properties the entry needs to display itself, used to fetch
+    # the scan results in bulk.
+    PROPERTIES = ['essid', 'bssid', 'quality', 'strength', 'encryption',
+                  'encryption_method', 'channel', 'automatic', 'never',
+                  'handle']
+
+    def __init__(self, networkID, network=None):
+        """ Build the wireless network entry.
+
+        Keyword arguments:
+        networkID -- the id of the network in the last scan
+        network -- dict of the network properties, as returned by
+                   GetScanResults.  If not given, the properties are
+                   fetched one at a time from the daemon.
+
+        """
         NetworkEntry.__init__(self)
 
         self.networkID = networkID
+        self.network = network
+        self.handle = self._get_prop('handle')
         self.image.set_padding(0, 0)
         self.image.set_alignment(.5, .5)
         self.image.set_size_request(60, -1)
         self.image.show()
-        self.essid = noneToBlankString(
-            wireless.GetWirelessProperty(networkID, "essid"))
+        self.essid = noneToBlankString(self._get_prop("essid"))
         self.lbl_strength = GreyLabel()
         self.lbl_encryption = GreyLabel()
         self.lbl_channel = GreyLabel()
@@ -1017,34 +1032,27 @@ class WirelessNetworkEntry(NetworkEntry):
             _('Never connect to this network'))
 
         self.set_signal_strength(
-            wireless.GetWirelessProperty(networkID, 'quality'),
-            wireless.GetWirelessProperty(networkID, 'strength')
+            self._get_prop('quality'),
+            self._get_prop('strength')
         )
         self.set_encryption(
-            wireless.GetWirelessProperty(networkID, 'encryption'),
-            wireless.GetWirelessProperty(networkID, 'encryption_method')
+            self._get_prop('encryption'),
+            self._get_prop('encryption_method')
         )
-        self.set_channel(wireless.GetWirelessProperty(networkID, 'channel'))
+        self.set_channel(self._get_prop('channel'))
         self.name_label.set_use_markup(True)
-        self.name_label.set_label(
-            "<b>%s</b>    %s    %s    %s" % (
-                self._escape(self.essid),
-                self.lbl_strength.get_label(),
-                self.lbl_encryption.get_label(),
-                self.lbl_channel.get_label(),
-            )
-        )
+        self._set_name_label()
         # Add the wireless network specific parts to the NetworkEntry
         # VBox objects.
         self.vbox_top.pack_start(self.chkbox_autoconnect, False, False)
         self.vbox_top.pack_start(self.chkbox_neverconnect, False, False)
 
-        if to_bool(self.format_entry(networkID, "automatic")):
+        if to_bool(noneToBlankString(self._get_prop("automatic"))):
             self.chkbox_autoconnect.set_active(True)
         else:
             self.chkbox_autoconnect.set_active(False)
 
-        if to_bool(self.format_entry(networkID, "never")):
+        if to_bool(noneToBlankString(self._get_prop("never"))):
             self.chkbox_autoconnect.set_sensitive(False)
             self.connect_button.set_sensitive(False)
             self.chkbox_neverconnect.set_active(True)
@@ -1052,14 +1060,79 @@ class WirelessNetworkEntry(NetworkEntry):
             self.chkbox_neverconnect.set_active(False)
 
         # Connect signals.
-        self.chkbox_autoconnect.connect("toggled", self.update_autoconnect)
-        self.chkbox_neverconnect.connect("toggled", self.update_neverconnect)
+        self.autoconnect_id = self.chkbox_autoconnect.connect(
+            "toggled", self.update_autoconnect)
+        self.neverconnect_id = self.chkbox_neverconnect.connect(
+            "toggled", self.update_neverconnect)
 
         # Show everything
         self.show_all()
         self.advanced_dialog = WirelessSettingsDialog(networkID)
         self.wifides = self.connect("destroy", self.destroy_called)
 
+    def _get_prop(self, prop):
+        """ Returns a property of the network, preferring prefetched data. """
+        if self.network is not None:
+            return self.network.get(prop)
+        return wireless.GetWirelessProperty(self.networkID, prop)
+
+    def _set_name_label(self):
+        """ Sets the label showing the essid, strength, encryption... """
+        self.name_label.set_label(
+            "<b>%s</b>    %s    %s    %s" % (
+                self._escape(self.essid),
+                self.lbl_strength.get_label(),
+                self.lbl_encryption.get_label(),
+                self.lbl_channel.get_label(),
+            )
+        )
+
+    def update(self, networkID, changed):
+        """ Update the entry with the results of a new scan.
+
+        Keyword arguments:
+        networkID -- the id of the network in the new scan
+        changed -- dict of the properties that changed since the entry
+                   was last updated
+
+        """
+        self.networkID = networkID
+        self.advanced_dialog.networkID = networkID
+        if not changed:
+            return
+        if self.network is None:
+            self.network = {}
+        self.network.update(changed)
+        if 'essid' in changed:
+            self.essid = noneToBlankString(self._get_prop('essid'))
+        if 'quality' in changed or 'strength' in changed:
+            self.set_signal_strength(
+                self._get_prop('quality'),
+                self._get_prop('strength')
+            )
+        if 'encryption' in changed or 'encryption_method' in changed:
+            self.set_encryption(
+                self._get_prop('encryption'),
+                self._get_prop('encryption_method')
+            )
+        if 'channel' in changed:
+            self.set_channel(self._get_prop('channel'))
+        self._set_name_label()
+
+        # The profile was changed by someone else, so don't save it again.
+        if 'automatic' in changed:
+            self.chkbox_autoconnect.handler_block(self.autoconnect_id)
+            self.chkbox_autoconnect.set_active(
+                to_bool(noneToBlankString(self._get_prop("automatic"))))
+            self.chkbox_autoconnect.handler_unblock(self.autoconnect_id)
+        if 'never' in changed:
+            never = to_bool(noneToBlankString(self._get_prop("never")))
+            self.chkbox_neverconnect.handler_block(self.neverconnect_id)
+            self.chkbox_neverconnect.set_active(never)
+            self.chkbox_neverconnect.handler_unblock(self.neverconnect_id)
+            self.chkbox_autoconnect.set_sensitive(not never)
+            self.connect_button.set_sensitive(not never)
+
     def _escape(self, val):
         """ Escapes special characters so they're displayed correctly. """
         return val.replace("&", "&amp;"). \
@@ -1112,7 +1185,7 @@ class WirelessNetworkEntry(NetworkEntry):
         if not apbssid:
             apbssid = wireless.GetApBssid()
         if state == misc.WIRELESS and \
-           apbssid == wireless.GetWirelessProperty(self.networkID, "bssid"):
+           apbssid == self._get_prop("bssid"):
             self.disconnect_button.show()
             self.connect_button.hide()
         else:
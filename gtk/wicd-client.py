@@ -688,12 +688,14 @@ TX:'''))
             return (rx_rate, tx_rate)
 
         def _add_item_to_menu(self, net_menu, lbl, type_, n_id, is_connecting,
-                              is_active):
+                              is_active, network=None, use_dbm=None):
             """ Add an item to the network list submenu. """
-            def network_selected(widget, net_type, net_id):
+            def network_selected(widget, net_type, net_id, network):
                 """ Callback method for a menu item selection. """
                 if net_type == "__wired__":
                     wired.ConnectWired()
+                elif network and network.get('handle'):
+                    wireless.ConnectWirelessByHandle(network.get('handle'))
                 else:
                     wireless.ConnectWireless(net_id)
 
@@ -704,11 +706,11 @@ TX:'''))
                 image.set_from_icon_name("network-wired",
                     gtk.ICON_SIZE_SMALL_TOOLBAR)
             else:
-                image.set_from_icon_name(self._get_img(n_id),
+                image.set_from_icon_name(self._get_img(n_id, network, use_dbm),
                     gtk.ICON_SIZE_SMALL_TOOLBAR)
             item.set_image(image)
             del image
-            item.connect("activate", network_selected, type_, n_id)
+            item.connect("activate", network_selected, type_, n_id, network)
             net_menu.append(item)
             item.show()
             if is_connecting:
@@ -716,20 +718,23 @@ TX:'''))
             del item
 
         @catchdbus
-        def _get_img(self, net_id):
+        def _get_img(self, net_id, network=None, use_dbm=None):
             """ Determines which image to use for the wireless entries. """
             def fix_strength(val, default):
                 """ Assigns given strength to a default value if needed. """
                 return val and int(val) or default
 
             def get_prop(prop):
+                if network is not None:
+                    return network.get(prop)
                 return wireless.GetWirelessProperty(net_id, prop)
 
             strength = fix_strength(get_prop("quality"), -1)
             dbm_strength = fix_strength(get_prop('strength'), -100)
 
-            if daemon.GetWPADriver() == 'ralink legacy' or \
-               daemon.GetSignalDisplayType() == 1:
+            if use_dbm is None:
+                use_dbm = self._use_dbm_strength()
+            if use_dbm:
                 if dbm_strength >= -60:
                     signal_img = 'signal-100'
                 elif dbm_strength >= -70:
@@ -749,6 +754,11 @@ TX:'''))
                     signal_img = 'signal-25'
             return signal_img
 
+        def _use_dbm_strength(self):
+            """ Returns True if signal strength should be shown in dBm. """
+            return (daemon.GetWPADriver() == 'ralink legacy' or
+                    daemon.GetSignalDisplayType() == 1)
+
         @catchdbus
         def on_net_menu_activate(self, item):
             """ Trigger a background scan to populate the network menu.
@@ -782,9 +792,6 @@ TX:'''))
         @catchdbus
         def populate_network_menu(self, data=None):
             """ Populates the network list submenu. """
-            def get_prop(net_id, prop):
-                return wireless.GetWirelessProperty(net_id, prop)
-
             net_menuitem = self.manager.get_widget("/Menubar/Menu/Connect/")
             submenu = net_menuitem.get_submenu()
             self._clear_menu(submenu)
@@ -793,7 +800,9 @@ TX:'''))
                 return
 
             is_connecting = daemon.CheckIfConnecting()
-            num_networks = wireless.GetNumberOfNetworks()
+            networks = wireless.GetScanResults(['essid', 'quality',
+                                                'strength', 'never',
+                                                'handle'])
             [status, info] = daemon.GetConnectionStatus()
 
             if daemon.GetAlwaysShowWiredInterface() or \
@@ -808,19 +817,21 @@ TX:'''))
                 submenu.append(sep)
                 sep.show()
 
-            if num_networks > 0:
+            if networks:
                 skip_never_connect = not daemon.GetShowNeverConnect()
-                for x in xrange(0, num_networks):
+                use_dbm = self._use_dbm_strength()
+                for x, network in enumerate(networks):
                     if skip_never_connect and \
-                      misc.to_bool(get_prop(x,"never")):
+                      misc.to_bool(network.get("never")):
                         continue
-                    essid = get_prop(x, "essid")
+                    essid = network.get("essid")
                     if status == misc.WIRELESS and info[1] == essid:
                         is_active = True
                     else:
                         is_active = False
                     self._add_item_to_menu(submenu, essid, "wifi", x,
-                                           is_connecting, is_active)
+                                           is_connecting, is_active, network,
+                                           use_dbm)
             else:
                 no_nets_item = gtk.MenuItem(_('No wireless networks found.'))
                 no_nets_item.set_sensitive(False)
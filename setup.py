@@ -442,7 +442,8 @@ class install(_install):
             (wpath.sbin,  ['scripts/wicd']),
             (wpath.daemon, ['wicd/monitor.py', 'wicd/wicd-daemon.py',
                         'wicd/suspend.py', 'wicd/autoconnect.py']),
-            (wpath.backends, ['wicd/backends/be-external.py', 'wicd/backends/be-ioctl.py']),
+            (wpath.backends, ['wicd/backends/be-external.py', 'wicd/backends/be-ioctl.py',
+                              'wicd/backends/be-netlink.py']),
             (wpath.scripts, [empty_file]),
             (wpath.predisconnectscripts, [empty_file]),
             (wpath.postdisconnectscripts, [empty_file]),
@@ -675,7 +676,9 @@ class uninstall(Command):
 py_modules = ['wicd.networking','wicd.misc','wicd.wnettools',
               'wicd.wpath','wicd.dbusmanager',
               'wicd.logfile','wicd.backend','wicd.configmanager',
-              'wicd.translations']
+              'wicd.translations', 'wicd.netlink',
+              'wicd.nl80211', 'wicd.scanstore', 'wicd.profilestore',
+              'wicd.wpasupplicant', 'wicd.enctemplates']
 
 setup(
     cmdclass = {
@@ -8,4 +8,31 @@ def run_tests():
     import testmisc
     test_suite.addTest(testmisc.suite())
 
+    import testnetlink
+    test_suite.addTest(testnetlink.suite())
+
+    import testnl80211
+    test_suite.addTest(testnl80211.suite())
+
+    import testiwlist
+    test_suite.addTest(testiwlist.suite())
+
+    import testscanstore
+    test_suite.addTest(testscanstore.suite())
+
+    import testconfigmanager
+    test_suite.addTest(testconfigmanager.suite())
+
+    import testprofilestore
+    test_suite.addTest(testprofilestore.suite())
+
+    import testnetworking
+    test_suite.addTest(testnetworking.suite())
+
+    import testwpasupplicant
+    test_suite.addTest(testwpasupplicant.suite())
+
+    import testenctemplates
+    test_suite.addTest(testenctemplates.suite())
+
     unittest.TextTestRunner(verbosity=2).run(test_suite)
@@ -0,0 +1,75 @@
+#!/usr/bin/python
+
+""" Compare the time spent configuring an interface with each backend.
+
+Runs the interface configuration steps of a static IP connection (the
+same calls ConnectThread makes) with be-external and be-netlink, and
+prints the average wall time per connect.
+
+This changes the addresses and routes of the interface, so it must be
+run as root, preferably on a dummy interface:
+
+    ip link add wicdbench type dummy
+    python tests/benchbackends.py wicdbench
+    ip link del wicdbench
+
+"""
+
+import os
+import sys
+import time
+
+BACKENDS = ['external', 'netlink']
+RUNS = 20
+
+def load_backend(name):
+    """ Import a backend module straight from the source tree. """
+    backend_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               os.pardir, 'wicd', 'backends')
+    if backend_dir not in sys.path:
+        sys.path.insert(0, backend_dir)
+    return __import__('be-' + name)
+
+def connect(iface):
+    """ Configure the interface like a static IP connect would. """
+    iface.SetAddress('0.0.0.0')
+    iface.FlushRoutes()
+    iface.Down()
+    iface.Up()
+    iface.SetAddress('10.254.0.2', '255.255.255.0')
+    iface.SetDefaultRoute('10.254.0.1')
+    iface.GetIP()
+    iface.IsUp()
+
+def disconnect(iface):
+    """ Undo what connect() did. """
+    iface.DelDefaultRoute()
+    iface.SetAddress('0.0.0.0')
+    iface.FlushRoutes()
+
+def bench(name, ifname, runs=RUNS):
+    """ Returns the average time of a connect with the given backend. """
+    backend = load_backend(name)
+    iface = backend.WiredInterface(ifname)
+    total = 0.0
+    for i in xrange(runs):
+        start = time.time()
+        connect(iface)
+        total += time.time() - start
+        disconnect(iface)
+    return total / runs
+
+def main(argv):
+    if len(argv) != 2:
+        print 'Usage: %s <interface>' % argv[0]
+        return 1
+    if os.getuid() != 0:
+        print 'This benchmark needs to be run as root.'
+        return 1
+    for name in BACKENDS:
+        print '%-10s %8.2f ms per connect' % (name,
+                                              bench(name, argv[1]) * 1000)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
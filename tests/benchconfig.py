@@ -0,0 +1,132 @@
+#!/usr/bin/python
+
+""" Benchmark reading options from a large wireless-settings.conf.
+
+Compares get_option with the implementation wicd used before values
+were cached, which converted the value on every call.
+
+    python tests/benchconfig.py [sections]
+
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+from ConfigParser import RawConfigParser
+
+from wicd.misc import Noneify, to_unicode
+from wicd.configmanager import ConfigManager
+from dbus import Int32
+
+SECTIONS = 1000
+
+PROFILE = """[00:16:%02X:%02X:%02X:%02X]
+bssid = 00:16:%02X:%02X:%02X:%02X
+essid = network %d
+hidden = False
+channel = %d
+mode = Master
+enctype = wpa-psk
+encryption = True
+encryption_method = WPA2
+key = `'` passphrase %d `'`
+automatic = %s
+never = False
+ip = None
+netmask = None
+gateway = None
+use_static_dns = False
+use_global_dns = False
+dns_domain = None
+search_domain = None
+dns1 = None
+dns2 = None
+dns3 = None
+use_settings_globally = False
+dhcphostname = host%d
+bitrate = auto
+allow_lower_bitrates = True
+beforescript = None
+afterscript = None
+predisconnectscript = None
+postdisconnectscript = None
+
+"""
+
+def make_wireless_settings(path, sections=SECTIONS):
+    """ Write a wireless-settings.conf with the given number of profiles. """
+    conf = open(path, 'w')
+    for n in xrange(sections):
+        mac = (n >> 24, (n >> 16) & 255, (n >> 8) & 255, n & 255)
+        conf.write(PROFILE % (mac + mac + (n, n % 13 + 1, n, n % 2 == 0, n)))
+    conf.close()
+
+def legacy_get_option(config, section, option, default="__None__"):
+    """ ConfigManager.get_option as it was before values were cached. """
+    if not config.has_section(section):
+        if default != "__None__":
+            config.add_section(section)
+        else:
+            return None
+
+    if config.has_option(section, option):
+        ret = RawConfigParser.get(config, section, option)
+        if (isinstance(ret, basestring) and ret.startswith(config.mrk_ws)
+            and ret.endswith(config.mrk_ws)):
+            ret = ret[3:-3]
+        ret = to_unicode(ret)
+    else:
+        if default != "__None__":
+            config.set(section, option, str(default), write=True)
+            ret = default
+        else:
+            ret = None
+
+    try:
+        if not ret.startswith('0') or len(ret) == 1:
+            ret = int(ret)
+    except (ValueError, TypeError, AttributeError):
+        ret = Noneify(ret)
+    if isinstance(ret, (int, long)):
+        try:
+            Int32(ret)
+        except OverflowError:
+            ret = str(ret)
+    return to_unicode(ret)
+
+def bench(config, get):
+    """ Returns the number of get_option calls per second. """
+    sections = config.sections()
+    options = config.options(sections[0])
+    calls = 0
+    start = time.time()
+    for section in sections:
+        for option in options:
+            get(config, section, option)
+        calls += len(options)
+    return calls / (time.time() - start)
+
+def main(argv):
+    sections = SECTIONS
+    if len(argv) > 1:
+        sections = int(argv[1])
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'wireless-settings.conf')
+        make_wireless_settings(path, sections)
+        start = time.time()
+        config = ConfigManager(path)
+        print 'load: %.1f ms for %d sections' % ((time.time() - start) * 1000,
+                                                 sections)
+        print 'uncached get_option: %10.0f ops/sec' % \
+            bench(config, legacy_get_option)
+        print 'cached get_option:   %10.0f ops/sec' % \
+            bench(config, ConfigManager.get_option)
+    finally:
+        shutil.rmtree(tmpdir)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,91 @@
+#!/usr/bin/python
+
+""" Measure how long GetConnectionStatus takes while the daemon scans.
+
+Needs a running wicd daemon with a wireless interface.  GetConnectionStatus
+is called repeatedly, first while the daemon is idle, then while a
+Scan(sync=True) requested by this script is in progress, and the latency
+of both rounds is printed.  With the slow backend calls running on the
+daemon's worker pool, the two should be about the same.
+
+    python tests/benchdbus.py [rounds]
+
+"""
+
+import sys
+import time
+import gobject
+
+from wicd import dbusmanager
+
+ROUNDS = 3
+# How often GetConnectionStatus is called, in milliseconds.
+INTERVAL = 20
+IDLE_SAMPLES = 100
+
+def timed_status(daemon):
+    """ Returns how long GetConnectionStatus took in milliseconds. """
+    start = time.time()
+    daemon.GetConnectionStatus()
+    return (time.time() - start) * 1000
+
+def idle_latency(daemon):
+    """ Returns the latencies of GetConnectionStatus with nothing else
+    going on. """
+    times = []
+    for n in xrange(IDLE_SAMPLES):
+        times.append(timed_status(daemon))
+        time.sleep(INTERVAL / 1000.0)
+    return times
+
+def scan_latency(daemon, wireless):
+    """ Returns the latencies of GetConnectionStatus during a sync scan,
+    and how long the scan took in milliseconds. """
+    loop = gobject.MainLoop()
+    times = []
+    result = {}
+
+    def sample():
+        times.append(timed_status(daemon))
+        return 'scan' not in result
+
+    def done(*args):
+        result['scan'] = (time.time() - start) * 1000
+        loop.quit()
+
+    def failed(e):
+        print 'Scan failed: %s' % e
+        done()
+
+    start = time.time()
+    wireless.Scan(True, reply_handler=done, error_handler=failed,
+                  timeout=120)
+    gobject.timeout_add(INTERVAL, sample)
+    loop.run()
+    return times, result['scan']
+
+def report(label, times):
+    """ Prints the minimum, average, 95th percentile and maximum. """
+    times = sorted(times)
+    print '%-8s %4d calls  min %7.2f  avg %7.2f  p95 %7.2f  max %7.2f ms' % \
+        (label, len(times), times[0], sum(times) / len(times),
+         times[int(len(times) * 0.95)], times[-1])
+
+def main(argv):
+    rounds = ROUNDS
+    if len(argv) > 1:
+        rounds = int(argv[1])
+    daemon = dbusmanager.get_interface('daemon')
+    wireless = dbusmanager.get_interface('wireless')
+    report('idle', idle_latency(daemon))
+    for n in xrange(rounds):
+        times, scan_time = scan_latency(daemon, wireless)
+        if not times:
+            print 'The scan finished before GetConnectionStatus was called.'
+            continue
+        report('scanning', times)
+        print '%-8s took %.0f ms' % ('scan', scan_time)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
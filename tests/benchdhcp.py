@@ -0,0 +1,116 @@
+#!/usr/bin/python
+
+""" Benchmark getting a DHCP lease with and without the cached lease.
+
+Needs root, iproute2 with network namespace support, dnsmasq and one
+of the DHCP clients wicd supports.  A veth pair is created, with one
+end moved to a network namespace where dnsmasq serves as the DHCP
+server, and StartDHCP is timed on the other end, once per round with
+a new lease key, which makes the client discover a server, and once
+with the same key, which makes it ask for the lease it got in the
+previous round.
+
+    python tests/benchdhcp.py [rounds]
+
+"""
+
+import os
+import sys
+import time
+import signal
+import shutil
+import tempfile
+import subprocess
+
+from wicd import misc
+from wicd import wnettools
+
+NAMESPACE = 'wicdbench'
+IFACE = 'wicdbench0'
+PEER = 'wicdbench1'
+ROUNDS = 5
+
+def run(*cmd):
+    """ Runs a command, raising an error if it fails. """
+    subprocess.check_call(list(cmd))
+
+def setup(tmpdir):
+    """ Creates the veth pair and starts dnsmasq on the namespace end.
+
+    Returns:
+    The dnsmasq process.
+
+    """
+    run('ip', 'netns', 'add', NAMESPACE)
+    run('ip', 'link', 'add', IFACE, 'type', 'veth', 'peer', 'name', PEER)
+    run('ip', 'link', 'set', PEER, 'netns', NAMESPACE)
+    run('ip', 'netns', 'exec', NAMESPACE, 'ip', 'addr', 'add',
+        '10.199.0.1/24', 'dev', PEER)
+    run('ip', 'netns', 'exec', NAMESPACE, 'ip', 'link', 'set', PEER, 'up')
+    run('ip', 'link', 'set', IFACE, 'up')
+    return subprocess.Popen(['ip', 'netns', 'exec', NAMESPACE, 'dnsmasq',
+                             '--keep-in-foreground', '--conf-file=/dev/null',
+                             '--port=0', '--bind-interfaces',
+                             '--interface=%s' % PEER,
+                             '--dhcp-range=10.199.0.10,10.199.0.200,1h',
+                             '--dhcp-leasefile=%s' %
+                             os.path.join(tmpdir, 'dnsmasq.leases')])
+
+def teardown(dnsmasq):
+    """ Stops dnsmasq and removes the interfaces and the namespace. """
+    if dnsmasq:
+        os.kill(dnsmasq.pid, signal.SIGTERM)
+        dnsmasq.wait()
+    subprocess.call(['ip', 'link', 'del', IFACE])
+    subprocess.call(['ip', 'netns', 'del', NAMESPACE])
+
+def timed_dhcp(iface, lease_key):
+    """ Returns how long getting a lease took in milliseconds, and the
+    result of StartDHCP. """
+    start = time.time()
+    result = iface.StartDHCP(None, lease_key)
+    elapsed = (time.time() - start) * 1000
+    # Stop the client and drop the address for the next round.
+    iface.ReleaseDHCP()
+    run('ip', 'addr', 'flush', 'dev', IFACE)
+    return elapsed, result
+
+def main(argv):
+    if os.getuid() != 0:
+        print 'This benchmark has to run as root.'
+        return 1
+    rounds = ROUNDS
+    if len(argv) > 1:
+        rounds = int(argv[1])
+    tmpdir = tempfile.mkdtemp()
+    # Keep the leases out of the real /var/lib/wicd.
+    wnettools.wpath.varlib = tmpdir
+    dnsmasq = None
+    try:
+        dnsmasq = setup(tmpdir)
+        iface = wnettools.BaseWiredInterface(IFACE)
+        iface.CheckDHCP()
+        iface.DHCP_CLIENT = misc.AUTO
+        # Get the first lease, so there is one to ask for again.
+        timed_dhcp(iface, 'bench')
+        for label in ['discovery', 'cached']:
+            times = []
+            for n in xrange(rounds):
+                if label == 'cached':
+                    lease_key = 'bench'
+                else:
+                    lease_key = 'bench%d' % n
+                elapsed, result = timed_dhcp(iface, lease_key)
+                if result != 'success':
+                    print '%s: DHCP failed: %s' % (label, result)
+                    return 1
+                times.append(elapsed)
+            print '%-10s min %8.1f ms   avg %8.1f ms' % \
+                (label, min(times), sum(times) / len(times))
+    finally:
+        teardown(dnsmasq)
+        shutil.rmtree(tmpdir)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
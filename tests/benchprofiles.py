@@ -0,0 +1,100 @@
+#!/usr/bin/python
+
+""" Benchmark the wireless profile stores.
+
+Compares wireless-settings.conf, read by ConfigManager, with
+SQLiteProfileStore on startup, profile lookups and profile saves.
+
+    python tests/benchprofiles.py [profiles...]
+
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+from wicd.configmanager import ConfigManager
+from wicd.profilestore import SQLiteProfileStore
+from wicd.scanstore import ProfileIndex
+from benchconfig import make_wireless_settings
+
+SIZES = [100, 1000, 10000]
+LOOKUPS = 1000
+SAVES = 20
+
+def timed(func, *args):
+    """ Returns how long calling func took in milliseconds, and what it
+    returned. """
+    start = time.time()
+    ret = func(*args)
+    return (time.time() - start) * 1000, ret
+
+def bench_lookups(config, sections):
+    """ Returns the number of profile lookups per second. """
+    index = ProfileIndex(config)
+    index.get_profile('', sections[0])
+    start = time.time()
+    for n in xrange(LOOKUPS):
+        section = random.choice(sections)
+        index.get_profile('network %d' % n, section)
+    return LOOKUPS / (time.time() - start)
+
+def bench_saves(config, sections):
+    """ Returns the average time to save a profile and look it up
+    again, in milliseconds. """
+    index = ProfileIndex(config)
+    total = 0
+    for n in xrange(SAVES):
+        section = random.choice(sections)
+        start = time.time()
+        profile = dict(config.get_section(section))
+        profile.pop('_filename_', None)
+        profile['channel'] = n + 1
+        config.set_section(section, profile)
+        config.write()
+        index.get_profile(profile['essid'], section)
+        total += time.time() - start
+    return total / SAVES * 1000
+
+def bench(tmpdir, size):
+    """ Prints the results for a number of profiles. """
+    path = os.path.join(tmpdir, 'wireless-settings-%d.conf' % size)
+    db = os.path.join(tmpdir, 'wireless-settings-%d.db' % size)
+    make_wireless_settings(path, size)
+    import_time, store = timed(SQLiteProfileStore, db)
+    import_time += timed(store.import_config, path)[0]
+    store.db.close()
+
+    ini_start, config = timed(ConfigManager, path)
+    ini_start += timed(ProfileIndex(config).get_profile, '', '')[0]
+    db_start, store = timed(SQLiteProfileStore, db)
+    db_start += timed(ProfileIndex(store).get_profile, '', '')[0]
+    sections = config.sections()
+
+    print '%d profiles (import into the database: %.0f ms)' % \
+        (size, import_time)
+    print '  startup:  ini %10.1f ms      sqlite %10.1f ms' % \
+        (ini_start, db_start)
+    print '  lookups:  ini %10.0f ops/sec sqlite %10.0f ops/sec' % \
+        (bench_lookups(config, sections), bench_lookups(store, sections))
+    print '  saves:    ini %10.1f ms      sqlite %10.1f ms' % \
+        (bench_saves(config, sections), bench_saves(store, sections))
+    store.db.close()
+
+def main(argv):
+    sizes = SIZES
+    if len(argv) > 1:
+        sizes = [int(size) for size in argv[1:]]
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for size in sizes:
+            bench(tmpdir, size)
+    finally:
+        shutil.rmtree(tmpdir)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
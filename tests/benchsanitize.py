@@ -0,0 +1,89 @@
+#!/usr/bin/python
+
+""" Benchmark sanitize_config_file on a large wireless-settings.conf.
+
+Compares sanitize_config_file with the implementation wicd used
+before, which always built the file line by line and rewrote it.
+
+    python tests/benchsanitize.py [lines]
+
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+from wicd import configmanager
+from benchconfig import PROFILE, make_wireless_settings
+
+LINES = 10000
+RUNS = 20
+
+def legacy_sanitize_config_file(path):
+    """ sanitize_config_file as it was before it checked the file. """
+    conf = open(path)
+    newconf = ''
+    for line in conf:
+        if '[' in line or '=' in line:
+            newconf += line
+    conf.close()
+    conf = open(path, 'w')
+    conf.write(newconf)
+    conf.close()
+
+def add_invalid_lines(path):
+    """ Appends lines sanitize_config_file has to remove. """
+    conf = open(path, 'a')
+    conf.write('this is not a valid line\n')
+    conf.close()
+
+def bench(path, sanitize, prepare=None, forget=False):
+    """ Returns the average time of a sanitize call, in milliseconds.
+
+    Keyword arguments:
+    path -- the config file to sanitize
+    sanitize -- the sanitize function to time
+    prepare -- called with the path before every run, if given
+    forget -- drop the known clean files before every run
+
+    """
+    total = 0
+    for run in xrange(RUNS):
+        if prepare:
+            prepare(path)
+        if forget:
+            configmanager._clean_files.clear()
+        start = time.time()
+        sanitize(path)
+        total += time.time() - start
+    return total / RUNS * 1000
+
+def main(argv):
+    lines = LINES
+    if len(argv) > 1:
+        lines = int(argv[1])
+    sections = max(1, lines / PROFILE.count('\n'))
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'wireless-settings.conf')
+        make_wireless_settings(path, sections)
+        lines = len(open(path).readlines())
+        print 'sanitizing %d lines, average of %d runs' % (lines, RUNS)
+        print 'legacy:             %8.3f ms' % \
+            bench(path, legacy_sanitize_config_file)
+        make_wireless_settings(path, sections)
+        print 'clean, first check: %8.3f ms' % \
+            bench(path, configmanager.sanitize_config_file, forget=True)
+        print 'clean, unchanged:   %8.3f ms' % \
+            bench(path, configmanager.sanitize_config_file)
+        print 'invalid lines:      %8.3f ms' % \
+            bench(path, configmanager.sanitize_config_file,
+                  prepare=add_invalid_lines)
+    finally:
+        shutil.rmtree(tmpdir)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,203 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import tempfile
+import unittest
+from wicd import configmanager
+from wicd.configmanager import ConfigManager, WriteBehind
+
+SETTINGS = """[00:11:22:33:44:55]
+essid = home
+channel = 6
+automatic = True
+never = False
+key = `'` secret `'`
+dhcphostname = None
+bitrate = auto
+"""
+
+class TestConfigManager(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'wireless-settings.conf')
+        conf = open(self.path, 'w')
+        conf.write(SETTINGS)
+        conf.close()
+        self.config = ConfigManager(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_typed_values(self):
+        section = '00:11:22:33:44:55'
+        self.assertEquals(self.config.get(section, 'essid'), 'home')
+        self.assertEquals(self.config.get(section, 'channel'), 6)
+        self.assertEquals(self.config.get(section, 'automatic'), True)
+        self.assertEquals(self.config.get(section, 'never'), False)
+        self.assertEquals(self.config.get(section, 'key'), ' secret ')
+        self.assertEquals(self.config.get(section, 'dhcphostname'), None)
+        self.assertEquals(self.config.get(section, 'bitrate'), 'auto')
+
+    def test_missing_option(self):
+        self.assertEquals(self.config.get('00:11:22:33:44:55', 'foo'), None)
+        self.assertEquals(self.config.get('nosection', 'foo'), None)
+
+    def test_option_names_are_case_insensitive(self):
+        self.assertEquals(self.config.get('00:11:22:33:44:55', 'ESSID'),
+                          'home')
+
+    def test_set_invalidates_cache(self):
+        self.assertEquals(self.config.get('00:11:22:33:44:55', 'channel'), 6)
+        self.config.set('00:11:22:33:44:55', 'channel', '11')
+        self.assertEquals(self.config.get('00:11:22:33:44:55', 'channel'), 11)
+
+    def test_remove_section_invalidates_cache(self):
+        self.config.get('00:11:22:33:44:55', 'channel')
+        self.config.remove_section('00:11:22:33:44:55')
+        self.assertEquals(self.config.get('00:11:22:33:44:55', 'channel'),
+                          None)
+        self.config.add_section('00:11:22:33:44:55')
+        self.assertEquals(self.config.get('00:11:22:33:44:55', 'channel'),
+                          None)
+
+    def test_reload_invalidates_cache(self):
+        self.config.get('00:11:22:33:44:55', 'essid')
+        conf = open(self.path, 'w')
+        conf.write(SETTINGS.replace('essid = home', 'essid = work'))
+        conf.close()
+        self.config.reload()
+        self.assertEquals(self.config.get('00:11:22:33:44:55', 'essid'),
+                          'work')
+
+    def test_default_is_written(self):
+        self.assertEquals(self.config.get('Settings', 'backend', 'external'),
+                          'external')
+        self.assertEquals(ConfigManager(self.path).get('Settings', 'backend'),
+                          'external')
+
+    def test_get_section(self):
+        section = self.config.get_section('00:11:22:33:44:55')
+        self.assertEquals(section['channel'], 6)
+        section['channel'] = 1
+        self.assertEquals(self.config.get('00:11:22:33:44:55', 'channel'), 6)
+
+    def test_batch_defers_writes(self):
+        before = open(self.path).read()
+        batch = self.config.batch()
+        batch.__enter__()
+        self.config.set('Settings', 'backend', 'external', write=True)
+        self.config.get('Settings', 'wpa_driver', 'wext')
+        self.assertEquals(open(self.path).read(), before)
+        batch.__exit__(None, None, None)
+        config = ConfigManager(self.path)
+        self.assertEquals(config.get('Settings', 'backend'), 'external')
+        self.assertEquals(config.get('Settings', 'wpa_driver'), 'wext')
+
+    def test_unchanged_config_is_not_written(self):
+        inode = os.stat(self.path).st_ino
+        self.config.write()
+        self.assertEquals(os.stat(self.path).st_ino, inode)
+
+    def test_only_changed_files_are_written(self):
+        os.mkdir(self.path + '.d')
+        for name in ['a', 'b']:
+            conf = open(os.path.join(self.path + '.d', name), 'w')
+            conf.write('[%s]\nessid = %s\n' % (name, name))
+            conf.close()
+        config = ConfigManager(self.path)
+        inodes = dict([(name, os.stat(os.path.join(self.path + '.d',
+                                                   name)).st_ino)
+                       for name in ['a', 'b']])
+        main_inode = os.stat(self.path).st_ino
+        config.set('b', 'channel', '11', write=True)
+        self.assertEquals(os.stat(self.path).st_ino, main_inode)
+        self.assertEquals(os.stat(os.path.join(self.path + '.d',
+                                               'a')).st_ino, inodes['a'])
+        self.assertNotEquals(os.stat(os.path.join(self.path + '.d',
+                                                  'b')).st_ino, inodes['b'])
+        self.assertEquals(ConfigManager(self.path).get('b', 'channel'), 11)
+
+    def test_write_keeps_mode(self):
+        os.chmod(self.path, 0600)
+        self.config.set('00:11:22:33:44:55', 'channel', '1', write=True)
+        self.assertEquals(os.stat(self.path).st_mode & 0777, 0600)
+        self.assertEquals(os.listdir(self.dir), ['wireless-settings.conf'])
+
+    def test_write_new_file_mode(self):
+        path = os.path.join(self.dir, 'new.conf')
+        configmanager.write_file(path, '[a]\n')
+        self.assertEquals(os.stat(path).st_mode & 0777, 0600)
+
+    def test_set_section_unchanged(self):
+        section = '00:11:22:33:44:55'
+        profile = {'essid': 'home', 'channel': 6, 'automatic': True,
+                   'never': False, 'key': ' secret ', 'dhcphostname': None,
+                   'bitrate': 'auto'}
+        generation = self.config.generation
+        inode = os.stat(self.path).st_ino
+        self.assertFalse(self.config.set_section(section, profile))
+        self.config.write()
+        self.assertEquals(self.config.generation, generation)
+        self.assertEquals(os.stat(self.path).st_ino, inode)
+
+    def test_set_section_changed(self):
+        section = '00:11:22:33:44:55'
+        self.assertTrue(self.config.set_section(section, {'essid': 'home',
+                                                          'channel': 11}))
+        self.config.write()
+        config = ConfigManager(self.path)
+        self.assertEquals(config.get_section(section),
+                          {'essid': 'home', 'channel': 11})
+
+    def test_write_behind(self):
+        writer = WriteBehind(delay=60)
+        config = ConfigManager(self.path, writer=writer)
+        before = open(self.path).read()
+        config.set('00:11:22:33:44:55', 'channel', '1', write=True)
+        config.set('00:11:22:33:44:55', 'channel', '2', write=True)
+        self.assertEquals(open(self.path).read(), before)
+        self.assertEquals(writer.pending(), [self.path])
+        config.flush()
+        self.assertEquals(writer.pending(), [])
+        self.assertEquals(ConfigManager(self.path).get('00:11:22:33:44:55',
+                                                       'channel'), 2)
+
+    def test_sanitize_clean_file(self):
+        inode = os.stat(self.path).st_ino
+        configmanager.sanitize_config_file(self.path)
+        self.assertEquals(os.stat(self.path).st_ino, inode)
+        self.assertEquals(open(self.path).read(), SETTINGS)
+
+    def test_sanitize_keeps_blank_lines(self):
+        config = ConfigManager(self.path)
+        config.set('other', 'foo', 'bar', write=True)
+        data = open(self.path).read()
+        self.assertTrue('\n\n' in data)
+        inode = os.stat(self.path).st_ino
+        del configmanager._clean_files[self.path]
+        configmanager.sanitize_config_file(self.path)
+        self.assertEquals(os.stat(self.path).st_ino, inode)
+        self.assertEquals(open(self.path).read(), data)
+
+    def test_sanitize_removes_invalid_lines(self):
+        configmanager.sanitize_config_file(self.path)
+        conf = open(self.path, 'a')
+        conf.write('garbage\n\n[other]\nfoo = bar\nmore garbage\n')
+        conf.close()
+        configmanager.sanitize_config_file(self.path)
+        self.assertEquals(open(self.path).read(),
+                          SETTINGS + '\n[other]\nfoo = bar\n')
+        self.assertEquals(configmanager._clean_files[self.path],
+                          configmanager._fingerprint(self.path))
+
+def suite():
+    suite = unittest.TestSuite()
+    tests = []
+    [ tests.append(test) for test in dir(TestConfigManager) if test.startswith('test') ]
+    for test in tests:
+        suite.addTest(TestConfigManager(test))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main()
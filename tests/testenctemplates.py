@@ -0,0 +1,105 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import tempfile
+import unittest
+from wicd import enctemplates
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            '..', 'encryption', 'templates')
+
+TEMPLATE = """name = Test
+author = nobody
+version = 1
+require key *Key
+optional key_index *Key_Index
+protected key *Key
+-----
+ctrl_interface=/var/run/wpa_supplicant
+network={
+       ssid="$_ESSID"
+       wep_key$_KEY_INDEX=$_KEY
+       priority=$_PRIORITY
+}
+"""
+
+class TestEncTemplates(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.write('test', TEMPLATE)
+        self.write('active', 'test\nmissing\n')
+        self.registry = enctemplates.TemplateRegistry(self.dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, data):
+        f = open(os.path.join(self.dir, name), 'w')
+        f.write(data)
+        f.close()
+
+    def test_methods(self):
+        methods = self.registry.methods()
+        self.assertEquals(len(methods), 1)
+        self.assertEquals(methods[0]['type'], 'test')
+        self.assertEquals(methods[0]['name'], 'Test')
+        self.assertEquals(methods[0]['required'], [['key', 'Key']])
+        self.assertEquals(methods[0]['optional'], [['key_index', 'Key_Index']])
+        self.assertEquals(methods[0]['protected'], [['key', 'Key']])
+
+    def test_render(self):
+        config = self.registry.render({'enctype' : 'test', 'essid' : 'home',
+                                       'key' : 'abcdef'})
+        self.assertEquals(config, 'ctrl_interface=/var/run/wpa_supplicant\n'
+                                  'network={\n'
+                                  '       ssid="home"\n'
+                                  '       wep_key0=abcdef\n'
+                                  '}\n')
+
+    def test_templates_are_parsed_once(self):
+        network = {'enctype' : 'test', 'essid' : 'home', 'key' : 'abcdef'}
+        for n in range(3):
+            self.registry.methods()
+            self.registry.render(network)
+        self.assertEquals(self.registry.parses, 1)
+
+    def test_changed_template(self):
+        self.registry.methods()
+        self.write('test', TEMPLATE.replace('name = Test', 'name = Changed'))
+        self.assertEquals(self.registry.methods()[0]['name'], 'Changed')
+        self.assertEquals(self.registry.parses, 2)
+
+    def test_changed_active(self):
+        self.write('other', TEMPLATE.replace('name = Test', 'name = Other'))
+        self.registry.methods()
+        self.write('active', 'other\n')
+        self.assertEquals([method['name'] for method in
+                           self.registry.methods()], ['Other'])
+
+    def test_invalid_template(self):
+        self.write('test', TEMPLATE.replace('require', 'requires nothing'))
+        self.assertEquals(self.registry.methods(), [])
+        self.assertRaises(IOError, self.registry.render, {'enctype' : 'test'})
+
+    def test_shipped_templates(self):
+        registry = enctemplates.TemplateRegistry(TEMPLATE_DIR)
+        for wired in (False, True):
+            active = registry.active(wired)
+            self.assertEquals(len(registry.methods(wired)), len(active))
+        config = registry.render({'enctype' : 'wpa', 'essid' : 'home',
+                                  'psk' : 'f42c6fc5'})
+        self.assertTrue('\n       ssid="home"\n' in config)
+        self.assertTrue('\n       psk=f42c6fc5\n' in config)
+        self.assertTrue('\n       scan_ssid=1\n' in config)
+
+def suite():
+    suite = unittest.TestSuite()
+    tests = []
+    [ tests.append(test) for test in dir(TestEncTemplates) if test.startswith('test') ]
+    for test in tests:
+        suite.addTest(TestEncTemplates(test))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main()
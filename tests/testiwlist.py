@@ -0,0 +1,296 @@
+#!/usr/bin/python
+
+""" Tests and benchmark for the iwlist scan parser.
+
+Running this file directly prints how long the old (regex per field)
+and the current (single pass) parsers take on scans of 10, 100 and 500
+cells.
+
+"""
+
+import re
+import time
+import unittest
+from wicd import misc
+from wicd import wnettools
+
+# Cells captured from `iwlist <iface> scan` with various drivers.  The
+# address, ESSID and signal are filled in to build scans of any size.
+CELLS = [
+# mac80211, WPA2, the basic rates split on two 'Bit Rates' lines
+"""          Cell %(n)02d - Address: %(mac)s
+                    Channel:6
+                    Frequency:2.437 GHz (Channel 6)
+                    Quality=%(qual)d/70  Signal level=%(dbm)d dBm
+                    Encryption key:on
+                    ESSID:"%(essid)s"
+                    Bit Rates:1 Mb/s; 2 Mb/s; 5.5 Mb/s; 11 Mb/s; 6 Mb/s
+                              9 Mb/s; 12 Mb/s; 18 Mb/s
+                    Bit Rates:24 Mb/s; 36 Mb/s; 48 Mb/s; 54 Mb/s
+                    Mode:Master
+                    Extra:tsf=000000208e5ce217
+                    Extra: Last beacon: 110ms ago
+                    IE: Unknown: 00074C696E6B737973
+                    IE: IEEE 802.11i/WPA2 Version 1
+                        Group Cipher : CCMP
+                        Pairwise Ciphers (1) : CCMP
+                        Authentication Suites (1) : PSK
+""",
+# mac80211, WPA/WPA2 mixed mode
+"""          Cell %(n)02d - Address: %(mac)s
+                    Channel:11
+                    Frequency:2.462 GHz (Channel 11)
+                    Quality=%(qual)d/70  Signal level=%(dbm)d dBm
+                    Encryption key:on
+                    ESSID:"%(essid)s"
+                    Bit Rates:1 Mb/s; 2 Mb/s; 5.5 Mb/s; 11 Mb/s; 18 Mb/s
+                              24 Mb/s; 36 Mb/s; 54 Mb/s
+                    Bit Rates:6 Mb/s; 9 Mb/s; 12 Mb/s; 48 Mb/s
+                    Mode:Master
+                    Extra:tsf=0000001d3f4ab2c0
+                    Extra: Last beacon: 1210ms ago
+                    IE: WPA Version 1
+                        Group Cipher : TKIP
+                        Pairwise Ciphers (2) : CCMP TKIP
+                        Authentication Suites (1) : PSK
+                    IE: IEEE 802.11i/WPA2 Version 1
+                        Group Cipher : TKIP
+                        Pairwise Ciphers (2) : CCMP TKIP
+                        Authentication Suites (1) : PSK
+""",
+# ipw2200, WEP
+"""          Cell %(n)02d - Address: %(mac)s
+                    ESSID:"%(essid)s"
+                    Protocol:IEEE 802.11bg
+                    Mode:Master
+                    Channel:1
+                    Encryption key:on
+                    Bit Rates:1 Mb/s; 2 Mb/s; 5.5 Mb/s; 6 Mb/s; 9 Mb/s
+                              11 Mb/s; 12 Mb/s; 18 Mb/s; 24 Mb/s; 36 Mb/s
+                              48 Mb/s; 54 Mb/s
+                    Quality=%(qual)d/100  Signal level=%(dbm)d dBm
+                    Extra: Last beacon: 24ms ago
+""",
+# ipw2200, WPA
+"""          Cell %(n)02d - Address: %(mac)s
+                    ESSID:"%(essid)s"
+                    Protocol:IEEE 802.11bg
+                    Mode:Master
+                    Frequency:2.452 GHz (Channel 9)
+                    Encryption key:on
+                    Bit Rates:1 Mb/s; 2 Mb/s; 5.5 Mb/s; 11 Mb/s
+                    Quality=%(qual)d/100  Signal level=%(dbm)d dBm
+                    IE: WPA Version 1
+                        Group Cipher : TKIP
+                        Pairwise Ciphers (1) : TKIP
+                        Authentication Suites (1) : PSK
+                    Extra: Last beacon: 408ms ago
+""",
+# madwifi, WPA information element only reported as an Extra
+"""          Cell %(n)02d - Address: %(mac)s
+                    ESSID:"%(essid)s"
+                    Mode:Master
+                    Frequency:2.427 GHz (Channel 4)
+                    Quality=%(qual)d/94  Signal level=%(dbm)d dBm  Noise level=-95 dBm
+                    Encryption key:on
+                    Bit Rates:1 Mb/s; 2 Mb/s; 5.5 Mb/s; 11 Mb/s; 6 Mb/s
+                              9 Mb/s; 12 Mb/s; 18 Mb/s; 24 Mb/s; 36 Mb/s
+                              48 Mb/s; 54 Mb/s
+                    Extra:bcn_int=100
+                    Extra:wpa_ie=dd160050f20101000050f20201000050f20201000050f202
+""",
+# mac80211, open network
+"""          Cell %(n)02d - Address: %(mac)s
+                    Channel:3
+                    Frequency:2.422 GHz (Channel 3)
+                    Quality=%(qual)d/70  Signal level=%(dbm)d dBm
+                    Encryption key:off
+                    ESSID:"%(essid)s"
+                    Bit Rates:1 Mb/s; 2 Mb/s; 5.5 Mb/s; 11 Mb/s
+                    Mode:Master
+                    Extra:tsf=0000000000a3c1d2
+                    Extra: Last beacon: 52ms ago
+""",
+# mac80211, hidden network
+"""          Cell %(n)02d - Address: %(mac)s
+                    Channel:13
+                    Frequency:2.472 GHz (Channel 13)
+                    Quality=%(qual)d/70  Signal level=%(dbm)d dBm
+                    Encryption key:on
+                    ESSID:""
+                    Bit Rates:6 Mb/s; 9 Mb/s; 12 Mb/s; 18 Mb/s; 24 Mb/s
+                              36 Mb/s; 48 Mb/s; 54 Mb/s
+                    Mode:Master
+                    IE: IEEE 802.11i/WPA2 Version 1
+                        Group Cipher : CCMP
+                        Pairwise Ciphers (1) : CCMP
+                        Authentication Suites (1) : 802.1x
+""",
+# ad-hoc network, frequency only
+"""          Cell %(n)02d - Address: %(mac)s
+                    ESSID:"%(essid)s"
+                    Mode:Ad-Hoc
+                    Frequency:2.412 GHz
+                    Quality:%(qual)d  Signal level:0  Noise level:0
+                    Encryption key:off
+                    Bit Rates:1 Mb/s; 2 Mb/s; 5.5 Mb/s; 11 Mb/s
+""",
+]
+
+FIELDS = ['essid', 'hidden', 'channel', 'bitrates', 'bssid', 'mode',
+          'encryption', 'encryption_method', 'quality', 'strength']
+
+
+def make_scan(count):
+    """ Build the output of an iwlist scan with count cells. """
+    cells = []
+    for n in xrange(1, count + 1):
+        cells.append(CELLS[n % len(CELLS)] % {
+            'n' : n,
+            'mac' : '00:1A:2B:%02X:%02X:%02X' % (n >> 16, (n >> 8) & 255,
+                                                 n & 255),
+            'essid' : 'network %d' % n,
+            'qual' : 20 + n % 50,
+            'dbm' : -40 - n % 50,
+        })
+    return 'wlan0     Scan completed :\n' + ''.join(cells) + '\n'
+
+def split_cells(output):
+    """ Split iwlist output into cells, like GetNetworks does. """
+    return [cell for cell in output.split('   Cell ') if 'ESSID:' in cell]
+
+def legacy_parse_access_point(iface, cell, ralink_info=None):
+    """ The regex per field iwlist cell parser wicd used to have. """
+    ap = {}
+    ap['essid'] = misc.RunRegex(wnettools.essid_pattern, cell)
+    try:
+        ap['essid'] = misc.to_unicode(ap['essid'])
+    except (UnicodeDecodeError, UnicodeEncodeError):
+        return None
+    ap['essid'] = ap['essid'].replace('\x00', '')
+    if ap['essid'] in ['Hidden', '<hidden>', "", None]:
+        ap['hidden'] = True
+        ap['essid'] = "<hidden>"
+    else:
+        ap['hidden'] = False
+
+    ap['channel'] = misc.RunRegex(wnettools.channel_pattern, cell)
+    if ap['channel'] == None:
+        freq = misc.RunRegex(wnettools.freq_pattern, cell)
+        ap['channel'] = iface._FreqToChannel(freq)
+
+    bitrates = cell.split('Bit Rates')[-1].replace('\n', '; ')
+    m = re.findall(wnettools.bitrates_pattern, bitrates)
+    if m:
+        ap['bitrates'] = sorted(m, lambda x, y: int(float(x) - float(y)))
+    else:
+        ap['bitrates'] = None
+
+    ap['bssid'] = misc.RunRegex(wnettools.ap_mac_pattern, cell)
+    ap['mode'] = misc.RunRegex(wnettools.mode_pattern, cell)
+    if ap['mode'] is None:
+        return None
+
+    if misc.RunRegex(wnettools.wep_pattern, cell) == 'on':
+        ap['encryption'] = True
+        ap['encryption_method'] = 'WEP'
+        if misc.RunRegex(wnettools.wpa1_pattern, cell) == 'WPA Version 1':
+            ap['encryption_method'] = 'WPA'
+        if misc.RunRegex(wnettools.altwpa_pattern, cell) == 'wpa_ie':
+            ap['encryption_method'] = 'WPA'
+        if misc.RunRegex(wnettools.wpa2_pattern, cell) == 'WPA2':
+            ap['encryption_method'] = 'WPA2'
+    else:
+        ap['encryption'] = False
+
+    ap['quality'] = iface._get_link_quality(cell)
+    if ap['quality'] is None:
+        ap['quality'] = -1
+
+    if misc.RunRegex(wnettools.signaldbm_pattern, cell):
+        ap['strength'] = misc.RunRegex(wnettools.signaldbm_pattern, cell)
+    else:
+        ap['strength'] = -1
+    return ap
+
+def parse(iface, cells):
+    """ Parse cells with the current parser. """
+    return [iface._ParseAccessPoint(cell, None) for cell in cells]
+
+def legacy_parse(iface, cells):
+    """ Parse cells with the old parser. """
+    return [legacy_parse_access_point(iface, cell) for cell in cells]
+
+
+class TestIwlistParser(unittest.TestCase):
+    def setUp(self):
+        self.iface = wnettools.BaseWirelessInterface('wlan0')
+
+    def _check_same_as_legacy(self, count):
+        cells = split_cells(make_scan(count))
+        self.assertEquals(len(cells), count)
+        new = parse(self.iface, cells)
+        old = legacy_parse(self.iface, cells)
+        for new_ap, old_ap in zip(new, old):
+            for field in FIELDS:
+                self.assertEquals(new_ap.get(field), old_ap.get(field))
+
+    def test_same_as_legacy_10(self):
+        self._check_same_as_legacy(10)
+
+    def test_same_as_legacy_100(self):
+        self._check_same_as_legacy(100)
+
+    def test_same_as_legacy_500(self):
+        self._check_same_as_legacy(500)
+
+    def test_wpa2_cell(self):
+        ap = self.iface._ParseAccessPoint(split_cells(make_scan(8))[7], None)
+        self.assertEquals(ap['essid'], 'network 8')
+        self.assertEquals(ap['bssid'], '00:1A:2B:00:00:08')
+        self.assertEquals(ap['channel'], '6')
+        self.assertEquals(ap['mode'], 'Master')
+        self.assertEquals(ap['encryption_method'], 'WPA2')
+        self.assertEquals(ap['quality'], 100 * 28 // 70)
+        self.assertEquals(ap['strength'], '-48')
+
+    def test_frequency_only_cell(self):
+        ap = self.iface._ParseAccessPoint(split_cells(make_scan(7))[6], None)
+        self.assertEquals(ap['mode'], 'Ad-Hoc')
+        self.assertEquals(ap['channel'], 1)
+        self.assertEquals(ap['quality'], 27)
+        self.assertEquals(ap['strength'], -1)
+
+    def test_hidden_cell(self):
+        ap = self.iface._ParseAccessPoint(split_cells(make_scan(6))[5], None)
+        self.assertTrue(ap['hidden'])
+        self.assertEquals(ap['essid'], '<hidden>')
+
+    def test_bitrates_sorted(self):
+        ap = self.iface._ParseAccessPoint(split_cells(make_scan(2))[1], None)
+        self.assertEquals(ap['bitrates'], ['1', '2', '5.5', '6', '9', '11',
+                                           '12', '18', '24', '36', '48',
+                                           '54'])
+
+def suite():
+    suite = unittest.TestSuite()
+    tests = []
+    [ tests.append(test) for test in dir(TestIwlistParser) if test.startswith('test') ]
+    for test in tests:
+        suite.addTest(TestIwlistParser(test))
+    return suite
+
+def benchmark(runs=20):
+    """ Print the time both parsers take on scans of various sizes. """
+    iface = wnettools.BaseWirelessInterface('wlan0')
+    for count in (10, 100, 500):
+        cells = split_cells(make_scan(count))
+        for name, func in (('regex', legacy_parse), ('single pass', parse)):
+            start = time.time()
+            for i in xrange(runs):
+                func(iface, cells)
+            elapsed = (time.time() - start) / runs
+            print '%4d cells, %-12s %8.2f ms' % (count, name, elapsed * 1000)
+
+if __name__ == '__main__':
+    benchmark()
@@ -1,6 +1,8 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
+import time
+import threading
 import unittest
 from wicd import misc
 
@@ -163,6 +165,188 @@ class TestMisc(unittest.TestCase):
     def test_string_to_none_4(self):
         self.assertEquals(misc.stringToNone('abcdef'), 'abcdef')
 
+    def test_diff_scans_added_removed(self):
+        old = [{'bssid' : 'A', 'quality' : 50}, {'bssid' : 'B', 'quality' : 40}]
+        new = [{'bssid' : 'C', 'quality' : 70}, {'bssid' : 'A', 'quality' : 50}]
+        added, removed, changed = misc.diff_scans(old, new)
+        self.assertEquals(added, [{'bssid' : 'C', 'quality' : 70}])
+        self.assertEquals(removed, ['B'])
+        self.assertEquals(changed, {})
+
+    def test_diff_scans_changed(self):
+        old = [{'bssid' : 'A', 'quality' : 50, 'automatic' : True}]
+        new = [{'bssid' : 'A', 'quality' : 60, 'channel' : '6'}]
+        added, removed, changed = misc.diff_scans(old, new)
+        self.assertEquals(added, [])
+        self.assertEquals(removed, [])
+        self.assertEquals(changed, {'A' : {'quality' : 60, 'channel' : '6',
+                                           'automatic' : None}})
+
+    def test_command_stats(self):
+        stats = misc.CommandStats()
+        stats.record(['/sbin/iwlist', 'wlan0', 'scan'], 0.0005,
+                     output_bytes=10)
+        stats.record(['iwlist'], 0.15, failed=True, output_bytes=5)
+        stats.record(['wpa_cli'])
+        entry = stats.get()['iwlist']
+        self.assertEquals(entry['calls'], 2)
+        self.assertEquals(entry['failures'], 1)
+        self.assertEquals(entry['output_bytes'], 15)
+        self.assertEquals(entry['max_ms'], 150)
+        self.assertEquals(entry['histogram'][0], 1)
+        bucket = misc.CommandStats.BUCKETS.index(200)
+        self.assertEquals(entry['histogram'][bucket], 1)
+        self.assertEquals(stats.get()['wpa_cli']['untimed'], 1)
+        stats.reset()
+        self.assertEquals(stats.get(), {})
+
+    def test_command_stats_bounded(self):
+        stats = misc.CommandStats(max_commands=2)
+        for name in ['a', 'b', 'c', 'd']:
+            stats.record([name], 0.001)
+        self.assertEquals(sorted(stats.get()), ['(other)', 'a', 'b'])
+        self.assertEquals(stats.get()['(other)']['calls'], 2)
+
+    def test_run_records_stats(self):
+        misc.command_stats.reset()
+        misc.Run(['echo', 'hi'])
+        entry = misc.command_stats.get()['echo']
+        self.assertEquals(entry['calls'], 1)
+        self.assertEquals(entry['output_bytes'], 3)
+
+    def test_monotonic(self):
+        first = misc.monotonic()
+        self.assertTrue(misc.monotonic() >= first)
+
+    def test_run_timeout(self):
+        start = time.time()
+        output = misc.Run(['sh', '-c', 'echo started; sleep 10'], timeout=0.3)
+        self.assertEquals(output, 'started\n')
+        self.assertTrue(time.time() - start < 2)
+
+    def test_run_obj_stops_watchdog(self):
+        process = misc.Run(['echo', 'hi'], return_obj=True, timeout=60)
+        watchdog = process.watchdog
+        self.assertTrue(watchdog.isAlive())
+        self.assertEquals(process.communicate()[0], 'hi\n')
+        watchdog.join(1)
+        self.assertFalse(watchdog.isAlive())
+
+    def test_run_obj_timeout(self):
+        process = misc.Run(['sleep', '10'], return_obj=True, timeout=0.3)
+        start = time.time()
+        process.wait()
+        self.assertTrue(time.time() - start < 2)
+
+    def test_cancel_token(self):
+        token = misc.CancelToken()
+        result = []
+        def run():
+            misc.set_cancel_token(token)
+            start = time.time()
+            try:
+                # The backgrounded sleep keeps the pipe open, so it has
+                # to be killed with its process group.
+                misc.Run(['sh', '-c', 'sleep 10 & sleep 10'])
+            except misc.CommandCancelled:
+                result.append(time.time() - start)
+        thread = threading.Thread(target=run)
+        thread.start()
+        time.sleep(0.2)
+        token.cancel()
+        thread.join(5)
+        self.assertEquals(len(result), 1)
+        self.assertTrue(result[0] < 1)
+
+    def test_cancelled_token_runs_nothing(self):
+        token = misc.CancelToken()
+        token.cancel()
+        misc.set_cancel_token(token)
+        try:
+            self.assertRaises(misc.CommandCancelled, misc.Run, ['true'])
+            self.assertRaises(misc.CommandCancelled, misc.LaunchAndWait,
+                              ['true'])
+            self.assertRaises(misc.CommandCancelled, misc.sleep, 10)
+        finally:
+            misc.set_cancel_token(None)
+
+    def test_token_timeout(self):
+        misc.set_cancel_token(misc.CancelToken(timeout=0.3))
+        try:
+            start = time.time()
+            self.assertNotEquals(misc.LaunchAndWait(['sleep', '10']), 0)
+            self.assertTrue(time.time() - start < 2)
+        finally:
+            misc.set_cancel_token(None)
+
+    def test_generate_psk(self):
+        # The test vectors of IEEE 802.11i, annex H.4.
+        self.assertEquals(misc.generate_psk('IEEE', 'password'),
+                          'f42c6fc52df0ebef9ebb4b90b38a5f90'
+                          '2e83fe1b135a70e23aed762e9710a12e')
+        self.assertEquals(misc.generate_psk(u'ThisIsASSID',
+                                            u'ThisIsAPassword'),
+                          '0dc0d6eb90555ed6419756b9a15ec3e3'
+                          '209b63df707dd508d14581f8982721af')
+
+    def test_pbkdf2_fallback(self):
+        self.assertEquals(misc._pbkdf2_sha1('password', 'IEEE', 4096, 32)
+                          .encode('hex'), misc.generate_psk('IEEE', 'password'))
+
+    def test_generate_psk_invalid_passphrase(self):
+        self.assertEquals(misc.generate_psk('IEEE', 'short'), None)
+        self.assertEquals(misc.generate_psk('IEEE', 'x' * 64), None)
+        self.assertEquals(misc.generate_psk('IEEE', 'pass\nword'), None)
+        self.assertEquals(misc.generate_psk('IEEE', u'pässword'), None)
+
+    def test_psk_cache_key(self):
+        key = misc.psk_cache_key('home', 'password')
+        self.assertEquals(key, misc.psk_cache_key(u'home', u'password'))
+        self.assertNotEquals(key, misc.psk_cache_key('home2', 'password'))
+        self.assertNotEquals(key, misc.psk_cache_key('home', 'password2'))
+
+    def test_worker_pool(self):
+        done = threading.Event()
+        results = []
+        pool = misc.WorkerPool(2, deliver=lambda call: call())
+        pool.run(lambda x: x * 2, (21,), results.append)
+        pool.run(lambda: None, (), lambda *args: results.append(args))
+        pool.run(lambda: 1 / 0, (), None,
+                 lambda e: results.append(type(e)))
+        pool.run(done.set)
+        done.wait(5)
+        time.sleep(0.1)
+        self.assertEquals(sorted(map(str, results)),
+                          sorted(map(str, [42, (), ZeroDivisionError])))
+
+    def test_worker_pool_is_bounded(self):
+        lock = threading.Lock()
+        release = threading.Event()
+        finished = []
+        running = [0, 0]
+        def work():
+            lock.acquire()
+            running[0] += 1
+            running[1] = max(running)
+            lock.release()
+            release.wait(5)
+            lock.acquire()
+            running[0] -= 1
+            lock.release()
+        pool = misc.WorkerPool(2, deliver=lambda call: call())
+        for n in range(5):
+            pool.run(work, (), lambda: finished.append(1))
+        time.sleep(0.2)
+        self.assertEquals(running[0], 2)
+        self.assertEquals(len(pool._threads), 2)
+        release.set()
+        for n in range(50):
+            if len(finished) == 5:
+                break
+            time.sleep(0.1)
+        self.assertEquals(len(finished), 5)
+        self.assertEquals(running[1], 2)
+
 def suite():
 	suite = unittest.TestSuite()
 	tests = []
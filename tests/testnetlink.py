@@ -0,0 +1,167 @@
+#!/usr/bin/python
+
+import socket
+import struct
+import unittest
+from wicd import backend
+from wicd import netlink
+
+def link_msg(index, flags, name='eth0', carrier=None, msg_type=None):
+    """ Build a RTM_NEWLINK message like the kernel would send. """
+    if msg_type is None:
+        msg_type = netlink.RTM_NEWLINK
+    payload = struct.pack(netlink.IFINFOMSG, 0, 1, index, flags, 0)
+    payload += netlink.pack_attr(netlink.IFLA_IFNAME, name + '\0')
+    if carrier is not None:
+        payload += netlink.pack_attr(netlink.IFLA_CARRIER, chr(int(carrier)))
+    return netlink.pack_message(msg_type, payload)
+
+def addr_msg(index, address, msg_type=None):
+    """ Build a RTM_NEWADDR message for an IPv4 address. """
+    if msg_type is None:
+        msg_type = netlink.RTM_NEWADDR
+    payload = struct.pack(netlink.IFADDRMSG, socket.AF_INET, 24, 0, 0, index)
+    payload += netlink.pack_attr(netlink.IFA_LOCAL, socket.inet_aton(address))
+    payload += netlink.pack_attr(netlink.IFA_LABEL, 'eth0\0')
+    return netlink.pack_message(msg_type, payload)
+
+UP = netlink.IFF_UP | netlink.IFF_RUNNING | netlink.IFF_LOWER_UP
+
+class TestNetlink(unittest.TestCase):
+    def test_parse_link(self):
+        events = netlink.parse_events(link_msg(2, UP, 'eth0', True))
+        self.assertEquals(len(events), 1)
+        self.assertEquals(events[0]['type'], netlink.RTM_NEWLINK)
+        self.assertEquals(events[0]['index'], 2)
+        self.assertEquals(events[0]['ifname'], 'eth0')
+        self.assertEquals(events[0]['flags'], UP)
+        self.assertTrue(events[0]['carrier'])
+
+    def test_parse_addr(self):
+        events = netlink.parse_events(addr_msg(3, '192.168.1.10'))
+        self.assertEquals(events[0]['type'], netlink.RTM_NEWADDR)
+        self.assertEquals(events[0]['index'], 3)
+        self.assertEquals(events[0]['address'], '192.168.1.10')
+        self.assertEquals(events[0]['label'], 'eth0')
+
+    def test_parse_multiple_messages(self):
+        data = link_msg(2, UP, 'eth0') + addr_msg(2, '10.0.0.1') + \
+               link_msg(3, 0, 'wlan0', msg_type=netlink.RTM_DELLINK)
+        events = netlink.parse_events(data)
+        self.assertEquals([e['type'] for e in events],
+                          [netlink.RTM_NEWLINK, netlink.RTM_NEWADDR,
+                           netlink.RTM_DELLINK])
+
+    def test_parse_ignores_other_messages(self):
+        data = netlink.pack_message(netlink.NLMSG_DONE, '\0' * 4)
+        self.assertEquals(netlink.parse_events(data), [])
+
+    def test_parse_truncated_message(self):
+        data = link_msg(2, UP)
+        self.assertEquals(netlink.parse_events(data[:-4]), [])
+
+    def test_tracker_ignores_repeated_link_state(self):
+        tracker = netlink.LinkStateTracker([2])
+        self.assertTrue(tracker.filter(netlink.parse_events(link_msg(2, UP))))
+        self.assertFalse(tracker.filter(netlink.parse_events(link_msg(2, UP))))
+
+    def test_tracker_reports_carrier_change(self):
+        tracker = netlink.LinkStateTracker([2])
+        tracker.filter(netlink.parse_events(link_msg(2, UP, carrier=True)))
+        self.assertTrue(tracker.filter(
+            netlink.parse_events(link_msg(2, UP, carrier=False))))
+
+    def test_tracker_ignores_untracked_interface(self):
+        tracker = netlink.LinkStateTracker([2])
+        self.assertFalse(tracker.filter(netlink.parse_events(link_msg(5, UP))))
+        self.assertFalse(tracker.filter(
+            netlink.parse_events(addr_msg(5, '10.0.0.1'))))
+
+    def test_tracker_reports_address_change(self):
+        tracker = netlink.LinkStateTracker([2])
+        self.assertTrue(tracker.filter(
+            netlink.parse_events(addr_msg(2, '10.0.0.1'))))
+
+    def test_tracker_reports_overrun(self):
+        tracker = netlink.LinkStateTracker([2])
+        tracker.filter(netlink.parse_events(link_msg(2, UP)))
+        self.assertTrue(tracker.filter([{'type' : netlink.EVENT_OVERRUN,
+                                         'index' : 0}]))
+        # The state was forgotten, so the next link message is relevant.
+        self.assertTrue(tracker.filter(netlink.parse_events(link_msg(2, UP))))
+
+    def test_tracker_defaults_to_all_but_loopback(self):
+        tracker = netlink.LinkStateTracker()
+        self.assertFalse(tracker.filter(netlink.parse_events(link_msg(1, UP))))
+        self.assertTrue(tracker.filter(netlink.parse_events(link_msg(7, UP))))
+
+    def test_tracker_follows_new_interface(self):
+        tracker = netlink.LinkStateTracker(names=['wicdtest0'])
+        self.assertFalse(tracker.filter(netlink.parse_events(link_msg(5, UP))))
+        self.assertTrue(tracker.filter(
+            netlink.parse_events(link_msg(9, UP, 'wicdtest0'))))
+        self.assertTrue(tracker.filter(
+            netlink.parse_events(addr_msg(9, '10.0.0.1'))))
+
+    def test_tracker_follows_recreated_interface(self):
+        tracker = netlink.LinkStateTracker(names=['wicdtest0'])
+        tracker.filter(netlink.parse_events(link_msg(9, UP, 'wicdtest0')))
+        self.assertTrue(tracker.filter(netlink.parse_events(
+            link_msg(9, 0, 'wicdtest0', msg_type=netlink.RTM_DELLINK))))
+        self.assertFalse(tracker.filter(
+            netlink.parse_events(addr_msg(9, '10.0.0.1'))))
+        self.assertTrue(tracker.filter(
+            netlink.parse_events(link_msg(10, UP, 'wicdtest0'))))
+
+    def test_tracker_follows_renamed_interface(self):
+        tracker = netlink.LinkStateTracker(names=['wicdtest0'])
+        tracker.filter(netlink.parse_events(link_msg(9, UP, 'wicdtest0')))
+        self.assertTrue(tracker.filter(
+            netlink.parse_events(link_msg(9, UP, 'wicdtest1'))))
+        self.assertFalse(tracker.filter(
+            netlink.parse_events(link_msg(9, 0, 'wicdtest1'))))
+
+    def test_delete_default_route_of_any_protocol(self):
+        be = backend.BackendManager().load_backend('netlink')
+        iface = be.WiredInterface('lo')
+        requests = []
+        iface._route_request = lambda msg_type, payload, flags=0: \
+            requests.append((msg_type, payload))
+        iface.DelDefaultRoute()
+        self.assertEquals(len(requests), 1)
+        self.assertEquals(requests[0][0], netlink.RTM_DELROUTE)
+        route = netlink.parse_route(requests[0][1])
+        self.assertEquals(route['protocol'], 0)
+        self.assertEquals(route['type'], 0)
+
+    def test_pack_default_route(self):
+        payload = netlink.pack_route(gateway='192.168.1.1', oif=3)
+        route = netlink.parse_route(payload)
+        self.assertEquals(route['family'], socket.AF_INET)
+        self.assertEquals(route['dst_len'], 0)
+        self.assertEquals(route['table'], netlink.RT_TABLE_MAIN)
+        self.assertEquals(route['gateway'], '192.168.1.1')
+        self.assertEquals(route['oif'], 3)
+
+    def test_pack_route_without_gateway(self):
+        payload = netlink.pack_route(scope=netlink.RT_SCOPE_NOWHERE, oif=2)
+        route = netlink.parse_route(payload)
+        self.assertEquals(route['scope'], netlink.RT_SCOPE_NOWHERE)
+        self.assertEquals(route['gateway'], None)
+
+    def test_parse_error_ack(self):
+        self.assertEquals(netlink.parse_error(struct.pack('i', 0)), 0)
+
+    def test_parse_error_errno(self):
+        self.assertEquals(netlink.parse_error(struct.pack('i', -17)), 17)
+
+def suite():
+    suite = unittest.TestSuite()
+    tests = []
+    [ tests.append(test) for test in dir(TestNetlink) if test.startswith('test') ]
+    for test in tests:
+        suite.addTest(TestNetlink(test))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+#!/usr/bin/python
+
+import time
+import unittest
+from wicd import misc
+from wicd import networking
+
+def make_thread(network):
+    return networking.ConnectThread(network, 'wlan0', None, None, None, None,
+                                    None, None, None, None, None, None, False)
+
+class TestConnectTraces(unittest.TestCase):
+    def test_traces_are_bounded(self):
+        traces = networking.ConnectTraces(max_traces=3)
+        for n in range(5):
+            traces.add({'result' : n})
+        self.assertEquals([trace['result'] for trace in traces.get()],
+                          [2, 3, 4])
+
+    def test_phases(self):
+        thread = make_thread({'essid' : 'home', 'bssid' : '00:11:22:33:44:55'})
+        thread.mark_phase('preconnect_scripts')
+        thread.SetStatus('interface_down')
+        thread.SetStatus('interface_down')
+        thread.SetStatus('running_dhcp')
+        thread.connect_result = 'success'
+        trace = thread.get_trace()
+        self.assertEquals(trace['network'], 'home')
+        self.assertEquals(trace['result'], 'success')
+        self.assertEquals(trace['phases'], ['interface_down',
+                                            'preconnect_scripts',
+                                            'interface_down',
+                                            'running_dhcp'])
+        self.assertEquals(len(trace['durations']), 4)
+        self.assertTrue(min(trace['durations']) >= 0)
+        self.assertAlmostEquals(sum(trace['durations']), trace['duration'])
+
+    def test_wired_trace(self):
+        trace = make_thread({'profilename' : 'wired-default'}).get_trace()
+        self.assertEquals(trace['network'], 'wired-default')
+        self.assertEquals(trace['bssid'], 'wired')
+
+class FakeWirelessInterface(object):
+    def __init__(self):
+        self.generated = 0
+        self.authenticated = []
+
+    def GeneratePSK(self, network):
+        self.generated += 1
+        return 'psk%d' % self.generated
+
+    def Authenticate(self, network):
+        self.authenticated.append(network['psk'])
+
+class TestPSKCache(unittest.TestCase):
+    def setUp(self):
+        self.network = {'essid' : 'home', 'bssid' : '00:11:22:33:44:55',
+                        'enctype' : 'wpa', 'key' : 'password'}
+        self.wiface = FakeWirelessInterface()
+
+    def connect(self):
+        thread = networking.WirelessConnectThread(self.network, 'wlan0',
+            None, None, None, None, None, None, None, None, None, None,
+            self.wiface, False, None, False)
+        thread.generate_psk_and_authenticate(self.wiface)
+
+    def test_psk_is_reused(self):
+        self.connect()
+        self.connect()
+        self.assertEquals(self.wiface.generated, 1)
+        self.assertEquals(self.wiface.authenticated, ['psk1', 'psk1'])
+
+    def test_changed_key(self):
+        self.connect()
+        self.network['key'] = 'password2'
+        self.connect()
+        self.assertEquals(self.wiface.authenticated, ['psk1', 'psk2'])
+
+class HungThread(networking.ConnectThread):
+    """ A connection that hangs in a command, like a DHCP client that
+    gets no answer. """
+    def _connect(self):
+        self.is_connecting = True
+        self.run_dhcp()
+        self.connect_result = 'success'
+
+    @networking.abortable
+    def run_dhcp(self):
+        self.SetStatus('running_dhcp')
+        misc.Run(['sleep', '30'])
+
+class TestAbort(unittest.TestCase):
+    def test_abort_latency(self):
+        thread = HungThread({'essid' : 'home'}, 'wlan0', None, None, None,
+                            None, None, None, None, None, None, None, False)
+        thread.start()
+        time.sleep(0.2)
+        start = time.time()
+        thread.should_die = True
+        thread.join(5)
+        latency = time.time() - start
+        self.assertFalse(thread.isAlive())
+        self.assertEquals(thread.connect_result, 'aborted')
+        # The hung command is killed, rather than waited for.
+        self.assertTrue(latency < 1, 'aborting took %.2f seconds' % latency)
+
+def suite():
+    suite = unittest.TestSuite()
+    tests = []
+    [ tests.append(test) for test in dir(TestConnectTraces) if test.startswith('test') ]
+    for test in tests:
+        suite.addTest(TestConnectTraces(test))
+    tests = []
+    [ tests.append(test) for test in dir(TestPSKCache) if test.startswith('test') ]
+    for test in tests:
+        suite.addTest(TestPSKCache(test))
+    tests = []
+    [ tests.append(test) for test in dir(TestAbort) if test.startswith('test') ]
+    for test in tests:
+        suite.addTest(TestAbort(test))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main()
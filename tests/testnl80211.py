@@ -0,0 +1,126 @@
+#!/usr/bin/python
+
+import binascii
+import struct
+import unittest
+from wicd import netlink
+from wicd import nl80211
+
+# NL80211_CMD_GET_SCAN dump of five BSSes, as returned by the kernel
+# (NLM_F_MULTI messages with a nested NL80211_ATTR_BSS, followed by
+# NLMSG_DONE):
+#   00:1C:10:AA:BB:01 HomeNet    2437 MHz -47 dBm RSN + WMM
+#   00:1C:10:AA:BB:02 OldRouter  2412 MHz -68 dBm WPA
+#   00:1C:10:AA:BB:03 Cafe WEP   2462 MHz -81 dBm privacy, no WPA/RSN
+#   00:1C:10:AA:BB:04 (hidden)   2472 MHz -55 dBm open, NUL ESSID
+#   02:11:22:33:44:55 adhoc-5g   5180 MHz -90 dBm IBSS
+SCAN_DUMP = binascii.unhexlify(
+    'a80000001c00020007000000921000002201000008002e000100000008000300'
+    '0300000084002f800a000100001c10aabb01000008000200850900000c000300'
+    '15cd5b0700000000060004006400000006000500110400003f0006000007486f'
+    '6d654e6574010882848b962430486c03010630140100000fac040100000fac04'
+    '0100000fac02000032040c121860dd070050f2020101000008000700a4edffff'
+    '08000a0078000000980000001c00020007000000921000002201000008002e00'
+    '01000000080003000300000074002f800a000100001c10aabb02000008000200'
+    '6c0900000c00030015cd5b070000000006000400640000000600050011040000'
+    '3000060000094f6c64526f75746572010482848b96030101dd160050f2010100'
+    '0050f20201000050f20201000050f2020800070070e5ffff08000a0078000000'
+    '800000001c00020007000000921000002201000008002e000100000008000300'
+    '030000005c002f800a000100001c10aabb030000080002009e0900000c000300'
+    '15cd5b0700000000060004006400000006000500110000001700060000084361'
+    '666520574550010482840b1603010b00080007005ce0ffff08000a0078000000'
+    '7c0000001c00020007000000921000002201000008002e000100000008000300'
+    '0300000058002f800a000100001c10aabb04000008000200a80900000c000300'
+    '15cd5b0700000000060004006400000006000500010400001100060000040000'
+    '00000102828403010d0000000800070084eaffff08000a007800000080000000'
+    '1c00020007000000921000002201000008002e00010000000800030003000000'
+    '5c002f800a0001000211223344550000080002003c1400000c00030015cd5b07'
+    '00000000060004006400000006000500020000001800060000086164686f632d'
+    '356701088c129824b048606c08000700d8dcffff08000a007800000014000000'
+    '03000200070000009210000000000000')
+
+class TestNl80211(unittest.TestCase):
+    def setUp(self):
+        self.aps = nl80211.parse_scan_dump(SCAN_DUMP)
+
+    def test_scan_dump_count(self):
+        self.assertEquals(len(self.aps), 5)
+
+    def test_scan_dump_keys(self):
+        for ap in self.aps:
+            for key in ['essid', 'hidden', 'channel', 'bitrates', 'bssid',
+                        'mode', 'encryption', 'quality', 'strength']:
+                self.assertTrue(key in ap)
+
+    def test_bssid(self):
+        self.assertEquals(self.aps[0]['bssid'], '00:1C:10:AA:BB:01')
+        self.assertEquals(self.aps[4]['bssid'], '02:11:22:33:44:55')
+
+    def test_essid(self):
+        self.assertEquals(self.aps[0]['essid'], 'HomeNet')
+        self.assertEquals(self.aps[2]['essid'], 'Cafe WEP')
+        self.assertFalse(self.aps[0]['hidden'])
+
+    def test_hidden_essid(self):
+        self.assertEquals(self.aps[3]['essid'], '<hidden>')
+        self.assertTrue(self.aps[3]['hidden'])
+
+    def test_channel(self):
+        self.assertEquals([ap['channel'] for ap in self.aps],
+                          ['6', '1', '11', '13', '36'])
+
+    def test_bitrates(self):
+        self.assertEquals(self.aps[0]['bitrates'],
+                          ['1', '2', '5.5', '6', '9', '11', '12', '18', '24',
+                           '36', '48', '54'])
+        self.assertEquals(self.aps[2]['bitrates'], ['1', '2', '5.5', '11'])
+
+    def test_mode(self):
+        self.assertEquals(self.aps[0]['mode'], 'Master')
+        self.assertEquals(self.aps[4]['mode'], 'Ad-Hoc')
+
+    def test_encryption_wpa2(self):
+        self.assertTrue(self.aps[0]['encryption'])
+        self.assertEquals(self.aps[0]['encryption_method'], 'WPA2')
+
+    def test_encryption_wpa(self):
+        self.assertEquals(self.aps[1]['encryption_method'], 'WPA')
+
+    def test_encryption_wep(self):
+        self.assertEquals(self.aps[2]['encryption_method'], 'WEP')
+
+    def test_no_encryption(self):
+        self.assertFalse(self.aps[3]['encryption'])
+        self.assertFalse('encryption_method' in self.aps[3])
+
+    def test_signal(self):
+        self.assertEquals(self.aps[0]['strength'], '-47')
+        self.assertEquals(self.aps[0]['quality'], 90)
+        self.assertEquals(self.aps[4]['strength'], '-90')
+        self.assertEquals(self.aps[4]['quality'], 28)
+
+    def test_freq_to_channel(self):
+        self.assertEquals(nl80211.freq_to_channel(2412), 1)
+        self.assertEquals(nl80211.freq_to_channel(2484), 14)
+        self.assertEquals(nl80211.freq_to_channel(5745), 149)
+        self.assertEquals(nl80211.freq_to_channel(900), None)
+
+    def test_truncated_ie(self):
+        ies = nl80211.parse_ies('\x00\x04Home\x01\x08\x82')
+        self.assertEquals(ies, [(0, 'Home')])
+
+    def test_bss_without_bssid(self):
+        attrs = {nl80211.NL80211_ATTR_BSS : netlink.pack_attr(
+            nl80211.NL80211_BSS_FREQUENCY, struct.pack('I', 2412))}
+        self.assertEquals(nl80211.parse_bss(attrs), None)
+
+def suite():
+    suite = unittest.TestSuite()
+    tests = []
+    [ tests.append(test) for test in dir(TestNl80211) if test.startswith('test') ]
+    for test in tests:
+        suite.addTest(TestNl80211(test))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main()
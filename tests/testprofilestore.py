@@ -0,0 +1,151 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import threading
+import tempfile
+import unittest
+from wicd.configmanager import ConfigManager
+from wicd.profilestore import SQLiteProfileStore
+from wicd.scanstore import ProfileIndex
+
+SETTINGS = """[00:11:22:33:44:55]
+bssid = 00:11:22:33:44:55
+essid = home
+channel = 6
+automatic = True
+key = `'` secret `'`
+dhcphostname = None
+
+[essid:work]
+bssid = 00:11:22:33:44:66
+essid = work
+use_settings_globally = True
+"""
+
+EXTRA = """[00:11:22:33:44:77]
+bssid = 00:11:22:33:44:77
+essid = home
+"""
+
+class TestSQLiteProfileStore(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'wireless-settings.conf')
+        conf = open(self.path, 'w')
+        conf.write(SETTINGS)
+        conf.close()
+        os.mkdir(self.path + '.d')
+        conf = open(os.path.join(self.path + '.d', 'extra'), 'w')
+        conf.write(EXTRA)
+        conf.close()
+        self.store = SQLiteProfileStore(os.path.join(self.dir, 'profiles.db'))
+        self.store.import_config(self.path)
+
+    def tearDown(self):
+        self.store.db.close()
+        shutil.rmtree(self.dir)
+
+    def test_import(self):
+        self.assertEquals(self.store.sections(),
+                          ['00:11:22:33:44:55', '00:11:22:33:44:77',
+                           'essid:work'])
+        section = '00:11:22:33:44:55'
+        self.assertEquals(self.store.get(section, 'channel'), 6)
+        self.assertEquals(self.store.get(section, 'automatic'), True)
+        self.assertEquals(self.store.get(section, 'key'), ' secret ')
+        self.assertEquals(self.store.get(section, 'dhcphostname'), None)
+        self.assertEquals(self.store.get(section, 'missing'), None)
+
+    def test_values_match_config_manager(self):
+        config = ConfigManager(self.path)
+        for section in config.sections():
+            section_config = config.get_section(section)
+            section_config.pop('_filename_', None)
+            section_store = self.store.get_section(section)
+            section_store.pop('_filename_', None)
+            self.assertEquals(section_store, section_config)
+
+    def test_set_section(self):
+        profile = self.store.get_section('00:11:22:33:44:55')
+        generation = self.store.generation
+        self.assertFalse(self.store.set_section('00:11:22:33:44:55',
+                                                profile))
+        self.assertEquals(self.store.generation, generation)
+        profile['channel'] = 11
+        self.assertTrue(self.store.set_section('00:11:22:33:44:55',
+                                               profile))
+        store = SQLiteProfileStore(self.store.config_file)
+        self.assertEquals(store.get('00:11:22:33:44:55', 'channel'), 11)
+
+    def test_remove_section(self):
+        self.store.remove_section('essid:work')
+        self.assertFalse(self.store.has_section('essid:work'))
+        self.assertEquals(self.store.get_section('essid:work'), None)
+
+    def test_find_sections(self):
+        self.assertEquals(self.store.find_sections(essid='home'),
+                          ['00:11:22:33:44:55', '00:11:22:33:44:77'])
+        self.assertEquals(self.store.find_sections(bssid='00:11:22:33:44:66'),
+                          ['essid:work'])
+        self.store.set('essid:work', 'bssid', '00:11:22:33:44:88')
+        self.assertEquals(self.store.find_sections(bssid='00:11:22:33:44:66'),
+                          [])
+
+    def test_batch(self):
+        other = SQLiteProfileStore(self.store.config_file)
+        batch = self.store.batch()
+        batch.__enter__()
+        self.store.set('00:11:22:33:44:55', 'channel', 1)
+        self.assertEquals(other.get('00:11:22:33:44:55', 'channel'), 6)
+        batch.__exit__(None, None, None)
+        other.reload()
+        self.assertEquals(other.get('00:11:22:33:44:55', 'channel'), 1)
+        other.db.close()
+
+    def test_profile_index(self):
+        index = ProfileIndex(self.store)
+        self.assertEquals(index.get_profile('work', '00:11:22:33:44:99')[0],
+                          'essid:work')
+        self.assertEquals(index.get_profile('home', '00:11:22:33:44:55')[0],
+                          '00:11:22:33:44:55')
+        self.assertEquals(index.get_profile('cafe', '00:11:22:33:44:99'),
+                          (None, None))
+
+    def test_other_thread(self):
+        results = []
+        errors = []
+        def read():
+            try:
+                results.append(self.store.get_profile('work',
+                                                      '00:11:22:33:44:66'))
+                self.store.set('00:11:22:33:44:55', 'channel', 11)
+            except Exception, e:
+                errors.append(e)
+        thread = threading.Thread(target=read)
+        thread.start()
+        thread.join()
+        self.assertEquals(errors, [])
+        self.assertEquals(results[0][0], 'essid:work')
+        self.assertEquals(self.store.get('00:11:22:33:44:55', 'channel'), 11)
+
+    def test_export(self):
+        self.store.set('00:11:22:33:44:77', 'channel', 3)
+        path = os.path.join(self.dir, 'exported.conf')
+        self.store.export_config(path)
+        config = ConfigManager(path)
+        self.assertEquals(config.get('00:11:22:33:44:55', 'key'), ' secret ')
+        self.assertFalse('00:11:22:33:44:77' in config.sections())
+        extra = ConfigManager(os.path.join(self.path + '.d', 'extra'))
+        self.assertEquals(extra.get('00:11:22:33:44:77', 'channel'), 3)
+
+def suite():
+    suite = unittest.TestSuite()
+    tests = []
+    [ tests.append(test) for test in dir(TestSQLiteProfileStore) if test.startswith('test') ]
+    for test in tests:
+        suite.addTest(TestSQLiteProfileStore(test))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+#!/usr/bin/python
+
+import os
+import tempfile
+import unittest
+from wicd import scanstore
+from wicd.configmanager import ConfigManager
+
+PROFILES = """[00:00:00:00:00:01]
+essid = home
+automatic = True
+channel = 6
+
+[essid:work]
+essid = work
+use_settings_globally = True
+key = secret
+
+[00:00:00:00:00:02]
+essid = work
+key = old
+
+[essid:cafe]
+essid = cafe
+use_settings_globally = False
+"""
+
+def network(bssid, essid, quality=50):
+    return {'bssid' : bssid, 'essid' : essid, 'quality' : quality}
+
+class TestScanStore(unittest.TestCase):
+    def setUp(self):
+        self.store = scanstore.ScanStore()
+        self.store.update([network('00:00:00:00:00:01', 'home'),
+                           network('00:00:00:00:00:02', 'work'),
+                           network('00:00:00:00:00:03', 'home')])
+
+    def test_list_access(self):
+        self.assertEquals(len(self.store), 3)
+        self.assertEquals(self.store[1]['essid'], 'work')
+        self.assertEquals([n['essid'] for n in self.store],
+                          ['home', 'work', 'home'])
+
+    def test_by_bssid(self):
+        self.assertEquals(self.store.by_bssid('00:00:00:00:00:02')['essid'],
+                          'work')
+        self.assertEquals(self.store.by_bssid('00:00:00:00:00:09'), None)
+
+    def test_by_essid_in_network_id_order(self):
+        self.assertEquals([self.store.get_id(n)
+                           for n in self.store.by_essid('home')], [0, 2])
+        self.assertEquals(self.store.by_essid('nowhere'), [])
+
+    def test_set_essid_updates_index(self):
+        self.store.set_property(self.store[1], 'essid', 'home')
+        self.assertEquals(len(self.store.by_essid('home')), 3)
+        self.assertEquals(self.store.by_essid('work'), [])
+
+    def test_handles_survive_rescan(self):
+        handle = self.store.get_handle(self.store[2])
+        self.store.update([network('00:00:00:00:00:03', 'home', 90),
+                           network('00:00:00:00:00:04', 'cafe')])
+        self.assertEquals(self.store.by_handle(handle)['quality'], 90)
+        self.assertEquals(self.store.get_id(self.store.by_handle(handle)), 0)
+
+    def test_handles_are_not_reused(self):
+        old = self.store.handles()
+        self.store.update([network('00:00:00:00:00:04', 'cafe')])
+        self.assertFalse(self.store.handles()[0] in old)
+        for handle in old:
+            self.assertEquals(self.store.by_handle(handle), None)
+
+    def test_handle_of_gone_network(self):
+        gone = network('00:00:00:00:00:09', 'gone')
+        self.assertEquals(self.store.get_handle(gone), scanstore.NO_HANDLE)
+        self.assertEquals(self.store.get_id(gone), -1)
+
+class TestProfileIndex(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.write(fd, PROFILES)
+        os.close(fd)
+        self.config = ConfigManager(self.path)
+        self.index = scanstore.ProfileIndex(self.config)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_bssid_profile(self):
+        section, profile = self.index.get_profile('home', '00:00:00:00:00:01')
+        self.assertEquals(section, '00:00:00:00:00:01')
+        self.assertEquals(profile['automatic'], True)
+        self.assertEquals(profile['channel'], 6)
+
+    def test_global_profile(self):
+        section, profile = self.index.get_profile('work', '00:00:00:00:00:02')
+        self.assertEquals(section, 'essid:work')
+        self.assertEquals(profile['key'], 'secret')
+
+    def test_global_profile_not_in_use(self):
+        self.assertEquals(self.index.get_profile('cafe', '00:00:00:00:00:03'),
+                          (None, None))
+
+    def test_same_values_as_config(self):
+        section, profile = self.index.get_profile('home', '00:00:00:00:00:01')
+        for option in self.config.options(section):
+            self.assertEquals(profile[option], self.config.get(section, option))
+
+    def test_invalidated_on_change(self):
+        self.index.get_profile('home', '00:00:00:00:00:01')
+        self.config.set('00:00:00:00:00:01', 'channel', '11')
+        section, profile = self.index.get_profile('home', '00:00:00:00:00:01')
+        self.assertEquals(profile['channel'], 11)
+        self.config.remove_section('00:00:00:00:00:01')
+        self.assertEquals(self.index.get_profile('home', '00:00:00:00:00:01'),
+                          (None, None))
+
+def suite():
+    suite = unittest.TestSuite()
+    tests = []
+    [ tests.append(test) for test in dir(TestScanStore) if test.startswith('test') ]
+    for test in tests:
+        suite.addTest(TestScanStore(test))
+    tests = []
+    [ tests.append(test) for test in dir(TestProfileIndex) if test.startswith('test') ]
+    for test in tests:
+        suite.addTest(TestProfileIndex(test))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main()
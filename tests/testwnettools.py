@@ -1,4 +1,10 @@
+import os
+import shutil
+import tempfile
+import time
 import unittest
+from wicd import misc
+from wicd import netlink
 from wicd import wnettools
 
 class TestWnettools(unittest.TestCase):
@@ -53,12 +59,231 @@ class TestWnettools(unittest.TestCase):
 			psk = interface.GeneratePSK({'essid' : 'Network 1', 'key' : 'arandompassphrase'})
 			self.assertEquals(psk, 'd70463014514f4b4ebb8e3aebbdec13f4437ac3a9af084b3433f3710e658a7be')
 
+	def test_validate_authentication_cancelled(self):
+		interface = wnettools.BaseWirelessInterface('wicdtest0')
+		# Prints wpa_state=COMPLETED, whatever the arguments.
+		interface.wpa_cli_cmd = r'printf wpa_state=COMPLETED\n'
+		self.assertTrue(interface.ValidateAuthentication(time.time(),
+														 lambda: False))
+		self.assertFalse(interface.ValidateAuthentication(time.time(),
+														  lambda: True))
+
+class TestDHCPLeases(unittest.TestCase):
+	def setUp(self):
+		self.varlib = wnettools.wpath.varlib
+		wnettools.wpath.varlib = tempfile.mkdtemp()
+		self.interface = wnettools.BaseInterface('eth0')
+		self.interface.dhcp_lease_key = '00:11:22:33:44:55'
+
+	def tearDown(self):
+		shutil.rmtree(wnettools.wpath.varlib)
+		wnettools.wpath.varlib = self.varlib
+
+	def test_dhclient_lease_file_per_network(self):
+		option = self.interface._get_lease_option('dhclient')
+		self.assertEquals(option, '-lf %s ' % os.path.join(
+			wnettools.wpath.varlib, 'leases', '00%3A11%3A22%3A33%3A44%3A55.leases'))
+		self.interface.dhcp_lease_key = 'wired:wired-default'
+		self.assertNotEquals(self.interface._get_lease_option('dhclient'), option)
+
+	def test_dhclient_release_uses_lease_file(self):
+		self.interface.dhclient_cmd = '/sbin/dhclient'
+		self.interface.DHCP_CLIENT = misc.DHCLIENT
+		etc = wnettools.wpath.etc
+		wnettools.wpath.etc = wnettools.wpath.varlib
+		open(os.path.join(wnettools.wpath.etc, 'dhclient.conf.template'),
+			 'w').close()
+		try:
+			self.assertEquals(self.interface._get_dhcp_command('release'),
+							  '/sbin/dhclient -r %seth0' %
+							  self.interface._get_lease_option('dhclient'))
+		finally:
+			wnettools.wpath.etc = etc
+
+	def test_requested_address(self):
+		self.interface.dhcpcd_cmd = '/sbin/dhcpcd'
+		self.interface.DHCP_CLIENT = misc.DHCPCD
+		self.interface.GetIP = lambda: '192.168.1.23'
+		self.assertEquals(self.interface._get_dhcp_command('connect'),
+						  '/sbin/dhcpcd --noipv4ll eth0')
+		self.interface._save_lease_address()
+		self.assertEquals(self.interface._get_dhcp_command('connect'),
+						  '/sbin/dhcpcd -r 192.168.1.23 --noipv4ll eth0')
+		self.interface.dhcp_lease_key = None
+		self.assertEquals(self.interface._get_dhcp_command('connect'),
+						  '/sbin/dhcpcd --noipv4ll eth0')
+
+class TestInterfaceCache(unittest.TestCase):
+	def setUp(self):
+		self.cache = wnettools.InterfaceCache(max_entries=3)
+		self.commands = []
+		self.run = misc.Run
+		misc.Run = self.fake_run
+		wnettools.cache.invalidate()
+		self.interface = wnettools.BaseInterface('lo')
+
+	def tearDown(self):
+		misc.Run = self.run
+
+	def fake_run(self, cmd, *args, **kwargs):
+		self.commands.append(cmd)
+		return 'output %d' % len(self.commands)
+
+	def store(self, iface, key, value, duration=5):
+		generation = self.cache.lookup(iface, key)[1]
+		self.cache.store(iface, key, value, duration, generation)
+
+	def test_hits_and_misses(self):
+		self.assertEquals(self.cache.lookup('eth0', ('a',))[0],
+						  wnettools._MISSING)
+		self.store('eth0', ('a',), 1)
+		self.assertEquals(self.cache.lookup('eth0', ('a',))[0], 1)
+		self.assertEquals(self.cache.lookup('wlan0', ('a',))[0],
+						  wnettools._MISSING)
+		self.assertEquals((self.cache.hits, self.cache.misses), (1, 3))
+
+	def test_expiry(self):
+		self.store('eth0', ('a',), 1, duration=0)
+		self.assertEquals(self.cache.lookup('eth0', ('a',))[0],
+						  wnettools._MISSING)
+		self.assertEquals(len(self.cache), 0)
+
+	def test_least_recently_used_is_evicted(self):
+		for key in ['a', 'b', 'c']:
+			self.store('eth0', (key,), key)
+		self.cache.lookup('eth0', ('a',))
+		self.store('wlan0', ('d',), 'd')
+		self.assertEquals(len(self.cache), 3)
+		self.assertEquals(self.cache.evictions, 1)
+		self.assertEquals(self.cache.lookup('eth0', ('b',))[0],
+						  wnettools._MISSING)
+		self.assertEquals(self.cache.lookup('eth0', ('a',))[0], 'a')
+
+	def test_invalidate(self):
+		self.store('eth0', ('a',), 1)
+		self.store('wlan0', ('a',), 2)
+		self.cache.invalidate('eth0')
+		self.assertEquals(self.cache.lookup('eth0', ('a',))[0],
+						  wnettools._MISSING)
+		self.assertEquals(self.cache.lookup('wlan0', ('a',))[0], 2)
+		self.assertEquals(len(self.cache), 1)
+
+	def test_result_of_probe_older_than_invalidation_is_dropped(self):
+		generation = self.cache.lookup('eth0', ('a',))[1]
+		self.cache.invalidate('eth0')
+		self.cache.store('eth0', ('a',), 'stale', 5, generation)
+		self.assertEquals(self.cache.lookup('eth0', ('a',))[0],
+						  wnettools._MISSING)
+
+	def test_probe_is_shared(self):
+		self.assertEquals(self.interface.GetIfconfig(), 'output 1')
+		self.assertEquals(self.interface.GetIfconfig(), 'output 1')
+		self.assertEquals(len(self.commands), 1)
+
+	def test_state_change_invalidates(self):
+		self.interface.GetIfconfig()
+		self.interface.Down()
+		self.assertEquals(self.interface.GetIfconfig(), 'output 3')
+		self.assertEquals(self.commands,
+						  ['ifconfig lo', 'ifconfig lo down', 'ifconfig lo'])
+
+class FakeEvents(object):
+	def __init__(self):
+		self.events = []
+
+	def read_events(self):
+		events, self.events = self.events, []
+		return events
+
+	def close(self):
+		pass
+
+class TestInterfaceRegistry(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.add('lo', 1, 772)
+		self.add('eth0', 2, 1)
+		self.add('wlan0', 3, 1, 'wireless')
+		open(os.path.join(self.dir, 'bonding_masters'), 'w').close()
+		self.registry = wnettools.InterfaceRegistry(self.dir,
+													use_netlink=False)
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def add(self, name, index, dev_type, subdir=None):
+		path = os.path.join(self.dir, name)
+		os.mkdir(path)
+		open(os.path.join(path, 'ifindex'), 'w').write('%d\n' % index)
+		open(os.path.join(path, 'type'), 'w').write('%d\n' % dev_type)
+		if subdir:
+			os.mkdir(os.path.join(path, subdir))
+
+	def test_kinds(self):
+		self.assertEquals(self.registry.interfaces(), ['lo', 'eth0', 'wlan0'])
+		self.assertEquals(self.registry.interfaces(wnettools.IFACE_WIRED),
+						  ['eth0'])
+		self.assertEquals(self.registry.interfaces(wnettools.IFACE_WIRELESS),
+						  ['wlan0'])
+		self.assertTrue(self.registry.exists('eth0'))
+		self.assertFalse(self.registry.exists('bonding_masters'))
+
+	def test_listed_once(self):
+		for n in range(5):
+			self.registry.exists('eth0')
+		self.assertEquals(self.registry.listings, 1)
+
+	def test_polling(self):
+		self.registry.interfaces()
+		self.add('eth1', 4, 1)
+		self.assertFalse(self.registry.exists('eth1'))
+		self.registry._listed -= wnettools.REGISTRY_POLL_INTERVAL + 1
+		self.assertTrue(self.registry.exists('eth1'))
+		self.assertEquals(self.registry.listings, 2)
+
+	def test_netlink_events(self):
+		events = self.registry._events = FakeEvents()
+		self.registry.interfaces()
+		self.add('veth0', 4, 1)
+		events.events = [{'type' : netlink.RTM_NEWLINK, 'index' : 4,
+						  'ifname' : 'veth0', 'dev_type' : 1},
+						 {'type' : netlink.RTM_DELLINK, 'index' : 2,
+						  'ifname' : 'eth0', 'dev_type' : 1},
+						 {'type' : netlink.RTM_NEWLINK, 'index' : 3,
+						  'ifname' : 'wlan1', 'dev_type' : 1}]
+		self.assertEquals(self.registry.interfaces(wnettools.IFACE_WIRED),
+						  ['veth0'])
+		self.assertEquals(self.registry.interfaces(wnettools.IFACE_WIRELESS),
+						  ['wlan1'])
+		self.assertFalse(self.registry.exists('eth0'))
+		self.assertEquals(self.registry.listings, 1)
+
+	def test_overrun_lists_again(self):
+		events = self.registry._events = FakeEvents()
+		self.registry.interfaces()
+		self.add('eth1', 4, 1)
+		events.events = [{'type' : netlink.EVENT_OVERRUN, 'index' : 0}]
+		self.assertTrue(self.registry.exists('eth1'))
+		self.assertEquals(self.registry.listings, 2)
+
 def suite():
 	suite = unittest.TestSuite()
 	tests = []
 	[ tests.append(test) for test in dir(TestWnettools) if test.startswith('test') ]
 	for test in tests:
 		suite.addTest(TestWnettools(test))
+	tests = []
+	[ tests.append(test) for test in dir(TestDHCPLeases) if test.startswith('test') ]
+	for test in tests:
+		suite.addTest(TestDHCPLeases(test))
+	tests = []
+	[ tests.append(test) for test in dir(TestInterfaceCache) if test.startswith('test') ]
+	for test in tests:
+		suite.addTest(TestInterfaceCache(test))
+	tests = []
+	[ tests.append(test) for test in dir(TestInterfaceRegistry) if test.startswith('test') ]
+	for test in tests:
+		suite.addTest(TestInterfaceRegistry(test))
 	return suite
 
 if __name__ == '__main__':
@@ -0,0 +1,238 @@
+#!/usr/bin/python
+
+import os
+import time
+import shutil
+import select
+import socket
+import tempfile
+import threading
+import unittest
+from wicd import wpasupplicant
+
+class FakeSupplicant(threading.Thread):
+    """ Answers on a control socket like wpa_supplicant would. """
+    def __init__(self, path, state='SCANNING'):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.state = state
+        self.requests = []
+        self.monitors = []
+        self.networks = 0
+        # Requests starting with any of these are answered with FAIL.
+        self.refused = []
+        self.running = True
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(path)
+
+    def run(self):
+        while self.running:
+            if not select.select([self.sock], [], [], 0.05)[0]:
+                continue
+            cmd, addr = self.sock.recvfrom(4096)
+            self.requests.append(cmd)
+            if cmd == 'ATTACH':
+                self.monitors.append(addr)
+                reply = 'OK\n'
+            elif cmd == 'DETACH':
+                self.monitors.remove(addr)
+                reply = 'OK\n'
+            elif cmd == 'STATUS':
+                reply = 'bssid=00:11:22:33:44:55\nssid=home\n' \
+                        'wpa_state=%s\n' % self.state
+            elif [prefix for prefix in self.refused
+                  if cmd.startswith(prefix)]:
+                reply = 'FAIL\n'
+            elif cmd == 'ADD_NETWORK':
+                reply = '%d\n' % self.networks
+                self.networks += 1
+            else:
+                reply = 'OK\n'
+            self.sock.sendto(reply, addr)
+
+    def send_event(self, event, priority=2):
+        for addr in self.monitors:
+            self.sock.sendto('<%d>%s' % (priority, event), addr)
+
+    def send_event_later(self, delay, event, state=None):
+        def send():
+            time.sleep(delay)
+            if state:
+                self.state = state
+            self.send_event(event)
+        threading.Thread(target=send).start()
+
+    def stop(self):
+        self.running = False
+        self.join()
+        self.sock.close()
+
+class TestWpaSupplicant(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = wpasupplicant.ctrl_path('wlan0', self.dir)
+        self.supplicant = FakeSupplicant(self.path)
+        self.supplicant.start()
+        self.ctrl = wpasupplicant.WpaCtrl(self.path, client_dir=self.dir)
+
+    def tearDown(self):
+        self.ctrl.close()
+        self.supplicant.stop()
+        shutil.rmtree(self.dir)
+
+    def test_parse_event(self):
+        self.assertEquals(wpasupplicant.parse_event(
+            '<2>CTRL-EVENT-CONNECTED - Connection to 00:11:22:33:44:55'),
+            (2, 'CTRL-EVENT-CONNECTED',
+             'CTRL-EVENT-CONNECTED - Connection to 00:11:22:33:44:55'))
+        self.assertEquals(wpasupplicant.parse_event('OK\n'), None)
+
+    def test_status(self):
+        status = self.ctrl.status()
+        self.assertEquals(status['wpa_state'], 'SCANNING')
+        self.assertEquals(status['ssid'], 'home')
+
+    def test_events_are_queued(self):
+        self.ctrl.attach()
+        self.supplicant.send_event('CTRL-EVENT-SCAN-RESULTS')
+        time.sleep(0.1)
+        self.assertEquals(self.ctrl.status()['wpa_state'], 'SCANNING')
+        self.assertEquals(self.ctrl.recv_event(0)[1],
+                          'CTRL-EVENT-SCAN-RESULTS')
+        self.assertEquals(self.ctrl.recv_event(0.05), None)
+
+    def test_close_removes_socket(self):
+        self.ctrl.attach()
+        self.ctrl.close()
+        self.assertEquals(os.listdir(self.dir), ['wlan0'])
+        time.sleep(0.1)
+        self.assertEquals(self.supplicant.requests[-1], 'DETACH')
+
+    def test_missing_supplicant(self):
+        self.assertRaises(wpasupplicant.WpaCtrlError, wpasupplicant.WpaCtrl,
+                          os.path.join(self.dir, 'wlan1'), self.dir)
+
+    def test_wait_for_exit(self):
+        threading.Timer(0.2, os.remove, [self.path]).start()
+        self.assertTrue(wpasupplicant.wait_for_exit(self.path, timeout=5))
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_wait_for_exit_timeout(self):
+        start = time.time()
+        self.assertFalse(wpasupplicant.wait_for_exit(self.path, timeout=0.3))
+        self.assertTrue(time.time() - start < 2)
+
+    def test_already_completed(self):
+        self.supplicant.state = 'COMPLETED'
+        self.assertTrue(wpasupplicant.validate_authentication(
+            self.ctrl, time.time() + 5))
+
+    def test_connected_event(self):
+        self.supplicant.send_event_later(0.2, 'CTRL-EVENT-CONNECTED - '
+                                         'Connection to 00:11:22:33:44:55 '
+                                         'completed', state='COMPLETED')
+        start = time.time()
+        self.assertTrue(wpasupplicant.validate_authentication(
+            self.ctrl, time.time() + 5))
+        # No waiting for the next poll once the event arrived.
+        self.assertTrue(time.time() - start < 0.5)
+
+    def test_wrong_key(self):
+        self.supplicant.send_event_later(0.1, 'CTRL-EVENT-SSID-TEMP-DISABLED '
+                                         'id=0 ssid="home" auth_failures=1 '
+                                         'duration=10 reason=WRONG_KEY')
+        start = time.time()
+        self.assertFalse(wpasupplicant.validate_authentication(
+            self.ctrl, time.time() + 5))
+        self.assertTrue(time.time() - start < 0.5)
+
+    def test_timeout(self):
+        start = time.time()
+        self.assertFalse(wpasupplicant.validate_authentication(
+            self.ctrl, time.time() + 0.3))
+        self.assertTrue(time.time() - start < 1)
+
+    def test_rescan_when_disconnected(self):
+        self.supplicant.state = 'DISCONNECTED'
+        self.supplicant.send_event_later(0.1, 'CTRL-EVENT-DISCONNECTED '
+                                         'bssid=00:11:22:33:44:55 reason=3')
+        self.supplicant.send_event_later(1.3, 'CTRL-EVENT-CONNECTED',
+                                         state='COMPLETED')
+        self.assertTrue(wpasupplicant.validate_authentication(
+            self.ctrl, time.time() + 1.5, max_disconnected_time=0.5))
+        self.assertTrue('SCAN' in self.supplicant.requests)
+
+CONFIG = """ap_scan=1
+ctrl_interface=/var/run/wpa_supplicant
+eapol_version=1
+network={
+       ssid="home net"
+       scan_ssid=1
+       key_mgmt=WPA-PSK
+       psk="s3cret=key"
+}
+"""
+
+class TestConfigureNetworks(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = wpasupplicant.ctrl_path('wlan0', self.dir)
+        self.supplicant = FakeSupplicant(self.path, state='COMPLETED')
+        self.supplicant.start()
+        self.ctrl = wpasupplicant.WpaCtrl(self.path, client_dir=self.dir)
+
+    def tearDown(self):
+        self.ctrl.close()
+        self.supplicant.stop()
+        shutil.rmtree(self.dir)
+
+    def test_parse_config(self):
+        settings, networks = wpasupplicant.parse_config(CONFIG)
+        self.assertEquals(settings, [('ap_scan', '1'),
+                                     ('ctrl_interface',
+                                      '/var/run/wpa_supplicant'),
+                                     ('eapol_version', '1')])
+        self.assertEquals(networks, [[('ssid', '"home net"'),
+                                      ('scan_ssid', '1'),
+                                      ('key_mgmt', 'WPA-PSK'),
+                                      ('psk', '"s3cret=key"')]])
+
+    def test_configure_networks(self):
+        self.supplicant.networks = 3
+        wpasupplicant.configure_networks(self.ctrl, CONFIG)
+        self.assertEquals(self.supplicant.requests,
+                          ['AP_SCAN 1',
+                           'SET eapol_version 1',
+                           'REMOVE_NETWORK all',
+                           'ADD_NETWORK',
+                           'SET_NETWORK 3 ssid "home net"',
+                           'SET_NETWORK 3 scan_ssid 1',
+                           'SET_NETWORK 3 key_mgmt WPA-PSK',
+                           'SET_NETWORK 3 psk "s3cret=key"',
+                           'SELECT_NETWORK 3'])
+
+    def test_refused_value_is_not_logged(self):
+        self.supplicant.refused.append('SET_NETWORK 0 psk')
+        try:
+            wpasupplicant.configure_networks(self.ctrl, CONFIG)
+        except wpasupplicant.WpaCtrlError, e:
+            self.assertTrue('psk' in str(e))
+            self.assertFalse('s3cret' in str(e))
+        else:
+            self.fail('WpaCtrlError not raised')
+        self.assertFalse('SELECT_NETWORK 0' in self.supplicant.requests)
+
+def suite():
+    suite = unittest.TestSuite()
+    tests = []
+    [ tests.append(test) for test in dir(TestWpaSupplicant) if test.startswith('test') ]
+    for test in tests:
+        suite.addTest(TestWpaSupplicant(test))
+    tests = []
+    [ tests.append(test) for test in dir(TestConfigureNetworks) if test.startswith('test') ]
+    for test in tests:
+        suite.addTest(TestConfigureNetworks(test))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main()
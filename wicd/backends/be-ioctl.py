@@ -32,10 +32,11 @@ class WirelessInterface() -- Control a wireless network interface.
 
 from wicd import misc
 from wicd import wpath
+from wicd import wpasupplicant
 from wicd.wnettools import GetDefaultGateway, GetWiredInterfaces, \
 GetWirelessInterfaces, IsValidWpaSuppDriver, BaseWirelessInterface, \
 BaseWiredInterface, BaseInterface, GetWpaSupplicantDrivers, wep_pattern, \
-signaldbm_pattern, neediface
+signaldbm_pattern, neediface, invalidates_cache
 
 try:
     import iwscan
@@ -43,15 +44,7 @@ try:
 except ImportError:
     print "WARNING: python-iwscan not found, falling back to using iwlist scan."
     IWSCAN_AVAIL = False
-try:
-    import wpactrl
-    WPACTRL_AVAIL = True
-except ImportError:
-    print "WARNING: python-wpactrl not found, falling back to using wpa_cli."
-    WPACTRL_AVAIL = False
-
 import re
-import os
 import time
 import socket
 import fcntl
@@ -68,7 +61,6 @@ network information whenever possible.  This makes it fast,
 but it may not work properly on all systems.
 
 (Optional) Dependencies:
-python-wpactrl (http://projects.otaku42.de/wiki/PythonWpaCtrl)
 python-iwscan (http://projects.otaku42.de/browser/python-iwscan/)"""
 
 RALINK_DRIVER = 'ralink legacy'
@@ -131,11 +123,6 @@ class Interface(BaseInterface):
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.Check()
 
-    def CheckWirelessTools(self):
-        """ Check for the existence needed wireless tools """
-        if not WPACTRL_AVAIL:
-            BaseInterface.CheckWirelessTools(self)
-
     @neediface("")
     def GetIP(self, ifconfig=""):
         """ Get the IP address of the interface.
@@ -346,95 +333,21 @@ class WirelessInterface(Interface, BaseWirelessInterface):
 
         return ap
 
-    def _connect_to_wpa_ctrl_iface(self):
-        """ Connect to the wpa ctrl interface. """
-        ctrl_iface = '/var/run/wpa_supplicant'
-        socket_loc = os.path.join(ctrl_iface, self.iface)
-        if os.path.exists(socket_loc):
-            try:
-                return wpactrl.WPACtrl(socket_loc)
-            except wpactrl.error, e:
-                print "Couldn't open ctrl_interface: %s" % e
-                return None
-        else:
-            print "Couldn't find a wpa_supplicant ctrl_interface for iface %s" \
-                % self.iface
-            return None
-
-    def ValidateAuthentication(self, auth_time):
-        """ Validate WPA authentication.
-
-            Validate that the wpa_supplicant authentication
-            process was successful.
-
-            NOTE: It's possible this could return False,
-            though in reality wpa_supplicant just isn't
-            finished yet.
-
-            Keyword arguments:
-            auth_time -- The time at which authentication began.
-
-            Returns:
-            True if wpa_supplicant authenticated succesfully,
-            False otherwise.
-
-        """
-        if not WPACTRL_AVAIL:
-            # If we don't have python-wpactrl, use the slow version.
-            return BaseWirelessInterface.ValidateAuthentication(self, auth_time)
-        
-        # Right now there's no way to do this for ralink drivers
-        if self.wpa_driver == RALINK_DRIVER:
-            return True
-
-        wpa = self._connect_to_wpa_ctrl_iface()
-        if not wpa:
-            print "Failed to open ctrl interface"
-            return False
-
-        MAX_TIME = 35
-        MAX_DISCONNECTED_TIME = 3
-        disconnected_time = 0
-        while (time.time() - auth_time) < MAX_TIME:
-            try:
-                status = wpa.request("STATUS").split("\n")
-            except:
-                print "wpa_supplicant status query failed."
-                return False
-
-            if self.verbose:
-                print 'wpa_supplicant ctrl_interface status query is %s' \
-                    % str(status)
-
-            try:
-                [result] = [l for l in status if l.startswith("wpa_state=")]
-            except ValueError:
-                return False
-
-            if result.endswith("COMPLETED"):
-                return True
-            elif result.endswith("DISCONNECTED"):
-                disconnected_time += 1
-                if disconnected_time > MAX_DISCONNECTED_TIME:
-                    # Force a rescan to get wpa_supplicant moving again.
-                    wpa.request("SCAN")
-                    MAX_TIME += 5
-            else:
-                disconnected_time = 0
-            time.sleep(1)
-
-        print 'wpa_supplicant authentication may have failed.'
-        return False
-
+    @invalidates_cache
     @neediface(False)
-    def StopWPA(self):
+    def StopWPA(self, terminate=False):
         """ Terminates wpa_supplicant using its ctrl interface. """
-        if not WPACTRL_AVAIL:
+        if self.persistent_wpa and not terminate:
             return BaseWirelessInterface.StopWPA(self)
-        wpa = self._connect_to_wpa_ctrl_iface()
-        if not wpa:
-            return
-        wpa.request("TERMINATE")
+        try:
+            wpa = wpasupplicant.WpaCtrl(wpasupplicant.ctrl_path(self.iface))
+        except wpasupplicant.WpaCtrlError:
+            return BaseWirelessInterface.StopWPA(self, terminate)
+        try:
+            wpa.request("TERMINATE")
+        except wpasupplicant.WpaCtrlError, e:
+            print e
+        wpa.close()
 
     def _AuthenticateRalinkLegacy(self, network):
         """ Authenticate with the specified wireless network.
@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" netlink Network interface control tools for wicd.
+
+This module implements functions to control and obtain information from
+network interfaces.  Interfaces are configured with ioctl calls and
+routes through rtnetlink, so connecting doesn't need ifconfig, route
+or ip.  Wireless scans use nl80211 when the driver supports it.
+
+class Interface() -- Control a network interface.
+class WiredInterface() -- Control a wired network interface.
+class WirelessInterface() -- Control a wireless network interface.
+
+"""
+
+#
+#   Copyright (C) 2008-2009 Adam Blackburn
+#   Copyright (C) 2008-2009 Dan O'Reilly
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License Version 2 as
+#   published by the Free Software Foundation.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from wicd import misc
+from wicd import netlink
+from wicd import nl80211
+from wicd.wnettools import GetDefaultGateway, GetWiredInterfaces, \
+GetWirelessInterfaces, IsValidWpaSuppDriver, BaseWirelessInterface, \
+BaseWiredInterface, BaseInterface, GetWpaSupplicantDrivers, neediface, \
+RALINK_DRIVER, invalidates_cache
+
+import socket
+import fcntl
+import struct
+
+
+NAME = "netlink"
+UPDATE_INTERVAL = 4
+DESCRIPTION = """Netlink (experimental) backend
+
+This backend configures interfaces with ioctl calls, manages
+routes through rtnetlink and scans through nl80211, instead of
+running ifconfig, route, ip or iwlist.  Wireless link information
+is still read with iwconfig.
+
+Requires a Linux kernel with rtnetlink support."""
+
+# Got these from /usr/include/sockios.h
+SIOCGIFFLAGS = 0x8913
+SIOCSIFFLAGS = 0x8914
+SIOCGIFADDR = 0x8915
+SIOCSIFADDR = 0x8916
+SIOCSIFBRDADDR = 0x891a
+SIOCSIFNETMASK = 0x891c
+
+IFF_UP = 0x1
+
+
+def NeedsExternalCalls(*args, **kargs):
+    """ Return True, since wireless information comes from iwconfig. """
+    return True
+
+
+class Interface(BaseInterface):
+    """ Control a network interface. """
+    def __init__(self, iface, verbose=False):
+        """ Initialise the object.
+
+        Keyword arguments:
+        iface -- the name of the interface
+        verbose -- whether to print every command run
+
+        """
+        BaseInterface.__init__(self, iface, verbose)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.rtnl = None
+        self.Check()
+
+    def _get_rtnl(self):
+        """ Returns the rtnetlink socket, opening it if needed. """
+        if not self.rtnl:
+            try:
+                self.rtnl = netlink.NetlinkSocket()
+            except socket.error, e:
+                print 'Could not open rtnetlink socket: %s' % str(e)
+                return None
+        return self.rtnl
+
+    def _ifreq(self):
+        """ Returns the interface name padded for a struct ifreq. """
+        return (self.iface + '\0' * 16)[:16]
+
+    def _get_flags(self):
+        """ Returns the interface flags, or None if they can't be read. """
+        data = self._ifreq() + '\0' * 16
+        try:
+            result = fcntl.ioctl(self.sock.fileno(), SIOCGIFFLAGS, data)
+        except IOError, e:
+            if self.verbose:
+                print "SIOCGIFFLAGS failed: " + str(e)
+            return None
+        flags, = struct.unpack('H', result[16:18])
+        return flags
+
+    def _set_flags(self, flags):
+        """ Sets the interface flags.  Returns True on success. """
+        data = self._ifreq() + struct.pack('H', flags) + '\0' * 14
+        try:
+            fcntl.ioctl(self.sock.fileno(), SIOCSIFFLAGS, data)
+        except IOError, e:
+            print "SIOCSIFFLAGS failed: " + str(e)
+            return False
+        return True
+
+    def _set_inet_addr(self, call, addr):
+        """ Sets one of the IPv4 addresses of the interface. """
+        data = self._ifreq() + struct.pack('H2s4s8x', socket.AF_INET, '\0\0',
+                                           socket.inet_aton(addr))
+        try:
+            fcntl.ioctl(self.sock.fileno(), call, data)
+        except IOError, e:
+            print 'Failed to set address %s on %s: %s' % (addr, self.iface,
+                                                          str(e))
+            return False
+        return True
+
+    def _route_request(self, msg_type, payload, flags=0):
+        """ Send a route request, returns True if it succeeded. """
+        rtnl = self._get_rtnl()
+        if not rtnl:
+            return False
+        try:
+            rtnl.request(msg_type, payload, flags)
+        except (netlink.NetlinkError, socket.error), e:
+            if self.verbose:
+                print 'Route request on %s failed: %s' % (self.iface, str(e))
+            return False
+        return True
+
+    @invalidates_cache
+    @neediface(False)
+    def Up(self):
+        """ Bring the network interface up.
+
+        Returns:
+        True
+
+        """
+        if self.verbose:
+            print 'Bringing up %s' % self.iface
+        flags = self._get_flags()
+        if flags is not None and not flags & IFF_UP:
+            self._set_flags(flags | IFF_UP)
+        return True
+
+    @invalidates_cache
+    @neediface(False)
+    def Down(self):
+        """ Take down the network interface.
+
+        Returns:
+        True
+
+        """
+        if self.verbose:
+            print 'Taking down %s' % self.iface
+        flags = self._get_flags()
+        if flags is not None and flags & IFF_UP:
+            self._set_flags(flags & ~IFF_UP)
+        return True
+
+    @invalidates_cache
+    @neediface("")
+    def SetAddress(self, ip=None, netmask=None, broadcast=None):
+        """ Set the IP addresses of an interface.
+
+        Keyword arguments:
+        ip -- interface IP address in dotted quad form
+        netmask -- netmask address in dotted quad form
+        broadcast -- broadcast address in dotted quad form
+
+        """
+        for val in [ip, netmask, broadcast]:
+            if not val:
+                continue
+            if not misc.IsValidIP(val):
+                print 'WARNING: Invalid IP address found, aborting!'
+                return False
+
+        if self.verbose:
+            print 'Setting address of %s: ip %s netmask %s broadcast %s' % \
+                (self.iface, ip, netmask, broadcast)
+        # Same order as ifconfig, since setting the address resets the
+        # netmask and broadcast.
+        if ip:
+            self._set_inet_addr(SIOCSIFADDR, ip)
+        if netmask:
+            self._set_inet_addr(SIOCSIFNETMASK, netmask)
+        if broadcast:
+            self._set_inet_addr(SIOCSIFBRDADDR, broadcast)
+
+    @neediface("")
+    def GetIP(self, ifconfig=""):
+        """ Get the IP address of the interface.
+
+        Returns:
+        The IP address of the interface in dotted quad form.
+
+        """
+        ifstruct = struct.pack('256s', self.iface)
+        try:
+            raw_ip = fcntl.ioctl(self.sock.fileno(), SIOCGIFADDR, ifstruct)
+        except IOError:
+            return None
+        except OSError:
+            return None
+
+        return socket.inet_ntoa(raw_ip[20:24])
+
+    @neediface(False)
+    def IsUp(self, ifconfig=None):
+        """ Determines if the interface is up.
+
+        Returns:
+        True if the interface is up, False otherwise.
+
+        """
+        flags = self._get_flags()
+        if flags is None:
+            return False
+        return bool(flags & IFF_UP)
+
+    @neediface(False)
+    def FlushRoutes(self):
+        """ Flush network routes for this device. """
+        index = netlink.get_ifindex(self.iface)
+        rtnl = self._get_rtnl()
+        if index is None or not rtnl:
+            return
+        if self.verbose:
+            print 'Flushing routes of %s' % self.iface
+        try:
+            replies = rtnl.dump(netlink.RTM_GETROUTE,
+                                struct.pack(netlink.RTMSG, socket.AF_INET,
+                                            0, 0, 0, 0, 0, 0, 0, 0))
+        except (netlink.NetlinkError, socket.error), e:
+            print 'Failed to list routes: %s' % str(e)
+            return
+        for reply in replies:
+            route = netlink.parse_route(reply)
+            if not route or route['oif'] != index or \
+               route['table'] != netlink.RT_TABLE_MAIN:
+                continue
+            # Deleting with the kernel's own description of the route
+            # matches exactly that route.
+            self._route_request(netlink.RTM_DELROUTE, reply)
+
+    @neediface(False)
+    def SetDefaultRoute(self, gw):
+        """ Add a default route with the specified gateway.
+
+        Keyword arguments:
+        gw -- gateway of the default route in dotted quad form
+
+        """
+        if not misc.IsValidIP(gw):
+            print 'WARNING: Invalid gateway found.  Aborting!'
+            return False
+        if self.verbose:
+            print 'Adding default route via %s dev %s' % (gw, self.iface)
+        payload = netlink.pack_route(gateway=gw,
+                                     oif=netlink.get_ifindex(self.iface))
+        if not self._route_request(netlink.RTM_NEWROUTE, payload,
+                                   netlink.NLM_F_CREATE | netlink.NLM_F_EXCL):
+            print 'Failed to add default route via %s' % gw
+
+    @neediface(False)
+    def DelDefaultRoute(self):
+        """ Delete only the default route for a device. """
+        if self.verbose:
+            print 'Deleting default route of %s' % self.iface
+        # A protocol and type of 0 match any default route, whoever
+        # added it, like "route del default dev <iface>" does.
+        payload = netlink.pack_route(protocol=0, rtn_type=0,
+                                     scope=netlink.RT_SCOPE_NOWHERE,
+                                     oif=netlink.get_ifindex(self.iface))
+        self._route_request(netlink.RTM_DELROUTE, payload)
+
+
+class WiredInterface(Interface, BaseWiredInterface):
+    """ Control a wired network interface. """
+    def __init__(self, iface, verbose=False):
+        """ Initialise the wired network interface class.
+
+        Keyword arguments:
+        iface -- name of the interface
+        verbose -- print all commands
+
+        """
+        BaseWiredInterface.__init__(self, iface, verbose)
+        Interface.__init__(self, iface, verbose)
+
+
+class WirelessInterface(Interface, BaseWirelessInterface):
+    """ Control a wireless network interface. """
+    def __init__(self, iface, verbose=False, wpa_driver='wext'):
+        """ Initialise the wireless network interface class.
+
+        Keyword arguments:
+        iface -- name of the interface
+        verbose -- print all commands
+
+        """
+        BaseWirelessInterface.__init__(self, iface, verbose, wpa_driver)
+        Interface.__init__(self, iface, verbose)
+        self.nl80211 = None
+
+    def _get_nl80211(self):
+        """ Returns the nl80211 connection, or None if unavailable. """
+        if not self.nl80211:
+            try:
+                self.nl80211 = nl80211.Nl80211()
+            except (socket.error, netlink.NetlinkError), e:
+                print 'nl80211 unavailable, falling back to iwlist: %s' % \
+                    str(e)
+                return None
+        return self.nl80211
+
+    @neediface([])
+    def GetNetworks(self):
+        """ Get a list of available wireless networks.
+
+        Returns:
+        A list containing available wireless networks.
+
+        """
+        nl = None
+        if self.wpa_driver != RALINK_DRIVER:
+            nl = self._get_nl80211()
+        index = netlink.get_ifindex(self.iface)
+        if not nl or index is None:
+            return BaseWirelessInterface.GetNetworks(self)
+
+        if self.verbose:
+            print 'Scanning %s through nl80211' % self.iface
+        try:
+            nl.trigger_scan(index)
+            results = nl.get_scan(index)
+        except (socket.error, netlink.NetlinkError), e:
+            # Drivers that only support wireless extensions end up here.
+            print 'nl80211 scan failed, falling back to iwlist: %s' % str(e)
+            return BaseWirelessInterface.GetNetworks(self)
+
+        access_points = {}
+        for entry in results:
+            # Only keep the entry with the real essid for hidden networks.
+            if entry['bssid'] not in access_points or not entry['hidden']:
+                access_points[entry['bssid']] = entry
+        return access_points.values()
@@ -25,31 +25,251 @@ reusable for other purposes as well.
 #   along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-import sys, os
+import sys, os, stat, tempfile, threading, time
 
 from ConfigParser import RawConfigParser, ParsingError
+from contextlib import contextmanager
+from cStringIO import StringIO
 import codecs
 
 from wicd.misc import Noneify, to_unicode
 
 from dbus import Int32
 
+# Fingerprints of the config files known to be clean, so they are
+# only read again once they changed.
+_clean_files = {}
+
+def _fingerprint(path):
+    """ Returns what identifies the current version of a file. """
+    st = os.stat(path)
+    return (st.st_ino, st.st_size, st.st_mtime)
+
+def _valid_line(line):
+    """ Returns True if a line can be kept in a config file.
+
+    Blank lines are kept: write() puts them between sections, so
+    dropping them would make every file wicd wrote look invalid.
+
+    """
+    return '[' in line or '=' in line or not line.strip()
+
 def sanitize_config_file(path):
-    """ Remove invalid lines from config file. """
+    """ Remove invalid lines from config file.
+
+    Lines without '[' or '=' are removed, except blank lines.  The file
+    is only rewritten if it has invalid lines, and isn't read at all if
+    it didn't change since it was last found clean.
+
+    """
+    try:
+        fingerprint = _fingerprint(path)
+    except OSError:
+        return
+    if _clean_files.get(path) == fingerprint:
+        return
     conf = open(path)
-    newconf = ''
-    for line in conf:
-        if '[' in line or '=' in line:
-            newconf += line
-    conf.close()
-    conf = open(path, 'w')
-    conf.write(newconf)
-    conf.close()
-
-class ConfigManager(RawConfigParser):
+    try:
+        for line in conf:
+            if not _valid_line(line):
+                break
+        else:
+            _clean_files[path] = fingerprint
+            return
+        conf.seek(0)
+        newconf = ''.join([line for line in conf if _valid_line(line)])
+    finally:
+        conf.close()
+    write_file(path, newconf)
+    _clean_files[path] = _fingerprint(path)
+
+def write_file(path, data):
+    """ Atomically replaces the file at 'path' with 'data'.
+
+    The data is written to a temporary file first, which then replaces
+    the file, so it is never left half written.  The mode and owner of
+    the file are kept.  New files are only readable by their owner,
+    like the config files the daemon creates.
+
+    """
+    fd, tmp = tempfile.mkstemp(prefix='.%s.' % os.path.basename(path),
+                               dir=os.path.dirname(path) or '.')
+    try:
+        f = os.fdopen(fd, 'w')
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        if os.path.exists(path):
+            st = os.stat(path)
+            os.chmod(tmp, stat.S_IMODE(st.st_mode))
+            try:
+                os.chown(tmp, st.st_uid, st.st_gid)
+            except OSError:
+                pass
+        else:
+            # Don't touch the umask, other threads may be creating files.
+            os.chmod(tmp, 0600)
+        os.rename(tmp, path)
+    except (IOError, OSError):
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+class WriteBehind(object):
+    """ Writes files from a background thread.
+
+    Files queued within 'delay' seconds of each other are written
+    together, and a file queued again before it was written is only
+    written once, with the latest data.
+
+    """
+    def __init__(self, delay=1.0):
+        """ Initialise the writer.
+
+        Keyword arguments:
+        delay -- seconds to wait for more changes before writing
+
+        """
+        self.delay = delay
+        self._pending = {}
+        self._cond = threading.Condition()
+        # Held while writing, so flush() and the thread never write
+        # the same file at once.
+        self._io_lock = threading.Lock()
+        self._thread = None
+
+    def queue(self, path, data):
+        """ Schedules writing 'data' to the file at 'path'. """
+        self._cond.acquire()
+        try:
+            self._pending[path] = data
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name='WriteBehind')
+                self._thread.setDaemon(True)
+                self._thread.start()
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def pending(self):
+        """ Returns the paths of the files waiting to be written. """
+        self._cond.acquire()
+        try:
+            return sorted(self._pending)
+        finally:
+            self._cond.release()
+
+    def flush(self):
+        """ Writes all the queued files now. """
+        self._io_lock.acquire()
+        try:
+            self._write_pending()
+        finally:
+            self._io_lock.release()
+
+    def _write_pending(self):
+        """ Writes the queued files.  Must hold _io_lock. """
+        self._cond.acquire()
+        try:
+            pending = self._pending
+            self._pending = {}
+        finally:
+            self._cond.release()
+        for path in sorted(pending):
+            try:
+                write_file(path, pending[path])
+            except (IOError, OSError), e:
+                print 'Could not write %s: %s' % (path, e)
+
+    def _run(self):
+        """ Writes the queued files as they come in. """
+        while True:
+            self._cond.acquire()
+            try:
+                while not self._pending:
+                    self._cond.wait()
+            finally:
+                self._cond.release()
+            time.sleep(self.delay)
+            self.flush()
+
+class ConfigValues:
+    """ Conversions between the values of config files and Python.
+
+    Shared by ConfigManager and the other stores the profiles can be
+    kept in, so values come out of all of them the same way.  Needs
+    the mrk_ws attribute, the marker used around values that start
+    or end with whitespace.
+
+    """
+    def _mark_value(self, value):
+        """ Converts a value to be stored, marking its whitespace. """
+        if isinstance(value, basestring):
+            value = to_unicode(value)
+            if value.startswith(' ') or value.endswith(' '):
+                value = "%(ws)s%(value)s%(ws)s" % {"value" : value,
+                                                   "ws" : self.mrk_ws}
+        return value
+
+    def _as_written(self, options):
+        """ Returns the options of a section as they'd be written. """
+        written = {}
+        for option, value in options.iteritems():
+            if isinstance(value, basestring):
+                written[option] = to_unicode(value)
+            else:
+                written[option] = str(value)
+        return written
+
+    def _unmark_value(self, value):
+        """ Removes the whitespace markers from a raw value. """
+        if (isinstance(value, basestring) and value.startswith(self.mrk_ws)
+            and value.endswith(self.mrk_ws)):
+            value = value[3:-3]
+        return to_unicode(value)
+
+    def _type_value(self, ret):
+        """ Converts a value read from the file to its likely type. """
+        # Try to intelligently handle the type of the return value.
+        try:
+            if not ret.startswith('0') or len(ret) == 1:
+                ret = int(ret)
+        except (ValueError, TypeError, AttributeError):
+            ret = Noneify(ret)
+        # This is a workaround for a python-dbus issue on 64-bit systems.
+        if isinstance(ret, (int, long)):
+            try:
+                Int32(ret)
+            except OverflowError:
+                ret = str(ret)
+        return to_unicode(ret)
+
+class ConfigManager(RawConfigParser, ConfigValues):
     """ A class that can be used to manage a given configuration file. """
-    def __init__(self, path, debug=False, mark_whitespace="`'`"):
+    def __init__(self, path, debug=False, mark_whitespace="`'`",
+                 writer=None):
+        """ Loads the config file at 'path'.
+
+        If a WriteBehind is given as 'writer', the config files are
+        written by it instead of right away.
+
+        """
         RawConfigParser.__init__(self)
+        # Incremented on every change, so users can tell when
+        # something they derived from the configuration is stale.
+        self.generation = 0
+        # The values of each section converted to their type, so
+        # get_option doesn't have to do it every time.
+        self._typed = {}
+        # Sections changed since the last write, and how many batch()
+        # blocks we are in.
+        self._dirty = set()
+        self._rewrite_all = False
+        self._batch_depth = 0
+        self._write_pending = False
+        self.writer = None
         self.config_file = path
         self.debug = debug
         self.mrk_ws = mark_whitespace
@@ -58,12 +278,15 @@ class ConfigManager(RawConfigParser):
         try:
             self.read(path)
         except ParsingError:
+            self._rewrite_all = True
             self.write()
             try:
                 self.read(path)
             except ParsingError, p:
                 print "Could not start wicd: %s" % p.message
                 sys.exit(1)
+        self._dirty = set()
+        self.writer = writer
 
     def __repr__(self):
         return self.config_file
@@ -86,12 +309,9 @@ class ConfigManager(RawConfigParser):
         """
         if not self.has_section(section):
             self.add_section(section)
-        if isinstance(value, basestring):
-            value = to_unicode(value)
-            if value.startswith(' ') or value.endswith(' '):
-                value = "%(ws)s%(value)s%(ws)s" % {"value" : value,
-                                                   "ws" : self.mrk_ws}
-        RawConfigParser.set(self, section, str(option), value)
+        RawConfigParser.set(self, section, str(option),
+                            self._mark_value(value))
+        self._section_changed(section)
         if write:
             self.write()
 
@@ -105,6 +325,9 @@ class ConfigManager(RawConfigParser):
         Automatically adds any missing sections, adds the ability
         to write a default value, and if one is provided prints if
         the default or a previously saved value is returned.
+
+        Values are converted to their type once, and then served from
+        a cache until the section changes.
         
         """
         if not self.has_section(section):
@@ -112,24 +335,23 @@ class ConfigManager(RawConfigParser):
                 self.add_section(section)
             else:
                 return None
-    
-        if self.has_option(section, option):
-            ret = RawConfigParser.get(self, section, option)
-            if (isinstance(ret, basestring) and ret.startswith(self.mrk_ws) 
-                and ret.endswith(self.mrk_ws)):
-                ret = ret[3:-3]
-            ret = to_unicode(ret)
-            if default:
-                if self.debug:
-                    # mask out sensitive information
-                    if option in ['apsk', 'password', 'identity', \
-                                  'private_key', 'private_key_passwd', \
-                                  'key', 'passphrase']:
-                        print ''.join(['found ', option, \
-                            ' in configuration *****'])
-                    else:
-                        print ''.join(['found ', option, ' in configuration ',
-                                       str(ret)])
+
+        typed = self._get_typed_section(section)
+        key = self.optionxform(option)
+        if key in typed:
+            if default and self.debug:
+                ret = self._unmark_value(
+                    RawConfigParser.get(self, section, option))
+                # mask out sensitive information
+                if option in ['apsk', 'password', 'identity', \
+                              'private_key', 'private_key_passwd', \
+                              'key', 'passphrase']:
+                    print ''.join(['found ', option, \
+                        ' in configuration *****'])
+                else:
+                    print ''.join(['found ', option, ' in configuration ',
+                                   str(ret)])
+            return typed[key]
         else:
             if default != "__None__":
                 print 'did not find %s in configuration, setting default %s' \
@@ -138,33 +360,94 @@ class ConfigManager(RawConfigParser):
                 ret = default
             else:
                 ret = None
-        
-        # Try to intelligently handle the type of the return value.
-        try:
-            if not ret.startswith('0') or len(ret) == 1:
-                ret = int(ret)
-        except (ValueError, TypeError, AttributeError):
-            ret = Noneify(ret)
-        # This is a workaround for a python-dbus issue on 64-bit systems.
-        if isinstance(ret, (int, long)):
-            try:
-                Int32(ret)
-            except OverflowError:
-                ret = str(ret)
-        return to_unicode(ret)
+        return self._type_value(ret)
+
+    def set_section(self, section, options):
+        """ Replaces all the options of a section.
+
+        Nothing changes if the section already holds the same values,
+        so saving an unchanged section doesn't cause a write.  The
+        file a section was read from is kept.
+
+        Keyword arguments:
+        section -- the name of the section, which is added if needed
+        options -- dict mapping the options to their new values
+
+        Returns:
+        True if the section changed.
+
+        """
+        values = dict([(self.optionxform(str(option)),
+                        self._mark_value(value))
+                       for option, value in options.iteritems()])
+        if self.has_section(section):
+            current = dict(self.items(section))
+            if '_filename_' in current:
+                values['_filename_'] = current['_filename_']
+            if self._as_written(current) == self._as_written(values):
+                return False
+            RawConfigParser.remove_section(self, section)
+        RawConfigParser.add_section(self, section)
+        for option, value in values.iteritems():
+            RawConfigParser.set(self, section, option, value)
+        self._section_changed(section)
+        return True
+
+    def get_section(self, section):
+        """ Returns all the options of a section.
+
+        The values are converted like get_option does, but nothing is
+        printed, even in debug mode.
+
+        Returns:
+        A dict mapping the options to their values, or None if the
+        section doesn't exist.
+
+        """
+        if not self.has_section(section):
+            return None
+        return dict(self._get_typed_section(section))
+
+    def _section_changed(self, section):
+        """ Drops the cached values of a section and marks it dirty. """
+        self._typed.pop(section, None)
+        self._dirty.add(section)
+        self.generation += 1
+
+    def _get_typed_section(self, section):
+        """ Returns the converted values of a section, from the cache. """
+        typed = self._typed.get(section)
+        if typed is None:
+            typed = dict([(option, self._type_value(self._unmark_value(value)))
+                          for option, value in self.items(section)])
+            self._typed[section] = typed
+        return typed
     
     def get(self, *args, **kargs):
         """ Calls the get_option method """
         return self.get_option(*args, **kargs)
     
-    def _write_one(self):
-        """ Writes the loaded config file to disk. """
+    def _render(self):
+        """ Returns the contents of the config file. """
         for section in self.sections():
             if not section:
                 self.remove_section(section)
-        configfile = open(self.config_file, 'w')
+        configfile = StringIO()
         RawConfigParser.write(self, configfile)
-        configfile.close()
+        return configfile.getvalue()
+
+    def _write_one(self, writer=None):
+        """ Writes the loaded config file to disk, or queues it on
+        'writer' if there is one. """
+        if writer:
+            writer.queue(self.config_file, self._render())
+        else:
+            write_file(self.config_file, self._render())
+
+    def flush(self):
+        """ Writes the changes still queued on the writer, if any. """
+        if self.writer:
+            self.writer.flush()
     
     def remove_section(self, section):
         """ Wrapper around the ConfigParser.remove_section() method.
@@ -175,10 +458,43 @@ class ConfigManager(RawConfigParser):
         """
         if self.has_section(section):
             RawConfigParser.remove_section(self, section)
+            self._section_changed(section)
+
+    def add_section(self, section):
+        """ Wrapper around the ConfigParser.add_section() method. """
+        RawConfigParser.add_section(self, section)
+        self._section_changed(section)
+
+    def remove_option(self, section, option):
+        """ Wrapper around the ConfigParser.remove_option() method. """
+        self._section_changed(section)
+        return RawConfigParser.remove_option(self, section, option)
             
     def reload(self):
         """ Re-reads the config file, in case it was edited out-of-band. """
+        # What was read doesn't need to be written back.
+        self.flush()
+        dirty = set(self._dirty)
         self.read(self.config_file)
+        self._dirty = dirty
+
+    @contextmanager
+    def batch(self):
+        """ Defers writing the config file until the end of the block.
+
+        All the writes asked for inside the block, including the ones
+        made by set_option(write=True) and get_option with a default,
+        are done at once when the block ends.  Blocks can be nested.
+
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth and self._write_pending:
+                self._write_pending = False
+                self.write()
 
     def read(self, path):
         """ Reads the config file specified by 'path' then reads all the
@@ -186,6 +502,8 @@ class ConfigManager(RawConfigParser):
         in the '.d' directory are read in normal sorted order and section
         entries in these files override entries in the main file.
         """
+        self._typed = {}
+        self.generation += 1
         if os.path.exists(path):
             RawConfigParser.readfp(self, codecs.open(path, 'r', 'utf-8'))
 
@@ -209,6 +527,8 @@ class ConfigManager(RawConfigParser):
                 # Store the filename this section was read from.
                 self.set(section_name, '_filename_', fname)
 
+        for section in self.sections():
+            self._get_typed_section(section)
 
     def _copy_section(self, name):
         """ Copy whole section from config file. """
@@ -222,17 +542,40 @@ class ConfigManager(RawConfigParser):
         return p
 
     def write(self, fp=None):
-        """ Writes the loaded config file to disk. """
+        """ Writes the loaded config file to disk.
+
+        Only the files holding sections that changed since the last
+        write are written.  Inside a batch() block, nothing is written
+        until the block ends.
+
+        """
+        if self._batch_depth:
+            self._write_pending = True
+            return
+        dirty = self._dirty
+        rewrite_all = self._rewrite_all
+        self._dirty = set()
+        self._rewrite_all = False
+
         in_this_file = []
+        # Sections that were removed were in this file, or in a file
+        # we don't write anymore.
+        main_dirty = rewrite_all or not os.path.exists(self.config_file) or \
+                     bool(dirty - set(self.sections()))
         for sname in sorted(self.sections()):
             fname = self.get_option(sname, '_filename_')
             if fname and fname != self.config_file:
                 # Write sections from other files
-                section = self._copy_section(sname)
-                section._write_one()
+                if rewrite_all or sname in dirty:
+                    section = self._copy_section(sname)
+                    section._write_one(self.writer)
             else:
                 # Save names of local sections
                 in_this_file.append(sname)
+                if sname in dirty:
+                    main_dirty = True
+        if not main_dirty:
+            return
 
         # Make an instance with only these sections
         p = ConfigManager("", self.debug, self.mrk_ws)
@@ -242,5 +585,5 @@ class ConfigManager(RawConfigParser):
             for (iname, value) in self.items(sname):
                 p.set(sname, iname, value)
             p.remove_option(sname, '_filename_')
-        p._write_one()
+        p._write_one(self.writer)
 
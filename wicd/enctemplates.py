@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+
+""" enctemplates -- Compiled encryption templates.
+
+The encryption templates in wpath.encryption describe the fields each
+encryption method needs, and hold the wpa_supplicant configuration to
+generate for it.  TemplateRegistry parses each template once into a
+Template, and parses it again only when the file changes, so listing
+the encryption methods and generating configurations on every connect
+don't read and parse the templates each time.
+
+class TemplateRegistry() -- The templates of a directory, parsed once.
+class Template() -- A parsed encryption template.
+
+"""
+
+#
+#   Copyright (C) 2007 - 2009 Adam Blackburn
+#   Copyright (C) 2007 - 2009 Dan O'Reilly
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License Version 2 as
+#   published by the Free Software Foundation.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import re
+from threading import Lock
+
+# Values used when a network doesn't set these template variables.
+DEFAULT_VALUES = {'SCAN' : '1', 'KEY_INDEX' : '0'}
+
+_var_pattern = re.compile('\$_([A-Z0-9_]+)')
+
+
+def _file_stamp(path):
+    """ Returns what tells whether a file changed, or None if it's gone. """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size, st.st_ino)
+
+def _parse_field_ent(fields):
+    """ Parse the fields of a require/optional/protected line.
+
+    Returns:
+    A list of [name, description] pairs, or None if the line is
+    invalid.
+
+    """
+    fields = fields.split(" ")
+    # We need an even number of entries in the line for it to be valid.
+    if (len(fields) % 2) != 0:
+        return None
+    ret = []
+    for n in range(0, len(fields), 2):
+        val, disp_val = fields[n], fields[n + 1]
+        if val.startswith("*") or not disp_val.startswith("*"):
+            return None
+        ret.append([val, disp_val[1:]])
+    return ret
+
+def _compile_line(line):
+    """ Compile a line of a template body into a step of a render plan.
+
+    Returns:
+    A tuple (line, parts, variables), where the rendered line is made
+    by joining parts with the values of variables in between, and
+    variables is empty for lines without template variables.
+
+    """
+    # The closing brace is always written as is.
+    if line.strip().startswith("}") or "$_" not in line:
+        return (line, [line], [])
+    pieces = _var_pattern.split(line)
+    return (line, pieces[0::2], pieces[1::2])
+
+
+class Template(object):
+    """ A parsed encryption template.
+
+    info holds the description of the encryption method, in the form
+    misc.LoadEncryptionMethods has always returned it, and the body
+    of the template is compiled into a list of lines to render.
+
+    """
+    def __init__(self, enctype, lines):
+        """ Parse the lines of the template named enctype.
+
+        Raises ValueError if the template is invalid.
+
+        """
+        def parse_ent(line, key):
+            return line.replace(key, "").replace("=", "").strip()
+
+        info = {'type' : enctype, 'fields' : [], 'optional' : [],
+                'required' : [], 'protected' : [], 'name' : ""}
+        self.plan = []
+        in_body = False
+        for line in lines:
+            if in_body:
+                self.plan.append(_compile_line(line))
+            elif line.startswith("name") and not info["name"]:
+                info["name"] = parse_ent(line, "name")
+            elif line.startswith("require"):
+                info["required"] = _parse_field_ent(parse_ent(line,
+                                                              "require"))
+                if not info["required"]:
+                    # An error occured parsing the require line.
+                    print "Invalid 'required' line found in template %s" % \
+                        enctype
+            elif line.startswith("optional"):
+                info["optional"] = _parse_field_ent(parse_ent(line,
+                                                              "optional"))
+                if not info["optional"]:
+                    # An error occured parsing the optional line.
+                    print "Invalid 'optional' line found in template %s" % \
+                        enctype
+            elif line.startswith("protected"):
+                info["protected"] = _parse_field_ent(parse_ent(line,
+                                                               "protected"))
+                if not info["protected"]:
+                    # An error occured parsing the protected line.
+                    print "Invalid 'protected' line found in template %s" % \
+                        enctype
+            elif line.startswith("---"):
+                in_body = True
+        if not info["required"]:
+            raise ValueError("Failed to find a 'require' line in template %s"
+                             % enctype)
+        if not info["name"]:
+            raise ValueError("Failed to find a 'name' line in template %s"
+                             % enctype)
+        self.info = info
+
+    def render(self, network):
+        """ Fill in the template with the values of a network.
+
+        Lines using a variable that has no value in network are left
+        out.
+
+        Returns:
+        The body of the template with the variables replaced.
+
+        """
+        out = []
+        for line, parts, variables in self.plan:
+            if not variables:
+                out.append(parts[0])
+                continue
+            values = []
+            for var in variables:
+                value = network.get(var.lower())
+                if not value:
+                    value = DEFAULT_VALUES.get(var)
+                if not value:
+                    break
+                values.append(str(value))
+            else:
+                out.append(parts[0])
+                for value, part in zip(values, parts[1:]):
+                    out.append(value)
+                    out.append(part)
+                continue
+            print "Ignoring template line: '%s'" % line
+        return ''.join(out)
+
+
+class TemplateRegistry(object):
+    """ The encryption templates of a directory, parsed once.
+
+    Each template is parsed again only when its modification time,
+    size or inode changes, and the lists of active templates only when
+    'active' or 'active_wired' change.
+
+    """
+    def __init__(self, template_dir):
+        """ Keyword arguments:
+        template_dir -- the directory holding the templates
+
+        """
+        self.template_dir = template_dir
+        # name -> (file stamp, Template or None if it's invalid)
+        self._templates = {}
+        # active file name -> (file stamp, list of template names)
+        self._active = {}
+        self.parses = 0
+        # Templates are rendered from connection threads as well.
+        self._lock = Lock()
+
+    def _load(self, enctype):
+        """ Returns the Template for enctype, or None if it's invalid. """
+        path = os.path.join(self.template_dir, enctype)
+        stamp = _file_stamp(path)
+        cached = self._templates.get(enctype)
+        if cached and stamp is not None and cached[0] == stamp:
+            return cached[1]
+        template = None
+        try:
+            f = open(path, "r")
+            try:
+                lines = f.readlines()
+            finally:
+                f.close()
+        except IOError:
+            print "Failed to open template file %s" % enctype
+            self._templates.pop(enctype, None)
+            return None
+        self.parses += 1
+        try:
+            template = Template(enctype, lines)
+        except ValueError, e:
+            print e
+        self._templates[enctype] = (stamp, template)
+        return template
+
+    def get(self, enctype):
+        """ Returns the Template for enctype, or None if it's missing or
+        invalid. """
+        self._lock.acquire()
+        try:
+            return self._load(enctype)
+        finally:
+            self._lock.release()
+
+    def active(self, wired=False):
+        """ Returns the names of the active templates.
+
+        Raises IOError if the file listing them is missing.
+
+        """
+        if wired:
+            active_fname = "active_wired"
+        else:
+            active_fname = "active"
+        path = os.path.join(self.template_dir, active_fname)
+        self._lock.acquire()
+        try:
+            stamp = _file_stamp(path)
+            cached = self._active.get(active_fname)
+            if cached and stamp is not None and cached[0] == stamp:
+                return list(cached[1])
+            f = open(path, "r")
+            try:
+                names = [line.strip() for line in f if line.strip()]
+            finally:
+                f.close()
+            self._active[active_fname] = (stamp, names)
+            return list(names)
+        finally:
+            self._lock.release()
+
+    def methods(self, wired=False):
+        """ Returns the info of the valid active templates.
+
+        See LoadEncryptionMethods in misc.py for their format.
+
+        """
+        methods = []
+        for enctype in self.active(wired):
+            template = self.get(enctype)
+            if template:
+                info = dict(template.info)
+                for key in ('required', 'optional', 'protected'):
+                    info[key] = [list(field) for field in info[key] or []]
+                methods.append(info)
+        return methods
+
+    def render(self, network):
+        """ Returns the body of the template of the network, filled in
+        with its values.
+
+        Raises IOError if the template is missing or invalid.
+
+        """
+        template = self.get(network["enctype"])
+        if template is None:
+            raise IOError("Invalid encryption template %s" %
+                          network["enctype"])
+        return template.render(network)
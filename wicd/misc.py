@@ -27,18 +27,27 @@ import locale
 import sys
 import re
 import string
+import time
 import gobject
-from threading import Thread
+import errno
+import select
+import signal
+from threading import Thread, Lock, Event, Timer, local
 from subprocess import Popen, STDOUT, PIPE, call
 from commands import getoutput
 from itertools import repeat, chain, izip
 from pipes import quote
 import socket
+import hashlib
+import binascii
+import struct
+import Queue
 
 from wicd.translations import _
 
 # wicd imports
 import wpath
+import enctemplates
 
 # Connection state constants
 NOT_CONNECTED = 0
@@ -110,10 +119,314 @@ _status_dict = {
 class WicdError(Exception):
     """ Custom Exception type. """
     pass
-    
+
+class CommandStats(object):
+    """ Statistics about the external commands wicd runs.
+
+    For every executable, the number of calls and failures, the size
+    of the output and a histogram of the wall time of the calls are
+    kept.  At most max_commands executables are tracked, the others
+    are counted together under "(other)", so the memory used stays
+    bounded however many different commands are run.
+
+    """
+    # Upper bounds of the histogram buckets in milliseconds.  The
+    # last bucket holds everything slower.
+    BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000,
+               10000, 30000]
+
+    def __init__(self, max_commands=64):
+        """ Initialise empty statistics.
+
+        Keyword arguments:
+        max_commands -- number of executables tracked separately
+
+        """
+        self.max_commands = max_commands
+        self._lock = Lock()
+        self._stats = {}
+
+    def _entry(self, cmd):
+        """ Returns the statistics of the executable of cmd.
+
+        Must be called with the lock held.
+
+        """
+        name = os.path.basename(cmd[0]) if cmd else ''
+        entry = self._stats.get(name)
+        if entry is None:
+            if len(self._stats) >= self.max_commands:
+                name = '(other)'
+                entry = self._stats.get(name)
+            if entry is None:
+                entry = {'calls' : 0, 'failures' : 0, 'untimed' : 0,
+                         'total_ms' : 0.0, 'max_ms' : 0.0,
+                         'output_bytes' : 0,
+                         'histogram' : [0] * (len(self.BUCKETS) + 1)}
+                self._stats[name] = entry
+        return entry
+
+    def record(self, cmd, seconds=None, failed=False, output_bytes=0):
+        """ Records a call of a command.
+
+        Keyword arguments:
+        cmd -- the command, as a list
+        seconds -- wall time of the call, or None if the command
+                   was left running and couldn't be timed
+        failed -- True if the command couldn't be started or
+                  returned a non-zero exit code
+        output_bytes -- size of the output of the command
+
+        """
+        self._lock.acquire()
+        try:
+            entry = self._entry(cmd)
+            entry['calls'] += 1
+            if failed:
+                entry['failures'] += 1
+            entry['output_bytes'] += output_bytes
+            if seconds is None:
+                entry['untimed'] += 1
+                return
+            ms = seconds * 1000
+            entry['total_ms'] += ms
+            entry['max_ms'] = max(entry['max_ms'], ms)
+            bucket = 0
+            while bucket < len(self.BUCKETS) and ms > self.BUCKETS[bucket]:
+                bucket += 1
+            entry['histogram'][bucket] += 1
+        finally:
+            self._lock.release()
+
+    def get(self):
+        """ Returns a copy of the statistics, by executable. """
+        self._lock.acquire()
+        try:
+            stats = {}
+            for name, entry in self._stats.iteritems():
+                stats[name] = dict(entry)
+                stats[name]['histogram'] = list(entry['histogram'])
+            return stats
+        finally:
+            self._lock.release()
+
+    def reset(self):
+        """ Forgets all the statistics. """
+        self._lock.acquire()
+        try:
+            self._stats = {}
+        finally:
+            self._lock.release()
+
+command_stats = CommandStats()
+
+# Seconds a cancelled or timed out command gets to exit after SIGTERM,
+# before it gets SIGKILL.
+KILL_GRACE = 1.0
+
+
+class CommandCancelled(SystemExit):
+    """ Raised by Run, LaunchAndWait and sleep when the CancelToken of
+    the thread is cancelled.
+
+    Like the SystemExit ConnectThread.abort_if_needed raises, it ends
+    the thread unless caught.
+
+    """
+    pass
+
+
+def _kill_process_group(process, sig=signal.SIGTERM):
+    """ Sends a signal to the process group of a command started by Run,
+    if it is still running. """
+    if process.returncode is None:
+        try:
+            os.killpg(process.pid, sig)
+        except OSError:
+            pass
+
+
+class _WatchedPopen(Popen):
+    """ A Popen that stops its timeout watchdog once it has exited. """
+    watchdog = None
+
+    def _stop_watchdog(self):
+        """ Cancels the watchdog if the command has exited. """
+        if self.watchdog and self.returncode is not None:
+            self.watchdog.cancel()
+            self.watchdog = None
+
+    def wait(self):
+        """ Waits for the command, see Popen.wait. """
+        try:
+            return Popen.wait(self)
+        finally:
+            self._stop_watchdog()
+
+    def poll(self):
+        """ Checks if the command exited, see Popen.poll. """
+        ret = Popen.poll(self)
+        self._stop_watchdog()
+        return ret
+
+
+class CancelToken(object):
+    """ Cancels the commands run by a thread.
+
+    When a thread uses a token, see set_cancel_token, the commands it
+    runs with Run and LaunchAndWait get a process group of their own,
+    which is killed when the token is cancelled, or when a command
+    runs longer than its timeout.  Run, LaunchAndWait and sleep then
+    raise CommandCancelled, so the thread stops without waiting for
+    anything else.
+
+    """
+    def __init__(self, timeout=None):
+        """ Keyword arguments:
+        timeout -- default number of seconds a command may run
+
+        """
+        self.timeout = timeout
+        self._event = Event()
+        self._lock = Lock()
+        self._processes = []
+
+    def cancelled(self):
+        """ Returns True if the token was cancelled. """
+        return self._event.isSet()
+
+    def cancel(self):
+        """ Cancels the token, terminating the commands still running.
+
+        Can be called from any thread.  Commands Run is waiting for
+        are killed if they don't exit on SIGTERM; the ones returned by
+        Run with return_pipe or return_obj only get SIGTERM.
+
+        """
+        self._lock.acquire()
+        try:
+            self._event.set()
+            processes = self._processes
+            self._processes = []
+        finally:
+            self._lock.release()
+        for process in processes:
+            _kill_process_group(process)
+
+    def check(self):
+        """ Raises CommandCancelled if the token was cancelled. """
+        if self._event.isSet():
+            raise CommandCancelled('cancelled')
+
+    def sleep(self, seconds):
+        """ Sleeps, unless the token is or gets cancelled. """
+        self._event.wait(seconds)
+        self.check()
+
+    def add(self, process):
+        """ Kills process along with the others if the token gets
+        cancelled. """
+        self._lock.acquire()
+        try:
+            if not self._event.isSet():
+                # Forget the commands that are done.
+                self._processes = [p for p in self._processes
+                                   if p.returncode is None]
+                self._processes.append(process)
+                return
+        finally:
+            self._lock.release()
+        _kill_process_group(process)
+
+    def remove(self, process):
+        """ Stops tracking a command that finished. """
+        self._lock.acquire()
+        try:
+            if process in self._processes:
+                self._processes.remove(process)
+        finally:
+            self._lock.release()
+
+_thread_state = local()
+
+def set_cancel_token(token):
+    """ Sets the CancelToken of the current thread, or None. """
+    _thread_state.token = token
+
+def get_cancel_token():
+    """ Returns the CancelToken of the current thread, or None. """
+    return getattr(_thread_state, 'token', None)
+
+def sleep(seconds):
+    """ time.sleep, that returns early with CommandCancelled if the
+    thread's CancelToken is cancelled. """
+    token = get_cancel_token()
+    if token:
+        token.sleep(seconds)
+    else:
+        time.sleep(seconds)
+
+def _wait_for_output(process, cmd, timeout, token):
+    """ Reads the output of a command until it exits.
+
+    The command is killed if it runs for more than timeout seconds, in
+    which case the output it wrote so far is returned, or if token is
+    cancelled.  It gets KILL_GRACE seconds to exit after SIGTERM.
+
+    Raises CommandCancelled if token was cancelled.
+
+    """
+    deadline = None
+    if timeout:
+        deadline = time.time() + timeout
+    killed_at = None
+    hard_killed = False
+    output = []
+    fd = process.stdout.fileno()
+    while True:
+        now = time.time()
+        if killed_at is None:
+            if token and token.cancelled():
+                _kill_process_group(process)
+                killed_at = now
+            elif deadline is not None and now >= deadline:
+                print "%s timed out after %s seconds, killing it" % \
+                    (cmd[0], timeout)
+                _kill_process_group(process)
+                killed_at = now
+        elif now - killed_at >= KILL_GRACE * 2:
+            # Something else keeps the pipe open, stop reading.
+            break
+        elif now - killed_at >= KILL_GRACE and not hard_killed:
+            _kill_process_group(process, signal.SIGKILL)
+            hard_killed = True
+        # Check the token and the deadline at least every 0.1 seconds.
+        if token or killed_at is not None:
+            wait = 0.1
+        elif deadline is not None:
+            wait = max(deadline - now, 0)
+        else:
+            wait = None
+        try:
+            ready = select.select([fd], [], [], wait)[0]
+        except select.error, e:
+            if e[0] == errno.EINTR:
+                continue
+            raise
+        if ready:
+            data = os.read(fd, 4096)
+            if not data:
+                break
+            output.append(data)
+    process.stdout.close()
+    process.wait()
+    if token:
+        token.remove(process)
+        token.check()
+    return ''.join(output)
 
 def Run(cmd, include_stderr=False, return_pipe=False,
-        return_obj=False, return_retcode=True):
+        return_obj=False, return_retcode=True, timeout=None):
     """ Run a command.
 
     Runs the given command, returning either the output
@@ -129,6 +442,13 @@ def Run(cmd, include_stderr=False, return_pipe=False,
                   one output string from the command.
     return_obj - If True, Run will return the Popen object
                  for the command that was run.
+    timeout - Number of seconds after which the command is killed.
+              Defaults to the timeout of the thread's CancelToken.
+              With return_pipe, the command can't be waited for, so
+              it's only killed if the thread is cancelled.
+
+    If the thread has a CancelToken, see set_cancel_token, the command
+    is killed when it is cancelled, and CommandCancelled is raised.
 
     """
     if not isinstance(cmd, list):
@@ -151,24 +471,62 @@ def Run(cmd, include_stderr=False, return_pipe=False,
     tmpenv["LC_ALL"] = "C"
     tmpenv["LANG"] = "C"
     
+    token = get_cancel_token()
+    if token:
+        token.check()
+        if timeout is None:
+            timeout = token.timeout
+    # Commands that may have to be killed get a process group of their
+    # own, so whatever they started is killed along with them.
+    if token or timeout:
+        preexec = os.setsid
+    else:
+        preexec = None
+
+    start = time.time()
     try:
-        f = Popen(cmd, shell=False, stdout=PIPE, stdin=std_in, stderr=err,
-                  close_fds=fds, cwd='/', env=tmpenv)
+        f = _WatchedPopen(cmd, shell=False, stdout=PIPE, stdin=std_in,
+                          stderr=err, close_fds=fds, cwd='/', env=tmpenv,
+                          preexec_fn=preexec)
     except OSError, e:
         print "Running command %s failed: %s" % (str(cmd), str(e))
+        command_stats.record(cmd, time.time() - start, failed=True)
         return ""
+    if token:
+        token.add(f)
+    if return_obj and timeout:
+        # The caller reads the output, so only the timeout is enforced.
+        # The watchdog is stopped when the caller waits for the command.
+        f.watchdog = Timer(timeout, _kill_process_group, [f])
+        f.watchdog.setDaemon(True)
+        f.watchdog.start()
         
+    if return_obj or return_pipe:
+        # The command is still running, so it can't be timed.
+        command_stats.record(cmd)
     if return_obj:
         return f
     if return_pipe:
         return f.stdout
+    elif preexec:
+        output = _wait_for_output(f, cmd, timeout, token)
+        command_stats.record(cmd, time.time() - start,
+                             failed=bool(f.returncode),
+                             output_bytes=len(output))
+        return output
     else:
-        return f.communicate()[0]
+        output = f.communicate()[0]
+        command_stats.record(cmd, time.time() - start,
+                             failed=bool(f.returncode),
+                             output_bytes=len(output or ''))
+        return output
     
-def LaunchAndWait(cmd):
+def LaunchAndWait(cmd, timeout=None):
     """ Launches the given program with the given arguments, then blocks.
 
     cmd : A list contained the program name and its arguments.
+    timeout : Number of seconds after which the program is killed, see
+              Run.
 
     returns: The exit code of the process.
     
@@ -176,8 +534,24 @@ def LaunchAndWait(cmd):
     if not isinstance(cmd, list):
         cmd = to_unicode(str(cmd))
         cmd = cmd.split()
-    p = Popen(cmd, shell=False, stdout=PIPE, stderr=STDOUT, stdin=None)
-    return p.wait()
+    token = get_cancel_token()
+    if token:
+        token.check()
+        if timeout is None:
+            timeout = token.timeout
+    start = time.time()
+    if token or timeout:
+        p = Popen(cmd, shell=False, stdout=PIPE, stderr=STDOUT, stdin=None,
+                  preexec_fn=os.setsid)
+        if token:
+            token.add(p)
+        _wait_for_output(p, cmd, timeout, token)
+        ret = p.returncode
+    else:
+        p = Popen(cmd, shell=False, stdout=PIPE, stderr=STDOUT, stdin=None)
+        ret = p.wait()
+    command_stats.record(cmd, time.time() - start, failed=bool(ret))
+    return ret
 
 def IsValidIP(ip):
     """ Make sure an entered IP is valid. """
@@ -287,6 +661,71 @@ def Noneify(variable, convert_to_bool=True):
             return True
     return variable
 
+_HMAC_INNER = ''.join([chr(x ^ 0x36) for x in range(256)])
+_HMAC_OUTER = ''.join([chr(x ^ 0x5c) for x in range(256)])
+
+def _pbkdf2_sha1(password, salt, iterations, length):
+    """ PBKDF2 with HMAC-SHA1, for Pythons without hashlib.pbkdf2_hmac. """
+    if len(password) > 64:
+        password = hashlib.sha1(password).digest()
+    password = password.ljust(64, '\0')
+    inner = hashlib.sha1(password.translate(_HMAC_INNER))
+    outer = hashlib.sha1(password.translate(_HMAC_OUTER))
+    def prf(msg):
+        i = inner.copy()
+        i.update(msg)
+        o = outer.copy()
+        o.update(i.digest())
+        return o.digest()
+    key = ''
+    block = 1
+    while len(key) < length:
+        u = prf(salt + struct.pack('>I', block))
+        result = long(binascii.hexlify(u), 16)
+        for n in xrange(iterations - 1):
+            u = prf(u)
+            result ^= long(binascii.hexlify(u), 16)
+        key += binascii.unhexlify('%040x' % result)
+        block += 1
+    return key[:length]
+
+def generate_psk(essid, passphrase):
+    """ Derive the WPA pre-shared key from a passphrase.
+
+    Does what wpa_passphrase does, PBKDF2-SHA1 with the essid as the
+    salt and 4096 iterations, without running it.
+
+    Returns:
+    The PSK as 64 hex digits, or None if passphrase isn't a valid
+    WPA passphrase of 8 to 63 printable ASCII characters.
+
+    """
+    if isinstance(essid, unicode):
+        essid = essid.encode('utf-8')
+    if isinstance(passphrase, unicode):
+        try:
+            passphrase = passphrase.encode('ascii')
+        except UnicodeError:
+            return None
+    essid, passphrase = str(essid), str(passphrase)
+    if not 8 <= len(passphrase) <= 63 or \
+       [c for c in passphrase if not 32 <= ord(c) <= 126]:
+        return None
+    if hasattr(hashlib, 'pbkdf2_hmac'):
+        psk = hashlib.pbkdf2_hmac('sha1', passphrase, essid, 4096, 32)
+    else:
+        psk = _pbkdf2_sha1(passphrase, essid, 4096, 32)
+    return binascii.hexlify(psk)
+
+def psk_cache_key(essid, passphrase):
+    """ Returns what a PSK derived from essid and passphrase is saved
+    with, so it is only reused while neither of them changes. """
+    if isinstance(essid, unicode):
+        essid = essid.encode('utf-8')
+    if isinstance(passphrase, unicode):
+        passphrase = passphrase.encode('utf-8')
+    return hashlib.sha1('%s\0%s' % (essid, passphrase)).hexdigest()
+
 def ParseEncryption(network):
     """ Parse through an encryption template file
 
@@ -294,40 +733,7 @@ def ParseEncryption(network):
     and creating a config file for it
 
     """
-    enctemplate = open(wpath.encryption + network["enctype"])
-    template = enctemplate.readlines()
-    if network.get('essid'):
-        config_file = "ap_scan=1\n"
-    else:
-        config_file = "ap_scan=0\n"
-    should_replace = False
-    for index, line in enumerate(template):
-        if not should_replace:
-            if line.strip().startswith('---'):
-                should_replace = True
-        else:
-            if line.strip().startswith("}"):
-                # This is the last line, so we just write it.
-                config_file = ''.join([config_file, line])
-            elif "$_" in line: 
-                for cur_val in re.findall('\$_([A-Z0-9_]+)', line):
-                    if cur_val:
-                        rep_val = network.get(cur_val.lower())
-                        if not rep_val:
-                            # hardcode some default values
-                            if cur_val == 'SCAN':
-                                rep_val = '1'
-                            elif cur_val == 'KEY_INDEX':
-                                rep_val = '0'
-                        if rep_val:
-                            line = line.replace("$_%s" % cur_val, str(rep_val))
-                            config_file = ''.join([config_file, line])
-                        else:
-                            print "Ignoring template line: '%s'" % line
-                    else:
-                        print "Weird parsing error occurred"
-            else:  # Just a regular entry.
-                config_file = ''.join([config_file, line])
+    config_file = GenerateEncryptionConfig(network)
 
     # Write the data to the files then chmod them so they can't be read 
     # by normal users.
@@ -344,6 +750,29 @@ def ParseEncryption(network):
     f.write(config_file)
     f.close()
 
+def GenerateEncryptionConfig(network):
+    """ Fill in the encryption template of a network.
+
+    Returns:
+    The wpa_supplicant configuration for the network, as it would be
+    written to its config file by ParseEncryption.
+
+    """
+    if network.get('essid'):
+        config_file = "ap_scan=1\n"
+    else:
+        config_file = "ap_scan=0\n"
+    return config_file + get_templates().render(network)
+
+_templates = None
+
+def get_templates():
+    """ Returns the registry of the encryption templates. """
+    global _templates
+    if _templates is None:
+        _templates = enctemplates.TemplateRegistry(wpath.encryption)
+    return _templates
+
 def LoadEncryptionMethods(wired = False):
     """ Load encryption methods from configuration files
 
@@ -351,94 +780,15 @@ def LoadEncryptionMethods(wired = False):
     in /encryption/templates into a data structure.  To be
     loaded, the template must be listed in the "active" file.
 
+    Templates are only parsed again when they change, see
+    enctemplates.TemplateRegistry.
+
     """
-    if wired:
-        active_fname = "active_wired"
-    else:
-        active_fname = "active"
     try:
-        enctypes = open(wpath.encryption + active_fname,"r").readlines()
+        return get_templates().methods(wired)
     except IOError, e:
         print "Fatal Error: template index file is missing."
         raise IOError(e)
-    
-    # Parse each encryption method
-    encryptionTypes = []
-    for enctype in enctypes:
-        parsed_template = _parse_enc_template(enctype.strip())
-        if parsed_template:
-            encryptionTypes.append(parsed_template)
-    return encryptionTypes
-
-def __parse_field_ent(fields, field_type='require'):
-    fields = fields.split(" ")
-    ret = []
-    # We need an even number of entries in the line for it to be valid.
-    if (len(fields) % 2) != 0:
-        return None
-    else:
-        for val, disp_val in grouper(2, fields, fillvalue=None):
-            if val.startswith("*") or not disp_val.startswith("*"):
-                return None
-            ret.append([val, disp_val[1:]])
-        return ret
-
-def _parse_enc_template(enctype):
-    """ Parse an encryption template. """
-    def parse_ent(line, key):
-        return line.replace(key, "").replace("=", "").strip()
-
-    try:
-        f = open(os.path.join(wpath.encryption, enctype), "r")
-    except IOError:
-        print "Failed to open template file %s" % enctype
-        return None
-
-    cur_type = {}
-    cur_type["type"] = enctype
-    cur_type["fields"] = []
-    cur_type['optional'] = []
-    cur_type['required'] = []
-    cur_type['protected'] = []
-    cur_type['name'] = ""
-    for index, line in enumerate(f):
-        if line.startswith("name") and not cur_type["name"]:
-            cur_type["name"] = parse_ent(line, "name")
-        elif line.startswith("require"):
-            cur_type["required"] = __parse_field_ent(parse_ent(line, "require"))
-            if not cur_type["required"]:
-                # An error occured parsing the require line.
-                print "Invalid 'required' line found in template %s" % enctype
-                continue
-        elif line.startswith("optional"):
-            cur_type["optional"] = __parse_field_ent(parse_ent(line,
-                                                               "optional"),
-                                                     field_type="optional")
-            if not cur_type["optional"]:
-                # An error occured parsing the optional line.
-                print "Invalid 'optional' line found in template %s" % enctype
-                continue
-        elif line.startswith("protected"):
-            cur_type["protected"] = __parse_field_ent(
-                parse_ent(line, "protected"),
-                field_type="protected"
-            )
-            if not cur_type["protected"]:
-                # An error occured parsing the protected line.
-                print "Invalid 'protected' line found in template %s" % enctype
-                continue
-        elif line.startswith("----"):
-            # We're done.
-            break
-    f.close()
-    if not cur_type["required"]:
-        print "Failed to find a 'require' line in template %s" % enctype
-        return None
-    if not cur_type["name"]:
-        print "Failed to find a 'name' line in template %s" % enctype
-        return None
-    else:
-        return cur_type
 
 def noneToString(text):
     """ Convert None, "None", or "" to string type "None"
@@ -512,6 +862,40 @@ def RenameProcess(new_name):
         print "rename failed"
         return False
     
+def _monotonic_clock():
+    """ Returns a function reading the monotonic clock of the system.
+
+    Uses clock_gettime(CLOCK_MONOTONIC) if it can be found, otherwise
+    the elapsed time reported by os.times(), which doesn't jump when
+    the time of day is changed either, but only has a resolution of
+    a few milliseconds.
+
+    """
+    try:
+        import ctypes
+        from ctypes.util import find_library
+
+        class timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+        librt = ctypes.CDLL(find_library('rt') or find_library('c'))
+        clock_gettime = librt.clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+        CLOCK_MONOTONIC = 1
+
+        def clock():
+            ts = timespec()
+            clock_gettime(CLOCK_MONOTONIC, ctypes.byref(ts))
+            return ts.tv_sec + ts.tv_nsec * 1e-9
+        clock()
+        return clock
+    except (ImportError, OSError, AttributeError, TypeError):
+        return lambda: os.times()[4]
+
+monotonic = _monotonic_clock()
+monotonic.__doc__ = """ Returns the time of a clock that never goes back,
+in seconds. """
+
 def detect_desktop_environment():
     """ Try to determine which desktop environment is in use. 
     
@@ -617,6 +1001,86 @@ def threaded(f):
 
     return wrapper
 
+class WorkerPool(object):
+    """ A fixed number of threads running slow calls off the main loop.
+
+    Calls are queued and run by the first free thread, so no more than
+    size of them run at once, however many are queued.  Their results
+    and errors are handed to the callbacks on the gobject main loop,
+    which makes the pool suitable for D-Bus methods using
+    async_callbacks.
+
+    """
+    def __init__(self, size, deliver=None):
+        """ Keyword arguments:
+        size -- the most threads to start
+        deliver -- how callbacks are scheduled, gobject.idle_add by
+                   default
+
+        """
+        self.size = size
+        if deliver is None:
+            deliver = gobject.idle_add
+        self.deliver = deliver
+        self._queue = Queue.Queue()
+        self._threads = []
+        # Calls queued or running.
+        self._pending = 0
+        self._lock = Lock()
+
+    def run(self, func, args=(), callback=None, errback=None):
+        """ Queue a call of func(*args).
+
+        Keyword arguments:
+        func -- the function to call on a worker thread
+        args -- the arguments to call it with
+        callback -- called with the result, or without any argument if
+                    func returned None, like a D-Bus reply_handler
+        errback -- called with the exception func raised
+
+        """
+        self._lock.acquire()
+        try:
+            self._pending += 1
+            if len(self._threads) < min(self._pending, self.size):
+                thread = Thread(target=self._work)
+                thread.setDaemon(True)
+                self._threads.append(thread)
+                thread.start()
+            self._queue.put((func, args, callback, errback))
+        finally:
+            self._lock.release()
+
+    def _finish(self, func, *args):
+        """ Hand a result to a callback on the main loop. """
+        def call():
+            func(*args)
+            # Returning True from an idle callback would call it again.
+            return False
+        self.deliver(call)
+
+    def _work(self):
+        """ Run the queued calls. """
+        while True:
+            func, args, callback, errback = self._queue.get()
+            try:
+                try:
+                    result = func(*args)
+                except Exception, e:
+                    if errback:
+                        self._finish(errback, e)
+                    else:
+                        print 'Error in %s: %s' % (func.__name__, e)
+                else:
+                    if callback and result is None:
+                        self._finish(callback)
+                    elif callback:
+                        self._finish(callback, result)
+            finally:
+                self._lock.acquire()
+                self._pending -= 1
+                self._lock.release()
+
 def timeout_add(time, func, milli=False):
     """ Convience function for running a function on a timer. """
     if hasattr(gobject, "timeout_add_seconds") and not milli:
@@ -652,3 +1116,44 @@ def grouper(n, iterable, fillvalue=None):
     """
     args = [iter(iterable)] * n
     return izip_longest(fillvalue=fillvalue, *args)
+
+def diff_scans(old, new, key='bssid'):
+    """ Compare two wireless scans.
+
+    Networks are matched by the given key, which stays the same across
+    scans, unlike the position of a network in the scan.
+
+    Keyword arguments:
+    old -- list of the network dicts of the previous scan
+    new -- list of the network dicts of the current scan
+    key -- the property identifying a network
+
+    Returns:
+    A tuple (added, removed, changed).  added is the list of networks
+    of the new scan that weren't in the old one, removed is the list of
+    keys of the networks that are gone, and changed maps the key of
+    every other network whose properties changed to a dict of those
+    properties and their new value.  Properties that are no longer set
+    have None as their new value.
+
+    """
+    old_networks = dict([(network.get(key), network) for network in old])
+    new_keys = set()
+    added = []
+    changed = {}
+    for network in new:
+        network_key = network.get(key)
+        new_keys.add(network_key)
+        previous = old_networks.get(network_key)
+        if previous is None:
+            added.append(network)
+            continue
+        fields = {}
+        for prop in set(previous) | set(network):
+            if previous.get(prop) != network.get(prop):
+                fields[prop] = network.get(prop)
+        if fields:
+            changed[network_key] = fields
+    removed = [network.get(key) for network in old
+               if network.get(key) not in new_keys]
+    return (added, removed, changed)
@@ -26,12 +26,14 @@ when appropriate.
 
 import gobject
 import time
+import socket
 
 from dbus import DBusException
 
 from wicd import wpath
 from wicd import misc
 from wicd import dbusmanager
+from wicd import netlink
 
 misc.RenameProcess("wicd-monitor")
 
@@ -46,6 +48,14 @@ wireless = dbus_dict["wireless"]
 
 mainloop = None
 
+# How often to poll when netlink tells us about link changes and
+# there's no wireless signal to keep track of.
+SLOW_POLL_INTERVAL = 30
+
+# Delay (in milliseconds) used to coalesce bursts of netlink events
+# into a single status update.
+NETLINK_SETTLE_TIME = 250
+
 def diewithdbus(func):
     """
     Decorator catching DBus exceptions, making wicd quit.
@@ -85,25 +95,90 @@ class ConnectionStatus(object):
         self.reconnecting = False
         self.reconnect_tries = 0
         self.signal_changed = False
-        self.iwconfig = ""
+        self.snapshot = {}
+        self.last_status = None
         self.trigger_reconnect = False
         self.__lost_dbus_count = 0
         self._to_time = daemon.GetBackendUpdateInterval()
+        self._poll_time = self._to_time
         self.update_callback = None
-        
+        self._netlink = None
+        self._netlink_update = None
+        self._link_tracker = netlink.LinkStateTracker()
+
+        self._setup_netlink()
         self.add_poll_callback()
         bus = dbusmanager.get_bus()
         bus.add_signal_receiver(self._force_update_connection_status, 
                                 "UpdateState", "org.wicd.daemon")
         bus.add_signal_receiver(self._update_timeout_interval,
                                 "SignalBackendChanged", "org.wicd.daemon")
+        bus.add_signal_receiver(self._update_tracked_interfaces,
+                                "InterfacesChanged", "org.wicd.daemon")
 
     def _update_timeout_interval(self, interval):
         """ Update the callback interval when signaled by the daemon. """
         self._to_time = interval
+        self._update_tracked_interfaces()
         gobject.source_remove(self.update_callback)
         self.add_poll_callback()
 
+    def _setup_netlink(self):
+        """ Start listening for link and address changes.
+
+        If the netlink socket can't be opened, the monitor falls back
+        to polling at the backend's update interval.
+
+        """
+        try:
+            self._netlink = netlink.RtnlEventSocket()
+        except (socket.error, AttributeError), e:
+            print 'Netlink unavailable, falling back to polling: %s' % str(e)
+            self._netlink = None
+            return
+        self._update_tracked_interfaces()
+        gobject.io_add_watch(self._netlink.fileno(),
+                             gobject.IO_IN | gobject.IO_ERR | gobject.IO_HUP,
+                             self._netlink_event)
+
+    def _update_tracked_interfaces(self):
+        """ Only watch the interfaces wicd is configured to use.
+
+        The interfaces are tracked by name, so they are still followed
+        if they only show up later (e.g. USB adapters) or are re-created.
+
+        """
+        if not self._netlink:
+            return
+        self._link_tracker.set_names([daemon.GetWiredInterface(),
+                                      daemon.GetWirelessInterface()])
+
+    def _netlink_event(self, fd, condition):
+        """ Handle pending netlink notifications.
+
+        Relevant events schedule a status update shortly afterwards,
+        so a burst of notifications only results in one update.
+
+        """
+        if condition & (gobject.IO_ERR | gobject.IO_HUP):
+            print 'Netlink socket closed, falling back to polling.'
+            self._netlink.close()
+            self._netlink = None
+            self._reschedule_poll()
+            return False
+        events = self._netlink.read_events()
+        if self._link_tracker.filter(events) and not self._netlink_update:
+            self._netlink_update = misc.timeout_add(NETLINK_SETTLE_TIME,
+                                                    self._netlink_settled,
+                                                    milli=True)
+        return True
+
+    def _netlink_settled(self):
+        """ Run the status update scheduled by a netlink event. """
+        self._netlink_update = None
+        self._force_update_connection_status()
+        return False
+
     def _force_update_connection_status(self):
         """ Run a connection status update on demand.
 
@@ -113,17 +188,38 @@ class ConnectionStatus(object):
 
         """
         gobject.source_remove(self.update_callback)
+        self.update_callback = None
         self.update_connection_status()
         self.add_poll_callback()
         
     def add_poll_callback(self):
         """ Registers a polling call at a predetermined interval.
         
-        The polling interval is determined by the backend in use.
+        The polling interval is determined by the backend in use.  When
+        netlink notifies us of link changes, polling is only needed to
+        follow the signal strength and connection progress, so it is
+        slowed down in the other states.
         
         """
-        self.update_callback = misc.timeout_add(self._to_time,
+        self._poll_time = self._get_poll_time()
+        self.update_callback = misc.timeout_add(self._poll_time,
                                                 self.update_connection_status)
+
+    def _get_poll_time(self):
+        """ Returns the polling interval to use for the current state. """
+        if not self._netlink or self.last_state in (misc.WIRELESS,
+                                                    misc.CONNECTING):
+            return self._to_time
+        return max(self._to_time, SLOW_POLL_INTERVAL)
+
+    def _reschedule_poll(self):
+        """ Reschedule the polling call if the interval has changed. """
+        if self.update_callback is None:
+            # We're in the middle of a forced update, which reschedules.
+            return
+        if self._get_poll_time() != self._poll_time:
+            gobject.source_remove(self.update_callback)
+            self.add_poll_callback()
     
     def check_for_wired_connection(self, wired_ip):
         """ Checks for a wired connection.
@@ -138,14 +234,15 @@ class ConnectionStatus(object):
 
         """
         self.trigger_reconnect = False
-        if not wired_ip and daemon.GetPreferWiredNetwork():
-            if not daemon.GetForcedDisconnect() and wired.CheckPluggedIn():
+        plugged_in = self.snapshot.get('plugged_in', False)
+        if not wired_ip and self.snapshot['prefer_wired']:
+            if not self.snapshot['forced_disconnect'] and plugged_in:
                 self.trigger_reconnect = True
 
-        elif wired_ip and wired.CheckPluggedIn():
+        elif wired_ip and plugged_in:
             # Only change the interface if it's not already set for wired
             if not self.still_wired:
-                daemon.SetCurrentInterface(daemon.GetWiredInterface())
+                daemon.SetCurrentInterface(self.snapshot['wired_interface'])
                 self.still_wired = True
             return True
         # Wired connection isn't active
@@ -172,13 +269,9 @@ class ConnectionStatus(object):
         if not wireless_ip:
             return False
 
-        if daemon.NeedsExternalCalls():
-            self.iwconfig = wireless.GetIwconfig()
-        else:
-            self.iwconfig = ''
         # Reset this, just in case.
         self.tried_reconnect = False
-        bssid = wireless.GetApBssid()
+        bssid = self.snapshot.get('bssid')
         if not bssid:
             return False
 
@@ -189,19 +282,21 @@ class ConnectionStatus(object):
             # try to reconnect.
             self.connection_lost_counter += 1
             print self.connection_lost_counter
-            if self.connection_lost_counter >= 4 and daemon.GetAutoReconnect():
+            if (self.connection_lost_counter >= 4 and
+                self.snapshot['auto_reconnect']):
                 wireless.DisconnectWireless()
                 self.connection_lost_counter = 0
                 return False
         else:  # If we have a signal, reset the counter
             self.connection_lost_counter = 0
 
+        self.network = self.snapshot.get('essid', '')
         if (wifi_signal != self.last_strength or
             self.network != self.last_network):
             self.last_strength = wifi_signal
             self.last_network = self.network
             self.signal_changed = True
-            daemon.SetCurrentInterface(daemon.GetWirelessInterface())    
+            daemon.SetCurrentInterface(self.snapshot['wireless_interface'])
 
         return True
 
@@ -213,31 +308,35 @@ class ConnectionStatus(object):
         announcing when the status changes.  Also starts the automatic
         reconnection process if necessary.
 
+        The state is fetched from the daemon with a single
+        GetLinkSnapshot() call.
+
         """
         wired_ip = None
         wifi_ip = None
+        self.snapshot = daemon.GetLinkSnapshot()
 
-        if daemon.GetSuspend():
+        if self.snapshot['suspended']:
             print "Suspended."
             state = misc.SUSPENDED
             return self.update_state(state)
 
         # Determine what our current state is.
         # Are we currently connecting?
-        if daemon.CheckIfConnecting():
+        if self.snapshot['connecting']:
             state = misc.CONNECTING
             return self.update_state(state)
 
         daemon.SendConnectResultsIfAvail()
 
         # Check for wired.
-        wired_ip = wired.GetWiredIP("")
+        wired_ip = self.snapshot['wired_ip']
         wired_found = self.check_for_wired_connection(wired_ip)
         if wired_found:
             return self.update_state(misc.WIRED, wired_ip=wired_ip)
 
         # Check for wireless
-        wifi_ip = wireless.GetWirelessIP("")
+        wifi_ip = self.snapshot.get('wireless_ip')
         self.signal_changed = False
         wireless_found = self.check_for_wireless_connection(wifi_ip)
         if wireless_found:
@@ -250,7 +349,7 @@ class ConnectionStatus(object):
 
                 # Don't trigger it if the gui is open, because autoconnect
                 # is disabled while it's open.
-                if not daemon.GetGUIOpen():
+                if not self.snapshot['gui_open']:
                     print 'Killing wireless connection to switch to wired...'
                     wireless.DisconnectWireless()
                     daemon.AutoConnect(False, reply_handler=lambda *a:None,
@@ -269,24 +368,22 @@ class ConnectionStatus(object):
     def update_state(self, state, wired_ip=None, wifi_ip=None):
         """ Set the current connection state. """
         # Set our connection state/info.
-        iwconfig = self.iwconfig
+        essid = misc.noneToBlankString(self.snapshot.get('essid'))
         if state == misc.NOT_CONNECTED:
             info = [""]
         elif state == misc.SUSPENDED:
             info = [""]
         elif state == misc.CONNECTING:
-            if wired.CheckIfWiredConnecting():
+            if self.snapshot['wired_connecting']:
                 info = ["wired"]
             else:
-                info = ["wireless",
-                  misc.noneToBlankString(wireless.GetCurrentNetwork(iwconfig))]
+                info = ["wireless", essid]
         elif state == misc.WIRELESS:
             self.reconnect_tries = 0
-            info = [str(wifi_ip),
-                misc.noneToBlankString(wireless.GetCurrentNetwork(iwconfig)),
+            info = [str(wifi_ip), essid,
                 str(self._get_printable_sig_strength()),
-                str(wireless.GetCurrentNetworkID(iwconfig)),
-                misc.noneToBlankString(wireless.GetCurrentBitrate(iwconfig))]
+                str(self.snapshot.get('network_id', -1)),
+                misc.noneToBlankString(self.snapshot.get('bitrate'))]
         elif state == misc.WIRED:
             self.reconnect_tries = 0
             info = [str(wired_ip)]
@@ -294,7 +391,11 @@ class ConnectionStatus(object):
             print 'ERROR: Invalid state!'
             return True
 
-        daemon.SetConnectionStatus(state, info)
+        # Only tell the daemon when something actually changed, so a
+        # steady state costs a single D-Bus call per poll.
+        if (state, info) != self.last_status:
+            daemon.SetConnectionStatus(state, info)
+            self.last_status = (state, info)
 
         # Send a D-Bus signal announcing status has changed if necessary.
         if (state != self.last_state or (state == misc.WIRELESS and 
@@ -302,22 +403,22 @@ class ConnectionStatus(object):
             daemon.EmitStatusChanged(state, info)
 
         if (state != self.last_state) and (state == misc.NOT_CONNECTED) and \
-            (not daemon.GetForcedDisconnect()):
+            (not self.snapshot['forced_disconnect']):
             daemon.Disconnect()
             # Disconnect() sets forced disconnect = True
             # so we'll revert that
             daemon.SetForcedDisconnect(False)
         self.last_state = state
+        self._reschedule_poll()
         return True
 
     def _get_printable_sig_strength(self, always_positive=False):
         """ Get the correct signal strength format. """
         try:
-            if daemon.GetSignalDisplayType() == 0:
-                signal = wireless.GetCurrentSignalStrength(self.iwconfig)
+            signal = self.snapshot.get('signal')
+            if self.snapshot['signal_display_type'] == 0:
                 wifi_signal = int(signal)
             else:
-                signal = wireless.GetCurrentDBMStrength(self.iwconfig)
                 if always_positive:
                     # because dBm is negative, add 99 to the signal. This way,
                     # if the signal drops below -99, wifi_signal will == 0, and
@@ -358,7 +459,7 @@ class ConnectionStatus(object):
 
             # If we just lost a wireless connection, try to connect to that
             # network again.  Otherwise just call Autoconnect.
-            cur_net_id = wireless.GetCurrentNetworkID(self.iwconfig)
+            cur_net_id = self.snapshot.get('network_id', -1)
             if from_wireless and cur_net_id > -1:
                 # make sure disconnect scripts are run
                 # before we reconnect
@@ -0,0 +1,553 @@
+#!/usr/bin/env python
+
+""" netlink -- minimal rtnetlink support for wicd
+
+This module implements just enough of the Linux rtnetlink protocol for
+wicd to be notified about link and address changes and to manage
+routes, without having to poll the interfaces or call any external
+program.
+
+class RtnlEventSocket() -- Receives rtnetlink multicast notifications.
+class LinkStateTracker() -- Decides which notifications are worth acting on.
+class NetlinkSocket() -- Sends netlink requests and reads the replies.
+
+"""
+
+#
+#   Copyright (C) 2007 - 2009 Adam Blackburn
+#   Copyright (C) 2007 - 2009 Dan O'Reilly
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License Version 2 as
+#   published by the Free Software Foundation.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import errno
+import socket
+import struct
+
+# Got these from /usr/include/linux/netlink.h
+NETLINK_ROUTE = 0
+NETLINK_GENERIC = 16
+SOL_NETLINK = 270
+NETLINK_ADD_MEMBERSHIP = 1
+NLMSG_NOOP = 1
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLMSG_OVERRUN = 4
+
+NLM_F_REQUEST = 0x1
+NLM_F_MULTI = 0x2
+NLM_F_ACK = 0x4
+NLM_F_DUMP = 0x300
+NLM_F_EXCL = 0x200
+NLM_F_CREATE = 0x400
+
+# Got these from /usr/include/linux/rtnetlink.h
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_NEWROUTE = 24
+RTM_DELROUTE = 25
+RTM_GETROUTE = 26
+
+RT_TABLE_MAIN = 254
+RTPROT_BOOT = 3
+RT_SCOPE_UNIVERSE = 0
+RT_SCOPE_NOWHERE = 255
+RTN_UNICAST = 1
+
+# Route attributes
+RTA_DST = 1
+RTA_OIF = 4
+RTA_GATEWAY = 5
+RTA_TABLE = 15
+
+# Link attributes, from /usr/include/linux/if_link.h
+IFLA_IFNAME = 3
+IFLA_OPERSTATE = 16
+IFLA_CARRIER = 33
+
+# Address attributes, from /usr/include/linux/if_addr.h
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_LABEL = 3
+
+# Interface flags, from /usr/include/linux/if.h
+IFF_UP = 0x1
+IFF_RUNNING = 0x40
+IFF_LOWER_UP = 0x10000
+
+# Fake message type returned when the kernel dropped notifications
+# because we didn't read them fast enough.
+EVENT_OVERRUN = -1
+
+NLMSGHDR = 'IHHII'
+NLMSGHDR_LEN = struct.calcsize(NLMSGHDR)
+IFINFOMSG = 'BxHiII'
+IFINFOMSG_LEN = struct.calcsize(IFINFOMSG)
+IFADDRMSG = 'BBBBi'
+IFADDRMSG_LEN = struct.calcsize(IFADDRMSG)
+RTMSG = 'BBBBBBBBI'
+RTMSG_LEN = struct.calcsize(RTMSG)
+RTATTR = 'HH'
+RTATTR_LEN = struct.calcsize(RTATTR)
+# The nested/byte order flags are stored in the attribute type.
+NLA_TYPE_MASK = 0x3fff
+
+
+class NetlinkError(Exception):
+    """ Raised when the kernel rejects a netlink request. """
+    def __init__(self, error):
+        Exception.__init__(self, error, os.strerror(error))
+        self.errno = error
+
+    def __str__(self):
+        return '[Errno %d] %s' % (self.errno, os.strerror(self.errno))
+
+
+def align(length):
+    """ Round a length up to the netlink 4 byte alignment. """
+    return (length + 3) & ~3
+
+def pack_attr(attr_type, payload):
+    """ Pack a single routing attribute, including its padding. """
+    length = RTATTR_LEN + len(payload)
+    data = struct.pack(RTATTR, length, attr_type) + payload
+    return data + '\0' * (align(length) - length)
+
+def pack_message(msg_type, payload, flags=0, seq=0, pid=0):
+    """ Pack a netlink message with the given type and payload. """
+    length = NLMSGHDR_LEN + len(payload)
+    data = struct.pack(NLMSGHDR, length, msg_type, flags, seq, pid) + payload
+    return data + '\0' * (align(length) - length)
+
+def parse_attrs(data):
+    """ Parse a buffer of routing attributes into a dict.
+
+    Returns:
+    A dict mapping the attribute type to its raw payload.
+
+    """
+    attrs = {}
+    offset = 0
+    while offset + RTATTR_LEN <= len(data):
+        length, attr_type = struct.unpack(RTATTR,
+                                          data[offset:offset + RTATTR_LEN])
+        if length < RTATTR_LEN:
+            break
+        attrs[attr_type & NLA_TYPE_MASK] = \
+            data[offset + RTATTR_LEN:offset + length]
+        offset += align(length)
+    return attrs
+
+def _attr_string(attrs, attr_type):
+    """ Returns a NUL terminated string attribute, or None. """
+    value = attrs.get(attr_type)
+    if value is None:
+        return None
+    return value.split('\0', 1)[0]
+
+def _attr_address(family, attrs, attr_type):
+    """ Returns an address attribute in printable form, or None. """
+    value = attrs.get(attr_type)
+    if value is None:
+        return None
+    try:
+        if family == socket.AF_INET:
+            return socket.inet_ntoa(value[:4])
+        return socket.inet_ntop(family, value)
+    except (ValueError, socket.error):
+        return None
+
+def parse_link(msg_type, payload):
+    """ Parse the payload of a RTM_NEWLINK/RTM_DELLINK message. """
+    if len(payload) < IFINFOMSG_LEN:
+        return None
+    family, dev_type, index, flags, change = \
+        struct.unpack(IFINFOMSG, payload[:IFINFOMSG_LEN])
+    attrs = parse_attrs(payload[IFINFOMSG_LEN:])
+    carrier = attrs.get(IFLA_CARRIER)
+    if carrier is not None:
+        carrier = bool(ord(carrier[0]))
+    operstate = attrs.get(IFLA_OPERSTATE)
+    if operstate is not None:
+        operstate = ord(operstate[0])
+    return {'type' : msg_type,
+            'index' : index,
+            'ifname' : _attr_string(attrs, IFLA_IFNAME),
+            'dev_type' : dev_type,
+            'flags' : flags,
+            'change' : change,
+            'carrier' : carrier,
+            'operstate' : operstate,
+            'attrs' : attrs,
+           }
+
+def parse_addr(msg_type, payload):
+    """ Parse the payload of a RTM_NEWADDR/RTM_DELADDR message. """
+    if len(payload) < IFADDRMSG_LEN:
+        return None
+    family, prefixlen, flags, scope, index = \
+        struct.unpack(IFADDRMSG, payload[:IFADDRMSG_LEN])
+    attrs = parse_attrs(payload[IFADDRMSG_LEN:])
+    address = _attr_address(family, attrs, IFA_LOCAL)
+    if address is None:
+        address = _attr_address(family, attrs, IFA_ADDRESS)
+    return {'type' : msg_type,
+            'index' : index,
+            'family' : family,
+            'prefixlen' : prefixlen,
+            'address' : address,
+            'label' : _attr_string(attrs, IFA_LABEL),
+            'attrs' : attrs,
+           }
+
+def parse_messages(data):
+    """ Parse a buffer received from a netlink socket.
+
+    Returns:
+    A list of (type, flags, seq, payload) tuples, one per message.
+
+    """
+    messages = []
+    offset = 0
+    while offset + NLMSGHDR_LEN <= len(data):
+        length, msg_type, flags, seq, pid = \
+            struct.unpack(NLMSGHDR, data[offset:offset + NLMSGHDR_LEN])
+        if length < NLMSGHDR_LEN or offset + length > len(data):
+            break
+        payload = data[offset + NLMSGHDR_LEN:offset + length]
+        messages.append((msg_type, flags, seq, payload))
+        offset += align(length)
+    return messages
+
+def parse_events(data):
+    """ Parse a buffer of link/address notifications.
+
+    Messages that are not link or address notifications are ignored.
+
+    Returns:
+    A list of event dicts, see parse_link and parse_addr.
+
+    """
+    events = []
+    for msg_type, flags, seq, payload in parse_messages(data):
+        if msg_type in (RTM_NEWLINK, RTM_DELLINK):
+            event = parse_link(msg_type, payload)
+        elif msg_type in (RTM_NEWADDR, RTM_DELADDR):
+            event = parse_addr(msg_type, payload)
+        else:
+            continue
+        if event is not None:
+            events.append(event)
+    return events
+
+def parse_error(payload):
+    """ Returns the (positive) errno of a NLMSG_ERROR payload, 0 for ACKs. """
+    error, = struct.unpack('i', payload[:4])
+    return -error
+
+def pack_route(family=socket.AF_INET, dst_len=0, table=RT_TABLE_MAIN,
+               protocol=RTPROT_BOOT, scope=RT_SCOPE_UNIVERSE,
+               rtn_type=RTN_UNICAST, gateway=None, oif=None):
+    """ Pack the payload of a RTM_NEWROUTE/RTM_DELROUTE request.
+
+    Only IPv4 default routes are supported, which is all wicd needs.
+
+    """
+    payload = struct.pack(RTMSG, family, dst_len, 0, 0, table, protocol,
+                          scope, rtn_type, 0)
+    if gateway:
+        payload += pack_attr(RTA_GATEWAY, socket.inet_aton(gateway))
+    if oif is not None:
+        payload += pack_attr(RTA_OIF, struct.pack('i', oif))
+    return payload
+
+def parse_route(payload):
+    """ Parse the payload of a RTM_NEWROUTE message. """
+    if len(payload) < RTMSG_LEN:
+        return None
+    (family, dst_len, src_len, tos, table, protocol, scope, rtn_type,
+     flags) = struct.unpack(RTMSG, payload[:RTMSG_LEN])
+    attrs = parse_attrs(payload[RTMSG_LEN:])
+    if RTA_TABLE in attrs:
+        table, = struct.unpack('I', attrs[RTA_TABLE][:4])
+    oif = attrs.get(RTA_OIF)
+    if oif is not None:
+        oif, = struct.unpack('i', oif[:4])
+    return {'family' : family,
+            'dst_len' : dst_len,
+            'table' : table,
+            'protocol' : protocol,
+            'scope' : scope,
+            'type' : rtn_type,
+            'oif' : oif,
+            'gateway' : _attr_address(family, attrs, RTA_GATEWAY),
+            'dst' : _attr_address(family, attrs, RTA_DST),
+           }
+
+def get_ifindex(iface):
+    """ Returns the kernel index of the given interface, or None. """
+    try:
+        f = open('/sys/class/net/%s/ifindex' % iface)
+        try:
+            return int(f.read().strip())
+        finally:
+            f.close()
+    except (IOError, ValueError):
+        return None
+
+
+class RtnlEventSocket(object):
+    """ A non-blocking socket subscribed to rtnetlink notifications. """
+    def __init__(self, groups=RTMGRP_LINK | RTMGRP_IPV4_IFADDR):
+        """ Open the socket and join the given multicast groups.
+
+        Raises socket.error if netlink isn't available.
+
+        """
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                                  NETLINK_ROUTE)
+        try:
+            self.sock.bind((0, groups))
+            self.sock.setblocking(False)
+        except socket.error:
+            self.sock.close()
+            raise
+
+    def fileno(self):
+        """ Returns the file descriptor, for use with select/gobject. """
+        return self.sock.fileno()
+
+    def read_events(self):
+        """ Read all the pending notifications.
+
+        Returns:
+        A list of event dicts.  If the kernel reported that some
+        notifications were dropped, an event with the type
+        EVENT_OVERRUN is included, meaning the caller can't trust
+        its view of the links anymore.
+
+        """
+        events = []
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except socket.error, e:
+                if e.args[0] == errno.ENOBUFS:
+                    events.append({'type' : EVENT_OVERRUN, 'index' : 0})
+                    continue
+                if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    print 'Error reading netlink socket: %s' % str(e)
+                break
+            if not data:
+                break
+            events.extend(parse_events(data))
+        return events
+
+    def close(self):
+        """ Close the socket. """
+        self.sock.close()
+
+
+class NetlinkSocket(object):
+    """ A socket used to send requests to the kernel over netlink. """
+    def __init__(self, protocol=NETLINK_ROUTE):
+        """ Open the socket.
+
+        Keyword arguments:
+        protocol -- the netlink protocol, NETLINK_ROUTE for rtnetlink
+
+        Raises socket.error if netlink isn't available.
+
+        """
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                                  protocol)
+        try:
+            self.sock.bind((0, 0))
+        except socket.error:
+            self.sock.close()
+            raise
+        self.seq = 0
+
+    def _send(self, msg_type, payload, flags):
+        """ Send a request and return its sequence number. """
+        self.seq += 1
+        self.sock.send(pack_message(msg_type, payload,
+                                    flags | NLM_F_REQUEST, self.seq))
+        return self.seq
+
+    def request(self, msg_type, payload, flags=0):
+        """ Send a request and wait for the kernel to acknowledge it.
+
+        Raises NetlinkError if the request failed.
+
+        Returns:
+        A list of the payloads of the replies received before the
+        acknowledgement.
+
+        """
+        seq = self._send(msg_type, payload, flags | NLM_F_ACK)
+        replies = []
+        while True:
+            for reply_type, reply_flags, reply_seq, reply in \
+                    parse_messages(self.sock.recv(65536)):
+                if reply_seq != seq:
+                    continue
+                if reply_type != NLMSG_ERROR:
+                    replies.append(reply)
+                    continue
+                error = parse_error(reply)
+                if error:
+                    raise NetlinkError(error)
+                return replies
+
+    def dump(self, msg_type, payload):
+        """ Send a dump request.
+
+        Returns:
+        A list of the payloads of all the messages returned.
+
+        """
+        seq = self._send(msg_type, payload, NLM_F_DUMP)
+        results = []
+        while True:
+            for reply_type, reply_flags, reply_seq, reply in \
+                    parse_messages(self.sock.recv(65536)):
+                if reply_seq != seq:
+                    continue
+                if reply_type == NLMSG_DONE:
+                    return results
+                if reply_type == NLMSG_ERROR:
+                    error = parse_error(reply)
+                    if error:
+                        raise NetlinkError(error)
+                    return results
+                results.append(reply)
+
+    def fileno(self):
+        """ Returns the file descriptor, for use with select/gobject. """
+        return self.sock.fileno()
+
+    def add_membership(self, group):
+        """ Join the multicast group with the given id. """
+        self.sock.setsockopt(SOL_NETLINK, NETLINK_ADD_MEMBERSHIP, group)
+
+    def close(self):
+        """ Close the socket. """
+        self.sock.close()
+
+
+class LinkStateTracker(object):
+    """ Filters rtnetlink notifications down to meaningful changes.
+
+    The kernel sends RTM_NEWLINK for lots of things that don't affect
+    connectivity (statistics, wireless scan events, ...).  This class
+    remembers the last flags and carrier seen for every link, so that
+    only carrier, up/down and address changes are reported.
+
+    Interfaces can also be tracked by name, in which case their index
+    is picked up from the link notifications, so interfaces that show
+    up later or are re-created with a new index are still followed.
+
+    """
+    def __init__(self, indices=None, names=None):
+        """ Initialize the tracker.
+
+        Keyword arguments:
+        indices -- list of interface indices to track.
+        names -- list of interface names to track.
+
+        If both are empty, every interface except the loopback is tracked.
+
+        """
+        self._links = {}
+        self.indices = set()
+        self.names = set()
+        if names:
+            self.set_names(names)
+        else:
+            self.set_indices(indices or [])
+
+    def set_indices(self, indices):
+        """ Set the list of interface indices we care about. """
+        self.indices = set([i for i in indices if i is not None])
+        self._links = {}
+
+    def set_names(self, names):
+        """ Set the list of interface names we care about.
+
+        The indices of the interfaces that currently exist are looked
+        up right away, the others are added once the kernel announces
+        them.
+
+        """
+        self.names = set([name for name in names if name])
+        self.set_indices([get_ifindex(name) for name in self.names])
+
+    def _tracked(self, index):
+        """ Returns True if changes on the interface should be reported. """
+        if self.indices or self.names:
+            return index in self.indices
+        return index != 1
+
+    def _update_index(self, event):
+        """ Follow tracked interfaces appearing, disappearing or renamed. """
+        if not self.names or event['type'] not in (RTM_NEWLINK, RTM_DELLINK):
+            return
+        index = event['index']
+        if event['type'] == RTM_DELLINK:
+            # A re-created interface gets a new index.
+            self.indices.discard(index)
+        elif event['ifname'] in self.names:
+            self.indices.add(index)
+        elif event['ifname'] is not None and index in self.indices:
+            self.indices.discard(index)
+            self._links.pop(index, None)
+
+    def is_relevant(self, event):
+        """ Returns True if the event might change the connection state. """
+        if event['type'] == EVENT_OVERRUN:
+            if self.names:
+                # Notifications about our interfaces may have been lost.
+                self.set_names(self.names)
+            self._links = {}
+            return True
+        tracked = self._tracked(event['index'])
+        self._update_index(event)
+        if not tracked and not self._tracked(event['index']):
+            return False
+        if event['type'] in (RTM_NEWADDR, RTM_DELADDR, RTM_DELLINK) or \
+           not self._tracked(event['index']):
+            if event['type'] == RTM_DELLINK:
+                self._links.pop(event['index'], None)
+            return True
+        mask = IFF_UP | IFF_RUNNING | IFF_LOWER_UP
+        state = (event['flags'] & mask, event['carrier'], event['operstate'])
+        if self._links.get(event['index']) == state:
+            return False
+        self._links[event['index']] = state
+        return True
+
+    def filter(self, events):
+        """ Returns True if any of the given events is relevant. """
+        relevant = False
+        for event in events:
+            # Don't short-circuit, every event has to update our state.
+            if self.is_relevant(event):
+                relevant = True
+        return relevant
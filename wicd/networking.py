@@ -61,6 +61,10 @@ if __name__ == '__main__':
 BACKEND = None
 BACKEND_MGR = BackendManager()
 
+# Seconds any single command run while connecting may take before it is
+# killed.  DHCP clients give up on their own well before that.
+COMMAND_TIMEOUT = 90
+
 def abortable(func):
     """ Mark a method in a ConnectionThread as abortable. 
     
@@ -288,6 +292,38 @@ class Controller(object):
         return self.iface.AppAvailable(app)
     
 
+class ConnectTraces(object):
+    """ The timed phases of the last connection attempts.
+
+    Every connection thread adds a trace when it ends, and only the
+    last max_traces are kept.
+
+    """
+    def __init__(self, max_traces=20):
+        """ Initialise an empty list of traces. """
+        self.max_traces = max_traces
+        self._traces = []
+        self._lock = threading.Lock()
+
+    def add(self, trace):
+        """ Adds the trace of a connection attempt. """
+        self._lock.acquire()
+        try:
+            self._traces.append(trace)
+            del self._traces[:-self.max_traces]
+        finally:
+            self._lock.release()
+
+    def get(self):
+        """ Returns the traces, oldest first. """
+        self._lock.acquire()
+        try:
+            return list(self._traces)
+        finally:
+            self._lock.release()
+
+connect_traces = ConnectTraces()
+
 class ConnectThread(threading.Thread):
     """ A class to perform network connections in a multi-threaded way.
 
@@ -343,7 +379,16 @@ class ConnectThread(threading.Thread):
 
         self.connecting_status = None
         self.debug = debug
-        
+
+        # The phases of the connection, as (phase, start) pairs timed
+        # with misc.monotonic().
+        self.phases = []
+        self.started = time.time()
+
+        # Cancelled along with the connection, to kill the command the
+        # thread is waiting for.
+        self.cancel_token = misc.CancelToken(timeout=COMMAND_TIMEOUT)
+
         self.SetStatus('interface_down')
 
     def _connect(self):
@@ -351,18 +396,74 @@ class ConnectThread(threading.Thread):
 
     def run(self):
         self.connect_result = "failed"
+        misc.set_cancel_token(self.cancel_token)
         try:
-            self._connect()
+            try:
+                self._connect()
+            except misc.CommandCancelled:
+                self.connect_aborted('aborted')
         finally:
+            misc.set_cancel_token(None)
             self.is_connecting = False
+            connect_traces.add(self.get_trace())
+
+    def mark_phase(self, phase):
+        """ Starts timing a new phase of the connection.
+
+        SetStatus marks every status as a phase.  Steps that don't
+        have a status of their own are marked with this directly, so
+        they show up in the trace separately.
+
+        """
+        self.lock.acquire()
+        try:
+            if not self.phases or self.phases[-1][0] != phase:
+                self.phases.append((phase, misc.monotonic()))
+        finally:
+            self.lock.release()
+
+    def get_trace(self):
+        """ Returns the timed phases of the connection so far.
+
+        Returns:
+        A dict with the 'network' (the ESSID, or the name of the wired
+        profile) and its 'bssid', the wall clock time the connection
+        'started' at, its 'result', its total 'duration' in seconds,
+        and the 'phases' it went through with the 'durations' of each.
+
+        """
+        self.lock.acquire()
+        try:
+            phases = list(self.phases)
+        finally:
+            self.lock.release()
+        now = misc.monotonic()
+        ends = [start for phase, start in phases[1:]] + [now]
+        name = self.network.get('essid', self.network.get('profilename'))
+        return {'network' : misc.noneToBlankString(name),
+                'bssid' : misc.noneToBlankString(self.network.get('bssid',
+                                                                  'wired')),
+                'started' : self.started,
+                'result' : misc.noneToBlankString(self.connect_result),
+                'duration' : now - phases[0][1],
+                'phases' : [phase for phase, start in phases],
+                'durations' : [end - start for (phase, start), end
+                               in zip(phases, ends)]}
         
     def set_should_die(self, val):
-        """ Setter for should_die property. """
+        """ Setter for should_die property.
+
+        Setting it also kills the command the thread is waiting for,
+        so it doesn't have to finish first.
+
+        """
         self.lock.acquire()
         try:
             self._should_die = val
         finally:
             self.lock.release()
+        if val:
+            self.cancel_token.cancel()
     def get_should_die(self):
         """ Getter for should_die property. """
         return self._should_die
@@ -380,6 +481,7 @@ class ConnectThread(threading.Thread):
             self.connecting_status = status
         finally:
             self.lock.release()
+        self.mark_phase(status)
 
     def GetStatus(self):
         """ Get the threads current status message in a thread-safe way.
@@ -476,7 +578,12 @@ class ConnectThread(threading.Thread):
             else:
                 hname = None
                 print "Running DHCP with NO hostname"
-            dhcp_status = iface.StartDHCP(hname)
+            # Leases are kept per access point, or per wired profile.
+            if self.network.get('bssid'):
+                lease_key = self.network['bssid']
+            else:
+                lease_key = 'wired:%s' % self.network.get('profilename')
+            dhcp_status = iface.StartDHCP(hname, lease_key)
             if dhcp_status in ['no_dhcp_offers', 'dhcp_failed']:
                 if self.connect_result != "aborted":
                     self.abort_connection(dhcp_status)
@@ -491,6 +598,7 @@ class ConnectThread(threading.Thread):
         setup.
 
         """
+        self.mark_phase('flushing_dns')
         iface.FlushDNS()
 
     @abortable
@@ -501,6 +609,7 @@ class ConnectThread(threading.Thread):
         Otherwise do nothing.
         
         """
+        self.mark_phase('setting_dns')
         if self.network.get('use_global_dns'):
             iface.SetDNS(misc.Noneify(self.global_dns_1),
                          misc.Noneify(self.global_dns_2), 
@@ -520,6 +629,7 @@ class ConnectThread(threading.Thread):
     def release_dhcp_clients(self, iface):
         """ Release all running dhcp clients. """
         print "Releasing DHCP leases..."
+        self.mark_phase('releasing_dhcp')
         iface.ReleaseDHCP()
         
     def connect_aborted(self, reason):
@@ -534,7 +644,10 @@ class ConnectThread(threading.Thread):
         
     def abort_connection(self, reason=""):
         """ Schedule a connection abortion for the given reason. """
-        self.abort_reason = reason
+        # A cancelled connection can fail because its commands were
+        # killed, but it was still cancelled.
+        if not self.should_die:
+            self.abort_reason = reason
         self.should_die = True
         
     def abort_if_needed(self):
@@ -551,6 +664,7 @@ class ConnectThread(threading.Thread):
     def stop_wpa(self, iface):
         """ Stops wpa_supplicant. """
         print 'Stopping wpa_supplicant'
+        self.mark_phase('stopping_wpa')
         iface.StopWPA()
         
     @abortable
@@ -560,7 +674,7 @@ class ConnectThread(threading.Thread):
         self.SetStatus('interface_up')
         iface.Up()
         for x in range(0, 5):
-            time.sleep(2)
+            misc.sleep(2)
             if iface.IsUp():
                 return
             self.abort_if_needed()
@@ -579,6 +693,7 @@ class Wireless(Controller):
         self._wireless_interface = None
         self.wiface = None 
         self.should_verify_ap = True
+        self._persistent_wpa = False
         
     def set_wireless_iface(self, value):
         """ Setter for wireless_interface property. """
@@ -599,6 +714,16 @@ class Wireless(Controller):
         """ Getter for wpa_driver property. """
         return self._wpa_driver
     wpa_driver = property(get_wpa_driver, set_wpa_driver)
+
+    def set_persistent_wpa(self, value):
+        """ Setter for persistent_wpa property. """
+        self._persistent_wpa = value
+        if self.wiface:
+            self.wiface.SetPersistentWpa(value)
+    def get_persistent_wpa(self):
+        """ Getter for persistent_wpa property. """
+        return self._persistent_wpa
+    persistent_wpa = property(get_persistent_wpa, set_persistent_wpa)
     
     def set_iface(self, value):
         """ Setter for iface property. """
@@ -620,6 +745,7 @@ class Wireless(Controller):
         if backend:
             self.wiface = backend.WirelessInterface(self.wireless_interface,
                                                     self.debug, self.wpa_driver)
+            self.wiface.SetPersistentWpa(self.persistent_wpa)
 
     def Scan(self, essid=None):
         """ Scan for available wireless networks.
@@ -710,15 +836,15 @@ class Wireless(Controller):
             return self.connecting_thread.network['essid']
         return self.wiface.GetCurrentNetwork(iwconfig)
     
-    def GetBSSID(self):
-        """ Get the BSSID of the current access point. 
-        
+    def GetBSSID(self, iwconfig=None):
+        """ Get the BSSID of the current access point.
+
         Returns:
         The MAC Adress of the active access point as a string, or
         None the BSSID can't be found.
-        
+
         """
-        return self.wiface.GetBSSID()
+        return self.wiface.GetBSSID(iwconfig)
 
     def GetCurrentBitrate(self, iwconfig):
         """ Get the current bitrate of the interface. 
@@ -788,7 +914,7 @@ class Wireless(Controller):
         print 'Creating ad-hoc network'
         print 'Stopping dhcp client and wpa_supplicant'
         wiface.ReleaseDHCP()
-        wiface.StopWPA()
+        wiface.StopWPA(terminate=True)
         print 'Putting wireless interface down'
         wiface.Down()
         print 'Setting mode, channel, and essid'
@@ -936,6 +1062,7 @@ class WirelessConnectThread(ConnectThread):
         self.is_connecting = True
         
         # Run pre-connection script.
+        self.mark_phase('preconnect_scripts')
         self.run_global_scripts_if_needed(wpath.preconnectscripts,
                                           extra_parameters=('wireless',
                                                     self.network['essid'],
@@ -964,6 +1091,7 @@ class WirelessConnectThread(ConnectThread):
             self.generate_psk_and_authenticate(wiface)
             
         # Associate.
+        self.mark_phase('associating')
         wiface.Associate(self.network['essid'], self.network['channel'],
                          self.network['bssid'])
 
@@ -975,7 +1103,8 @@ class WirelessConnectThread(ConnectThread):
         # Validate Authentication.
         if self.network.get('enctype'):
             self.SetStatus('validating_authentication')
-            if not wiface.ValidateAuthentication(time.time()):
+            if not wiface.ValidateAuthentication(time.time(),
+                                                 lambda: self.should_die):
                 print "connect result is %s" % self.connect_result
                 if not self.connect_result or self.connect_result == 'failed':
                     self.abort_connection('bad_pass')
@@ -987,6 +1116,7 @@ class WirelessConnectThread(ConnectThread):
         self.verify_association(wiface)
         
         # Run post-connection script.
+        self.mark_phase('postconnect_scripts')
         self.run_global_scripts_if_needed(wpath.postconnectscripts,
                                           extra_parameters=('wireless',
                                                     self.network['essid'],
@@ -1020,7 +1150,7 @@ class WirelessConnectThread(ConnectThread):
                 if retcode == 0: 
                     print "Successfully associated."
                     break
-                time.sleep(1)
+                misc.sleep(1)
             #TODO this should be in wnettools.py
             if retcode:
                 print "Connection Failed: Failed to ping the access point!"
@@ -1048,9 +1178,20 @@ class WirelessConnectThread(ConnectThread):
             print "enctype is %s" % self.network.get('enctype')
         if self.network.get('key') and \
            'wpa' in str(self.network.get('enctype')):
-            self.SetStatus('generating_psk')
-            print 'Generating psk...'
-            self.network['psk'] = wiface.GeneratePSK(self.network)
+            # The PSK is saved with the profile, along with a hash of
+            # what it was derived from, so it is only generated again
+            # when the essid or the key change.
+            cache_key = misc.psk_cache_key(self.network.get('essid'),
+                                           self.network['key'])
+            if self.network.get('psk') and \
+               self.network.get('psk_cache_key') == cache_key:
+                print 'Using saved psk'
+            else:
+                self.SetStatus('generating_psk')
+                print 'Generating psk...'
+                self.network['psk'] = wiface.GeneratePSK(self.network)
+                if self.network['psk']:
+                    self.network['psk_cache_key'] = cache_key
             
             if not self.network.get('psk'):
                 self.network['psk'] = self.network['key']
@@ -1205,6 +1346,7 @@ class WiredConnectThread(ConnectThread):
         self.is_connecting = True
 
         # Run pre-connection script.
+        self.mark_phase('preconnect_scripts')
         self.run_global_scripts_if_needed(wpath.preconnectscripts,
                                           extra_parameters=('wired', 'wired',
                                                     self.network['profilename'])
@@ -1233,6 +1375,7 @@ class WiredConnectThread(ConnectThread):
         self.set_dns_addresses(liface)
         
         # Run post-connection script.
+        self.mark_phase('postconnect_scripts')
         self.run_global_scripts_if_needed(wpath.postconnectscripts,
                                           extra_parameters=('wired', 'wired',
                                                 self.network['profilename'])
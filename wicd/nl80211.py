@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+
+""" nl80211 -- wireless scanning through generic netlink
+
+This module asks the kernel's cfg80211 layer for scan results over
+nl80211 and decodes them, including the information elements, straight
+into the access point dicts used by the rest of wicd.  It is much
+cheaper than running iwlist and parsing its output.
+
+class Nl80211() -- Triggers scans and fetches their results.
+
+"""
+
+#
+#   Copyright (C) 2007 - 2009 Adam Blackburn
+#   Copyright (C) 2007 - 2009 Dan O'Reilly
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License Version 2 as
+#   published by the Free Software Foundation.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import errno
+import select
+import struct
+import time
+
+from wicd import misc
+from wicd import netlink
+
+# Got these from /usr/include/linux/genetlink.h
+GENL_ID_CTRL = 0x10
+CTRL_CMD_GETFAMILY = 3
+CTRL_ATTR_FAMILY_ID = 1
+CTRL_ATTR_FAMILY_NAME = 2
+CTRL_ATTR_MCAST_GROUPS = 7
+CTRL_ATTR_MCAST_GRP_NAME = 1
+CTRL_ATTR_MCAST_GRP_ID = 2
+
+GENLMSGHDR = 'BBH'
+GENLMSGHDR_LEN = struct.calcsize(GENLMSGHDR)
+
+# Got these from /usr/include/linux/nl80211.h
+NL80211_CMD_GET_SCAN = 32
+NL80211_CMD_TRIGGER_SCAN = 33
+NL80211_CMD_NEW_SCAN_RESULTS = 34
+NL80211_CMD_SCAN_ABORTED = 35
+
+NL80211_ATTR_IFINDEX = 3
+NL80211_ATTR_SCAN_SSIDS = 45
+NL80211_ATTR_BSS = 47
+
+NL80211_BSS_BSSID = 1
+NL80211_BSS_FREQUENCY = 2
+NL80211_BSS_CAPABILITY = 5
+NL80211_BSS_INFORMATION_ELEMENTS = 6
+NL80211_BSS_SIGNAL_MBM = 7
+NL80211_BSS_SIGNAL_UNSPEC = 8
+
+# Capability bits and element ids, from the 802.11 standard.
+WLAN_CAPABILITY_IBSS = 0x2
+WLAN_CAPABILITY_PRIVACY = 0x10
+
+WLAN_EID_SSID = 0
+WLAN_EID_SUPP_RATES = 1
+WLAN_EID_DS_PARAMS = 3
+WLAN_EID_RSN = 48
+WLAN_EID_EXT_SUPP_RATES = 50
+WLAN_EID_VENDOR_SPECIFIC = 221
+
+# Microsoft OUI followed by the WPA element type.
+WPA_IE_PREFIX = '\x00\x50\xf2\x01'
+
+SCAN_TIMEOUT = 10
+
+
+def pack_genl(cmd, attrs='', version=0):
+    """ Pack a generic netlink payload. """
+    return struct.pack(GENLMSGHDR, cmd, version, 0) + attrs
+
+def parse_genl(payload):
+    """ Split a generic netlink payload.
+
+    Returns:
+    A (cmd, attrs) tuple, where attrs is a dict as returned by
+    netlink.parse_attrs.
+
+    """
+    if len(payload) < GENLMSGHDR_LEN:
+        return None, {}
+    cmd, version, reserved = struct.unpack(GENLMSGHDR,
+                                           payload[:GENLMSGHDR_LEN])
+    return cmd, netlink.parse_attrs(payload[GENLMSGHDR_LEN:])
+
+def freq_to_channel(freq):
+    """ Translate a frequency in MHz to a channel number, or None. """
+    if freq == 2484:
+        return 14
+    elif 2412 <= freq < 2484:
+        return (freq - 2407) // 5
+    elif 5000 <= freq < 5900:
+        return (freq - 5000) // 5
+    return None
+
+def format_rate(rate):
+    """ Format a supported rate byte in Mb/s, like iwlist does. """
+    rate = (ord(rate) & 0x7f) * 5
+    if rate % 10:
+        return '%d.%d' % (rate // 10, rate % 10)
+    return str(rate // 10)
+
+def signal_to_quality(dbm):
+    """ Map a signal in dBm to a 0-100 quality, the same way cfg80211
+    computes the wireless extensions link quality. """
+    dbm = min(max(dbm, -110), -40)
+    return 100 * (dbm + 110) // 70
+
+def parse_ies(data):
+    """ Walk a buffer of information elements.
+
+    Returns:
+    A list of (element id, body) tuples, in the order they appear.
+
+    """
+    ies = []
+    offset = 0
+    while offset + 2 <= len(data):
+        eid = ord(data[offset])
+        length = ord(data[offset + 1])
+        body = data[offset + 2:offset + 2 + length]
+        if len(body) < length:
+            break
+        ies.append((eid, body))
+        offset += 2 + length
+    return ies
+
+def parse_bss(attrs):
+    """ Convert the attributes of a scan result into an access point dict.
+
+    The dict has the same keys and value formats as the one built
+    from iwlist output by BaseWirelessInterface._ParseAccessPoint.
+
+    Returns:
+    The access point dict, or None if it couldn't be parsed.
+
+    """
+    bss = attrs.get(NL80211_ATTR_BSS)
+    if bss is None:
+        return None
+    bss = netlink.parse_attrs(bss)
+    bssid = bss.get(NL80211_BSS_BSSID)
+    if not bssid or len(bssid) != 6:
+        return None
+
+    ap = {}
+    ap['bssid'] = ':'.join(['%02X' % ord(c) for c in bssid])
+
+    capability = 0
+    if NL80211_BSS_CAPABILITY in bss:
+        capability, = struct.unpack('H', bss[NL80211_BSS_CAPABILITY][:2])
+    if capability & WLAN_CAPABILITY_IBSS:
+        ap['mode'] = 'Ad-Hoc'
+    else:
+        ap['mode'] = 'Master'
+
+    essid = ''
+    channel = None
+    rates = []
+    has_rsn = has_wpa = False
+    for eid, body in parse_ies(bss.get(NL80211_BSS_INFORMATION_ELEMENTS,
+                                       '')):
+        if eid == WLAN_EID_SSID:
+            essid = body
+        elif eid in (WLAN_EID_SUPP_RATES, WLAN_EID_EXT_SUPP_RATES):
+            rates.extend([format_rate(r) for r in body])
+        elif eid == WLAN_EID_DS_PARAMS and body:
+            channel = ord(body[0])
+        elif eid == WLAN_EID_RSN:
+            has_rsn = True
+        elif eid == WLAN_EID_VENDOR_SPECIFIC and \
+             body.startswith(WPA_IE_PREFIX):
+            has_wpa = True
+
+    try:
+        ap['essid'] = misc.to_unicode(essid)
+    except (UnicodeDecodeError, UnicodeEncodeError):
+        print 'Unicode problem with current network essid, ignoring!!'
+        return None
+    # Hidden networks send an empty ESSID, or one made of NUL bytes.
+    ap['essid'] = ap['essid'].replace('\x00', '')
+    if not ap['essid']:
+        ap['hidden'] = True
+        ap['essid'] = "<hidden>"
+    else:
+        ap['hidden'] = False
+
+    if NL80211_BSS_FREQUENCY in bss:
+        freq, = struct.unpack('I', bss[NL80211_BSS_FREQUENCY][:4])
+        channel = freq_to_channel(freq) or channel
+    if channel is None:
+        ap['channel'] = None
+    else:
+        ap['channel'] = str(channel)
+
+    if rates:
+        ap['bitrates'] = sorted(rates, key=float)
+    else:
+        ap['bitrates'] = None
+
+    if capability & WLAN_CAPABILITY_PRIVACY:
+        ap['encryption'] = True
+        if has_rsn:
+            ap['encryption_method'] = 'WPA2'
+        elif has_wpa:
+            ap['encryption_method'] = 'WPA'
+        else:
+            ap['encryption_method'] = 'WEP'
+    else:
+        ap['encryption'] = False
+
+    if NL80211_BSS_SIGNAL_MBM in bss:
+        mbm, = struct.unpack('i', bss[NL80211_BSS_SIGNAL_MBM][:4])
+        dbm = mbm // 100
+        ap['strength'] = str(dbm)
+        ap['quality'] = signal_to_quality(dbm)
+    elif NL80211_BSS_SIGNAL_UNSPEC in bss:
+        ap['strength'] = -1
+        ap['quality'] = ord(bss[NL80211_BSS_SIGNAL_UNSPEC][0])
+    else:
+        ap['strength'] = -1
+        ap['quality'] = -1
+    return ap
+
+def parse_scan_dump(data):
+    """ Parse a raw NL80211_CMD_GET_SCAN dump, as read from the socket.
+
+    Returns:
+    A list of access point dicts.
+
+    """
+    aps = []
+    for msg_type, flags, seq, payload in netlink.parse_messages(data):
+        if msg_type < GENL_ID_CTRL:
+            # NLMSG_DONE, NLMSG_ERROR, ...
+            continue
+        cmd, attrs = parse_genl(payload)
+        ap = parse_bss(attrs)
+        if ap is not None:
+            aps.append(ap)
+    return aps
+
+
+class Nl80211(object):
+    """ Talks to the nl80211 generic netlink family. """
+    def __init__(self):
+        """ Open the netlink socket and look up the nl80211 family.
+
+        Raises socket.error if generic netlink isn't available, and
+        netlink.NetlinkError if nl80211 isn't (e.g. no cfg80211).
+
+        """
+        self.sock = netlink.NetlinkSocket(netlink.NETLINK_GENERIC)
+        self.family_id = None
+        self.mcast_groups = {}
+        try:
+            self._resolve_family()
+        except:
+            self.sock.close()
+            raise
+
+    def _resolve_family(self):
+        """ Look up the id and the multicast groups of nl80211. """
+        replies = self.sock.request(GENL_ID_CTRL,
+            pack_genl(CTRL_CMD_GETFAMILY,
+                      netlink.pack_attr(CTRL_ATTR_FAMILY_NAME, 'nl80211\0'),
+                      version=1))
+        for reply in replies:
+            cmd, attrs = parse_genl(reply)
+            if CTRL_ATTR_FAMILY_ID not in attrs:
+                continue
+            self.family_id, = struct.unpack('H',
+                                            attrs[CTRL_ATTR_FAMILY_ID][:2])
+            groups = netlink.parse_attrs(attrs.get(CTRL_ATTR_MCAST_GROUPS,
+                                                   ''))
+            for group in groups.values():
+                group = netlink.parse_attrs(group)
+                name = group.get(CTRL_ATTR_MCAST_GRP_NAME, '').rstrip('\0')
+                if name and CTRL_ATTR_MCAST_GRP_ID in group:
+                    self.mcast_groups[name], = \
+                        struct.unpack('I', group[CTRL_ATTR_MCAST_GRP_ID][:4])
+        if self.family_id is None:
+            raise netlink.NetlinkError(errno.ENOENT)
+
+    def _ifindex_attr(self, ifindex):
+        """ Returns the packed interface index attribute. """
+        return netlink.pack_attr(NL80211_ATTR_IFINDEX,
+                                 struct.pack('I', ifindex))
+
+    def trigger_scan(self, ifindex, timeout=SCAN_TIMEOUT):
+        """ Start a scan and wait until it's done.
+
+        Returns:
+        True if new scan results are available, False if the scan
+        couldn't be started or didn't finish in time.  The cached
+        results can be used in the latter case.
+
+        """
+        events = netlink.NetlinkSocket(netlink.NETLINK_GENERIC)
+        try:
+            if 'scan' in self.mcast_groups:
+                events.add_membership(self.mcast_groups['scan'])
+            # An empty SSID makes it a wildcard (broadcast) scan.
+            attrs = self._ifindex_attr(ifindex) + \
+                    netlink.pack_attr(NL80211_ATTR_SCAN_SSIDS,
+                                      netlink.pack_attr(1, ''))
+            try:
+                self.sock.request(self.family_id,
+                                  pack_genl(NL80211_CMD_TRIGGER_SCAN, attrs))
+            except netlink.NetlinkError, e:
+                # EBUSY means a scan is already running, so wait for it.
+                if e.errno != errno.EBUSY:
+                    print 'Failed to trigger nl80211 scan: %s' % str(e)
+                    return False
+            if 'scan' not in self.mcast_groups:
+                return False
+            return self._wait_for_scan(events, ifindex, timeout)
+        finally:
+            events.close()
+
+    def _wait_for_scan(self, events, ifindex, timeout):
+        """ Wait for the end of scan notification for the interface. """
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            readable = select.select([events.fileno()], [], [], remaining)[0]
+            if not readable:
+                return False
+            data = events.sock.recv(65536)
+            for msg_type, flags, seq, payload in \
+                    netlink.parse_messages(data):
+                cmd, attrs = parse_genl(payload)
+                index = attrs.get(NL80211_ATTR_IFINDEX)
+                if index is None or \
+                   struct.unpack('I', index[:4])[0] != ifindex:
+                    continue
+                if cmd == NL80211_CMD_NEW_SCAN_RESULTS:
+                    return True
+                if cmd == NL80211_CMD_SCAN_ABORTED:
+                    return False
+
+    def get_scan(self, ifindex):
+        """ Returns the scan results of the interface as AP dicts. """
+        replies = self.sock.dump(self.family_id,
+                                 pack_genl(NL80211_CMD_GET_SCAN,
+                                           self._ifindex_attr(ifindex)))
+        aps = []
+        for reply in replies:
+            cmd, attrs = parse_genl(reply)
+            ap = parse_bss(attrs)
+            if ap is not None:
+                aps.append(ap)
+        return aps
+
+    def close(self):
+        """ Close the socket. """
+        self.sock.close()
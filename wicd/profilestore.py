@@ -0,0 +1,379 @@
+#!/usr/bin/env python
+
+""" profilestore -- Wireless profiles kept in an SQLite database.
+
+wireless-settings.conf is parsed whole when the daemon starts, and
+written whole when a profile changes, which gets slow once thousands
+of networks were saved.  SQLiteProfileStore keeps the profiles in a
+database instead, where each profile is read and updated on its own.
+
+A profile store is anything the daemon can use as its wireless
+configuration.  Like ConfigManager, it provides get_option/get,
+set_option/set, get_section, set_section, has_section, sections,
+remove_section, remove_option, write, reload, flush and batch, and a
+generation that changes with the profiles.  Stores can also provide
+get_profile, which ProfileIndex then uses instead of its own index.
+
+"""
+
+#
+#   Copyright (C) 2008-2009 Adam Blackburn
+#   Copyright (C) 2008-2009 Dan O'Reilly
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License Version 2 as
+#   published by the Free Software Foundation.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import sqlite3
+from threading import RLock
+from contextlib import contextmanager
+
+from wicd.configmanager import ConfigManager, ConfigValues
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    section TEXT PRIMARY KEY,
+    bssid TEXT,
+    essid TEXT
+);
+CREATE INDEX IF NOT EXISTS profiles_bssid ON profiles (bssid);
+CREATE INDEX IF NOT EXISTS profiles_essid ON profiles (essid);
+CREATE TABLE IF NOT EXISTS options (
+    section TEXT NOT NULL REFERENCES profiles (section),
+    option TEXT NOT NULL,
+    value TEXT,
+    PRIMARY KEY (section, option)
+);
+"""
+
+def _locked(f):
+    """ A decorator that holds the lock of the store while f runs. """
+    def wrapper(self, *args, **kwargs):
+        self._lock.acquire()
+        try:
+            return f(self, *args, **kwargs)
+        finally:
+            self._lock.release()
+
+    wrapper.__name__ = f.__name__
+    wrapper.__dict__ = f.__dict__
+    wrapper.__doc__ = f.__doc__
+    wrapper.__module__ = f.__module__
+    return wrapper
+
+
+class SQLiteProfileStore(ConfigValues):
+    """ Wireless profiles stored in an SQLite database.
+
+    Values are stored as they would be written to a config file, so
+    they read back with the same types as from ConfigManager, and
+    profiles can be moved between the two without changes.
+
+    Every change is committed right away, except inside a batch()
+    block, which is committed as a whole when it ends.
+
+    The store can be used from any thread; the connection is shared
+    and only used by one thread at a time.  A batch() block keeps
+    the other threads out until it ends.
+
+    """
+    def __init__(self, path, debug=False, mark_whitespace="`'`"):
+        """ Opens the database at 'path', creating it if needed. """
+        self.config_file = path
+        self.debug = debug
+        self.mrk_ws = mark_whitespace
+        self.generation = 0
+        self._batch_depth = 0
+        # Values of the sections converted to their type.
+        self._typed = {}
+        # Scans read profiles on the daemon's worker threads.
+        self._lock = RLock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.text_factory = str
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+
+    def __repr__(self):
+        return self.config_file
+
+    def __str__(self):
+        return self.config_file
+
+    def get_config(self):
+        """ Returns the path to the database. """
+        return self.config_file
+
+    def _changed(self, section=None):
+        """ Commits a change, unless in a batch() block. """
+        if section is None:
+            self._typed = {}
+        else:
+            self._typed.pop(section, None)
+        self.generation += 1
+        if not self._batch_depth:
+            self.db.commit()
+
+    def _update_keys(self, section):
+        """ Updates the indexed columns of a section from its options. """
+        row = dict(self.db.execute(
+            "SELECT option, value FROM options WHERE section = ? "
+            "AND option IN ('bssid', 'essid')", (section,)).fetchall())
+        self.db.execute("UPDATE profiles SET bssid = ?, essid = ? "
+                        "WHERE section = ?",
+                        (row.get('bssid'), row.get('essid'), section))
+
+    @_locked
+    def sections(self):
+        """ Returns the names of all the sections. """
+        return [row[0] for row in
+                self.db.execute("SELECT section FROM profiles "
+                                "ORDER BY section")]
+
+    @_locked
+    def has_section(self, section):
+        """ Returns True if the section exists. """
+        return self.db.execute("SELECT 1 FROM profiles WHERE section = ?",
+                               (section,)).fetchone() is not None
+
+    @_locked
+    def has_option(self, section, option):
+        """ Returns True if the section has the option. """
+        return self.db.execute(
+            "SELECT 1 FROM options WHERE section = ? AND option = ?",
+            (section, option.lower())).fetchone() is not None
+
+    @_locked
+    def add_section(self, section):
+        """ Adds an empty section. """
+        self.db.execute("INSERT INTO profiles (section) VALUES (?)",
+                        (section,))
+        self._changed(section)
+
+    @_locked
+    def remove_section(self, section):
+        """ Removes a section, if it exists. """
+        if not self.has_section(section):
+            return
+        self.db.execute("DELETE FROM options WHERE section = ?", (section,))
+        self.db.execute("DELETE FROM profiles WHERE section = ?", (section,))
+        self._changed(section)
+
+    @_locked
+    def items(self, section):
+        """ Returns the raw (option, value) pairs of a section. """
+        return self.db.execute("SELECT option, value FROM options "
+                               "WHERE section = ? ORDER BY option",
+                               (section,)).fetchall()
+
+    def options(self, section):
+        """ Returns the options of a section. """
+        return [option for option, value in self.items(section)]
+
+    def _get_typed_section(self, section):
+        """ Returns the converted values of a section, from the cache. """
+        typed = self._typed.get(section)
+        if typed is None:
+            typed = dict([(option, self._type_value(self._unmark_value(value)))
+                          for option, value in self.items(section)])
+            self._typed[section] = typed
+        return typed
+
+    @_locked
+    def get_section(self, section):
+        """ Returns all the options of a section as a dict, or None if
+        the section doesn't exist. """
+        # Only sections that exist are cached.
+        if section not in self._typed and not self.has_section(section):
+            return None
+        return dict(self._get_typed_section(section))
+
+    @_locked
+    def get_option(self, section, option, default="__None__"):
+        """ Returns the value of an option.
+
+        If the option is missing and a default is given, the default
+        is saved and returned, like ConfigManager.get_option does.
+
+        """
+        typed = self.get_section(section) or {}
+        key = option.lower()
+        if key in typed:
+            return typed[key]
+        if default == "__None__":
+            return None
+        print 'did not find %s in configuration, setting default %s' \
+            % (option, str(default))
+        self.set_option(section, option, str(default))
+        return self._type_value(default)
+
+    def get(self, *args, **kargs):
+        """ Calls the get_option method. """
+        return self.get_option(*args, **kargs)
+
+    @_locked
+    def set_option(self, section, option, value, write=False):
+        """ Sets an option, adding the section if needed.
+
+        The change is committed right away, so 'write' is only
+        accepted for compatibility with ConfigManager.
+
+        """
+        if not self.has_section(section):
+            self.db.execute("INSERT INTO profiles (section) VALUES (?)",
+                            (section,))
+        value = self._as_written({'': self._mark_value(value)})['']
+        self.db.execute("INSERT OR REPLACE INTO options "
+                        "(section, option, value) VALUES (?, ?, ?)",
+                        (section, str(option).lower(), value))
+        if option.lower() in ('bssid', 'essid'):
+            self._update_keys(section)
+        self._changed(section)
+
+    def set(self, *args, **kargs):
+        """ Calls the set_option method. """
+        self.set_option(*args, **kargs)
+
+    @_locked
+    def remove_option(self, section, option):
+        """ Removes an option.  Returns True if it existed. """
+        cursor = self.db.execute("DELETE FROM options WHERE section = ? "
+                                 "AND option = ?", (section, option.lower()))
+        if option.lower() in ('bssid', 'essid'):
+            self._update_keys(section)
+        self._changed(section)
+        return cursor.rowcount > 0
+
+    @_locked
+    def set_section(self, section, options):
+        """ Replaces all the options of a section in one transaction.
+
+        Returns:
+        True if the section changed, False if it already held the
+        same values.
+
+        """
+        values = self._as_written(dict(
+            [(str(option).lower(), self._mark_value(value))
+             for option, value in options.iteritems()]))
+        if self.has_section(section):
+            current = dict(self.items(section))
+            if '_filename_' in current:
+                values['_filename_'] = current['_filename_']
+            if current == values:
+                return False
+        else:
+            self.db.execute("INSERT INTO profiles (section) VALUES (?)",
+                            (section,))
+        self.db.execute("DELETE FROM options WHERE section = ?", (section,))
+        self.db.executemany("INSERT INTO options (section, option, value) "
+                            "VALUES (?, ?, ?)",
+                            [(section, option, value)
+                             for option, value in values.iteritems()])
+        self._update_keys(section)
+        self._changed(section)
+        return True
+
+    @_locked
+    def get_profile(self, essid, bssid):
+        """ Returns the saved profile to use for a network.
+
+        The same as ProfileIndex.get_profile, but only the profiles
+        of the network are read.
+
+        """
+        essid_key = "essid:%s" % essid
+        profile = self.get_section(essid_key)
+        if profile and profile.get('use_settings_globally'):
+            return (essid_key, profile)
+        profile = self.get_section(bssid)
+        if profile is not None:
+            return (bssid, profile)
+        return (None, None)
+
+    @_locked
+    def find_sections(self, bssid=None, essid=None):
+        """ Returns the sections saved for a BSSID or an ESSID. """
+        if bssid is not None:
+            query, arg = "SELECT section FROM profiles WHERE bssid = ?", bssid
+        else:
+            query, arg = "SELECT section FROM profiles WHERE essid = ?", essid
+        return sorted([row[0] for row in self.db.execute(query, (arg,))])
+
+    @contextmanager
+    def batch(self):
+        """ Commits all the changes made in the block at once. """
+        self._lock.acquire()
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                self.db.commit()
+            self._lock.release()
+
+    @_locked
+    def write(self):
+        """ Commits the pending changes, if not in a batch() block. """
+        if not self._batch_depth:
+            self.db.commit()
+
+    @_locked
+    def flush(self):
+        """ Commits the pending changes. """
+        self.db.commit()
+
+    @_locked
+    def reload(self):
+        """ Drops the cached values, in case the database was changed
+        by another program. """
+        self._changed()
+
+    @_locked
+    def import_config(self, path):
+        """ Imports the profiles of a config file.
+
+        The sections of the files in the '.d' directory of the config
+        file are imported as well, and remember which file they came
+        from, like ConfigManager does.  Profiles already in the store
+        are replaced.
+
+        """
+        config = ConfigManager(path, self.debug, self.mrk_ws)
+        with self.batch():
+            for section in config.sections():
+                self.remove_section(section)
+                self.db.execute("INSERT INTO profiles (section) VALUES (?)",
+                                (section,))
+                self.db.executemany(
+                    "INSERT INTO options (section, option, value) "
+                    "VALUES (?, ?, ?)",
+                    [(section, option, self._as_written({'': value})[''])
+                     for option, value in config.items(section)])
+                self._update_keys(section)
+            self._changed()
+
+    @_locked
+    def export_config(self, path):
+        """ Writes the profiles to a config file.
+
+        Sections imported from a '.d' directory are written back to
+        the file they came from.
+
+        """
+        config = ConfigManager("", self.debug, self.mrk_ws)
+        config.config_file = path
+        for section in self.sections():
+            config.add_section(section)
+            for option, value in self.items(section):
+                config.set(section, option, value)
+        config.write()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+
+""" scanstore -- Indexed results of the last wireless scan.
+
+The daemon used to keep the last scan in a plain list, so the only
+way to refer to a network was its position in the list, which changes
+with every scan.  ScanStore keeps that list, so network ids still work,
+and indexes it by BSSID and ESSID.  Every network also gets a handle,
+which stays the same as long as the network is found by consecutive
+scans, and is never given to another network.
+
+ProfileIndex keeps the saved wireless profiles parsed, so they can be
+merged into a scan without going through the configuration file for
+every option of every network.
+
+"""
+
+#
+#   Copyright (C) 2008-2009 Adam Blackburn
+#   Copyright (C) 2008-2009 Dan O'Reilly
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License Version 2 as
+#   published by the Free Software Foundation.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# Never a valid handle, returned when a network isn't found.
+NO_HANDLE = 0
+
+
+class ScanStore(object):
+    """ The networks found by the last wireless scan.
+
+    The store can be used like the list of networks it replaces:
+    store[networkid], len(store) and iterating over it work the same.
+
+    """
+    def __init__(self):
+        """ Initialise an empty store. """
+        self.networks = []
+        self._by_bssid = {}
+        self._ids = {}
+        self._handles = {}
+        self._networks_by_handle = {}
+        self._by_essid = None
+        self._next_handle = 1
+
+    def __len__(self):
+        return len(self.networks)
+
+    def __getitem__(self, networkid):
+        return self.networks[networkid]
+
+    def __iter__(self):
+        return iter(self.networks)
+
+    def update(self, scan):
+        """ Replace the networks with the results of a new scan.
+
+        Networks that were in the previous scan keep their handle,
+        the others get a new one.
+
+        Keyword arguments:
+        scan -- list of network dicts, in network id order
+
+        """
+        handles = {}
+        networks_by_handle = {}
+        by_bssid = {}
+        ids = {}
+        for networkid, network in enumerate(scan):
+            bssid = network.get('bssid')
+            handle = self._handles.get(bssid)
+            if handle is None:
+                handle = self._next_handle
+                self._next_handle += 1
+            handles[bssid] = handle
+            networks_by_handle[handle] = network
+            by_bssid[bssid] = network
+            ids[bssid] = networkid
+        self.networks = scan
+        self._handles = handles
+        self._networks_by_handle = networks_by_handle
+        self._by_bssid = by_bssid
+        self._ids = ids
+        self._by_essid = None
+
+    def set_property(self, network, prop, value):
+        """ Set a property of a network, keeping the indexes up to date. """
+        network[prop] = value
+        if prop == 'essid':
+            self._by_essid = None
+
+    def by_bssid(self, bssid):
+        """ Returns the network with the given BSSID, or None. """
+        return self._by_bssid.get(bssid)
+
+    def by_essid(self, essid):
+        """ Returns the networks with the given ESSID, in network id order.
+        """
+        if self._by_essid is None:
+            by_essid = {}
+            for network in self.networks:
+                by_essid.setdefault(network.get('essid'), []).append(network)
+            self._by_essid = by_essid
+        return self._by_essid.get(essid, [])
+
+    def by_handle(self, handle):
+        """ Returns the network with the given handle, or None. """
+        return self._networks_by_handle.get(handle)
+
+    def get_handle(self, network):
+        """ Returns the handle of a network of the store. """
+        return self._handles.get(network.get('bssid'), NO_HANDLE)
+
+    def get_id(self, network):
+        """ Returns the network id of a network, or -1 if it isn't found. """
+        return self._ids.get(network.get('bssid'), -1)
+
+    def handles(self):
+        """ Returns the handles of all the networks, in network id order. """
+        return [self._handles[network.get('bssid')]
+                for network in self.networks]
+
+
+class ProfileIndex(object):
+    """ The saved wireless profiles, indexed by BSSID and ESSID.
+
+    The profiles are parsed from the configuration the first time
+    they're needed, and again only after the configuration changed.
+    Stores that can look profiles up themselves, like
+    SQLiteProfileStore, are asked directly instead.
+
+    """
+    def __init__(self, config):
+        """ Initialise the index.
+
+        Keyword arguments:
+        config -- the ConfigManager of the wireless profiles
+
+        """
+        self.config = config
+        self._sections = {}
+        self._generation = None
+
+    def _update(self):
+        """ Parses the profiles again if the configuration changed. """
+        if self._generation == self.config.generation:
+            return
+        sections = {}
+        for section in self.config.sections():
+            sections[section] = self.config.get_section(section)
+        self._sections = sections
+        self._generation = self.config.generation
+
+    def get_profile(self, essid, bssid):
+        """ Returns the saved profile to use for a network.
+
+        The global profile of the ESSID is used if it has
+        use_settings_globally set, else the profile of the BSSID.
+
+        Returns:
+        A tuple (section, profile), where profile is a dict of the
+        parsed options, or (None, None) if there's no profile.
+
+        """
+        if hasattr(self.config, 'get_profile'):
+            return self.config.get_profile(essid, bssid)
+        self._update()
+        essid_key = "essid:%s" % essid
+        profile = self._sections.get(essid_key)
+        if profile and profile.get('use_settings_globally'):
+            return (essid_key, profile)
+        profile = self._sections.get(bssid)
+        if profile is not None:
+            return (bssid, profile)
+        return (None, None)
@@ -33,10 +33,11 @@ class WirelessDaemon() -- DBus interface to managed the wireless network.
 #   along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+from __future__ import with_statement
+
 import os
 import shutil
 import sys
-import time
 import getopt
 import signal
 import atexit
@@ -60,7 +61,8 @@ from wicd import misc
 from wicd import wnettools
 from wicd.misc import noneToBlankString, _status_dict
 from wicd.logfile import ManagedStdio
-from wicd.configmanager import ConfigManager
+from wicd.configmanager import ConfigManager, WriteBehind
+from wicd.scanstore import ScanStore, ProfileIndex, NO_HANDLE
 
 if __name__ == '__main__':
     wpath.chdir(__file__)
@@ -68,9 +70,36 @@ if __name__ == '__main__':
 misc.RenameProcess("wicd")
 
 wireless_conf = os.path.join(wpath.etc, "wireless-settings.conf")
+wireless_db = os.path.join(wpath.etc, "wireless-settings.db")
 wired_conf = os.path.join(wpath.etc, "wired-settings.conf")
 dhclient_conf = os.path.join(wpath.etc, "dhclient.conf.template")
 
+# How many slow backend calls (scans, autoconnects, link checks) may
+# run at once, off the main loop.
+BACKEND_THREADS = 3
+
+# The keyword arguments async D-Bus methods get their replies sent with.
+ASYNC_CALLBACKS = ('reply_handler', 'error_handler')
+
+def encryption_methods(wired=False):
+    """ Returns the active encryption methods, ready to send over D-Bus.
+
+    The field lists are typed explicitly, as dbus-python can't guess
+    the type of an empty list.
+
+    """
+    methods = []
+    for method in misc.LoadEncryptionMethods(wired):
+        info = {}
+        for key, value in method.iteritems():
+            if isinstance(value, list):
+                value = dbus.Array([dbus.Array(field, signature='s')
+                                    for field in value], signature='as')
+            info[key] = value
+        methods.append(info)
+    return methods
+
+
 class WicdDaemon(dbus.service.Object, object):
     """ The main wicd daemon class.
 
@@ -87,6 +116,11 @@ class WicdDaemon(dbus.service.Object, object):
         self.config = ConfigManager(os.path.join(wpath.etc,
                                                  "manager-settings.conf"))
         self._debug_mode = bool(self.config.get("Settings", "debug_mode"))
+        # Slow backend calls run here, so they don't hold up the
+        # clients asking for the state the daemon keeps.
+        self.pool = misc.WorkerPool(BACKEND_THREADS)
+        # Set while an autoconnect is waiting for a probe or a scan.
+        self._autoconnect_pending = False
         self.wifi = networking.Wireless(debug=self._debug_mode)
         self.wired = networking.Wired(debug=self._debug_mode)
         self.wired_bus = WiredDaemon(bus_name, self, wired=self.wired)
@@ -128,14 +162,15 @@ class WicdDaemon(dbus.service.Object, object):
         # Load the config file
         self.ReadConfig()
 
-        signal.signal(signal.SIGTERM, self.DaemonClosing)
+        signal.signal(signal.SIGTERM, self._handle_sigterm)
         self.DaemonStarting()
 
         # Scan since we just got started
         if not auto_connect:
             print "--no-autoconnect detected, not autoconnecting..."
             self.SetForcedDisconnect(True)
-        self.wireless_bus.Scan()
+        if self.wireless_bus._begin_scan():
+            self.wireless_bus._async_scan()
 
     def get_debug_mode(self):
         """ Getter for debug_mode property. """
@@ -158,12 +193,42 @@ class WicdDaemon(dbus.service.Object, object):
         """
         return wpath.version
 
+    @dbus.service.method('org.wicd.daemon', out_signature='aua{sa{sv}}')
+    def GetCommandStats(self):
+        """ Returns statistics about the external commands run.
+
+        Returns:
+        The upper bounds in milliseconds of the buckets of the time
+        histograms, and a dict mapping every executable to a dict
+        with the number of calls, failures and untimed calls, the
+        total and maximum time in milliseconds, the size of the
+        output and the histogram of the time of the calls.
+
+        """
+        return (misc.CommandStats.BUCKETS, misc.command_stats.get())
+
+    @dbus.service.method('org.wicd.daemon')
+    def ResetCommandStats(self):
+        """ Forgets the statistics about the external commands run. """
+        misc.command_stats.reset()
+
+    @dbus.service.method('org.wicd.daemon', out_signature='aa{sv}')
+    def GetConnectTraces(self):
+        """ Returns the timed phases of the last connection attempts.
+
+        See ConnectThread.get_trace for the contents of the traces,
+        which are returned oldest first.
+
+        """
+        return networking.connect_traces.get()
+
     @dbus.service.method('org.wicd.daemon')
     def SetWiredInterface(self, interface):
         """ Sets the wired interface for the daemon to use. """
         print "setting wired interface %s" % (str(interface))
         self.wired.wired_interface = noneToBlankString(interface)
         self.config.set("Settings", "wired_interface", interface, write=True)
+        self.InterfacesChanged()
 
     @dbus.service.method('org.wicd.daemon')
     def SetWirelessInterface(self, interface):
@@ -171,6 +236,7 @@ class WicdDaemon(dbus.service.Object, object):
         print "setting wireless interface %s" % (str(interface))
         self.wifi.wireless_interface = noneToBlankString(interface)
         self.config.set("Settings", "wireless_interface", interface, write=True)
+        self.InterfacesChanged()
 
     @dbus.service.method('org.wicd.daemon')
     def SetWPADriver(self, driver):
@@ -354,14 +420,22 @@ class WicdDaemon(dbus.service.Object, object):
         """ Returns True if the computer is in the suspend state. """
         return self.suspended
 
-    @dbus.service.method('org.wicd.daemon')
-    def AutoConnect(self, fresh):
+    @dbus.service.method('org.wicd.daemon', async_callbacks=ASYNC_CALLBACKS)
+    def AutoConnect(self, fresh, reply_handler, error_handler):
         """ Attempts to autoconnect to a wired or wireless network.
 
         Autoconnect will first try to connect to a wired network, if that 
-        fails it tries a wireless connection.
+        fails it tries a wireless connection.  Only the link check and
+        the scan run on the worker pool; the network is picked and
+        connected to on the main loop.  The reply is sent once the
+        attempt is started.
 
         """
+        self._autoconnect(fresh)
+        reply_handler()
+
+    def _autoconnect(self, fresh):
+        """ Attempts to autoconnect.  See AutoConnect. """
         print "Autoconnecting..."
         if self.CheckIfConnecting():
             if self.debug_mode:
@@ -372,7 +446,20 @@ class WicdDaemon(dbus.service.Object, object):
             if self.debug_mode:
                 print "Skipping autoconnect because GUI is open."
             return
-        if self.wired_bus.CheckPluggedIn():
+        # Two attempts at once would both pick a network to connect to.
+        if self._autoconnect_pending:
+            if self.debug_mode:
+                print 'Already autoconnecting, doing nothing.'
+            return
+        self._autoconnect_pending = True
+        self.pool.run(self.wired_bus._check_plugged_in, (),
+                      lambda plugged_in=None:
+                          self._autoconnect_plugged_in(plugged_in, fresh),
+                      self._autoconnect_failed)
+
+    def _autoconnect_plugged_in(self, plugged_in, fresh):
+        """ Continues an autoconnect once the link was checked. """
+        if plugged_in:
             if self.debug_mode:
                 print "Starting wired autoconnect..."
             self._wired_autoconnect(fresh)
@@ -381,6 +468,16 @@ class WicdDaemon(dbus.service.Object, object):
                 print "Starting wireless autoconnect..."
             self.wireless_bus._wireless_autoconnect(fresh)
 
+    def _end_autoconnect(self):
+        """ Lets the next autoconnect go ahead. """
+        self._autoconnect_pending = False
+        return False
+
+    def _autoconnect_failed(self, error):
+        """ Ends an autoconnect the worker pool failed on. """
+        print 'Autoconnect failed: %s' % error
+        self._autoconnect_pending = False
+
     @dbus.service.method('org.wicd.daemon')
     def GetAutoReconnect(self):
         """ Returns the value of self.auto_reconnect. See SetAutoReconnect. """
@@ -564,6 +661,25 @@ class WicdDaemon(dbus.service.Object, object):
         """ Returns current value for WAP connection verification. """
         return bool(self.wifi.should_verify_ap)
 
+    @dbus.service.method('org.wicd.daemon')
+    def SetPersistentWpaSupplicant(self, value):
+        """ Enable/disable keeping wpa_supplicant running.
+
+        If this is True, wicd keeps one wpa_supplicant running for the
+        wireless interface, and switches it between networks through
+        its control interface instead of restarting it every time a
+        wireless connection is made.
+
+        """
+        self.config.set("Settings", "persistent_wpa_supplicant", int(value),
+                        write=True)
+        self.wifi.persistent_wpa = misc.to_bool(value)
+
+    @dbus.service.method('org.wicd.daemon')
+    def GetPersistentWpaSupplicant(self):
+        """ Returns whether wpa_supplicant is kept running. """
+        return bool(self.wifi.persistent_wpa)
+
     @dbus.service.method('org.wicd.daemon')
     def GetWiredAutoConnectMethod(self):
         """ Returns the wired autoconnect method. """
@@ -638,6 +754,83 @@ class WicdDaemon(dbus.service.Object, object):
         """
         return [self.connection_state, self.connection_info]
 
+    @dbus.service.method('org.wicd.daemon', out_signature='a{sv}')
+    def GetLinkSnapshot(self):
+        """ Returns everything the monitor needs to know in one call.
+
+        The state is gathered in a single pass, in the same order the
+        monitor checks it, and stops as soon as the remaining values
+        can't matter (e.g. no wireless details are fetched while a
+        wired connection is active).  iwconfig is run at most once.
+
+        Returns:
+        A dict which always contains 'suspended', 'forced_disconnect',
+        'prefer_wired', 'auto_reconnect', 'gui_open',
+        'signal_display_type', 'wired_interface' and
+        'wireless_interface'.  Depending on the state it can also
+        contain 'connecting', 'wired_connecting', 'wired_ip',
+        'plugged_in', 'wireless_ip', 'bssid', 'essid', 'signal',
+        'network_id' and 'bitrate'.  'signal' is in the unit selected
+        by the signal display type.
+
+        """
+        snapshot = {'suspended' : bool(self.suspended),
+                    'forced_disconnect' : bool(self.forced_disconnect),
+                    'prefer_wired' : bool(self.prefer_wired),
+                    'auto_reconnect' : bool(self.auto_reconnect),
+                    'gui_open' : bool(self.gui_open),
+                    'signal_display_type' : int(self.signal_display_type),
+                    'wired_interface' : str(self.wired.wired_interface),
+                    'wireless_interface' : str(self.wifi.wireless_interface),
+                   }
+        if self.suspended:
+            return snapshot
+
+        wired_connecting = bool(self.wired_bus.CheckIfWiredConnecting())
+        wireless_connecting = bool(self.wireless_bus.CheckIfWirelessConnecting())
+        snapshot['wired_connecting'] = wired_connecting
+        snapshot['connecting'] = wired_connecting or wireless_connecting
+        if wireless_connecting:
+            snapshot['essid'] = \
+                misc.noneToBlankString(self.wifi.GetCurrentNetwork())
+        if snapshot['connecting']:
+            return snapshot
+
+        wired_ip = misc.noneToBlankString(self.wired.GetIP(""))
+        snapshot['wired_ip'] = wired_ip
+        if wired_ip or (self.prefer_wired and not self.forced_disconnect):
+            plugged_in = bool(self.wired_bus._peek_plugged_in())
+            snapshot['plugged_in'] = plugged_in
+            if wired_ip and plugged_in:
+                return snapshot
+
+        wifi_ip = misc.noneToBlankString(self.wifi.GetIP(""))
+        snapshot['wireless_ip'] = wifi_ip
+        if not wifi_ip:
+            return snapshot
+
+        if self.NeedsExternalCalls():
+            iwconfig = self.wifi.GetIwconfig()
+        else:
+            iwconfig = ''
+        bssid = misc.noneToBlankString(self.wifi.GetBSSID(iwconfig))
+        snapshot['bssid'] = bssid
+        if not bssid:
+            return snapshot
+
+        snapshot['essid'] = \
+            misc.noneToBlankString(self.wifi.GetCurrentNetwork(iwconfig))
+        if self.signal_display_type == 0:
+            signal = self.wireless_bus.GetCurrentSignalStrength(iwconfig)
+        else:
+            signal = self.wireless_bus.GetCurrentDBMStrength(iwconfig)
+        snapshot['signal'] = int(signal)
+        snapshot['network_id'] = \
+            int(self.wireless_bus.GetCurrentNetworkID(iwconfig))
+        snapshot['bitrate'] = \
+            misc.noneToBlankString(self.wifi.GetCurrentBitrate(iwconfig))
+        return snapshot
+
     @dbus.service.method('org.wicd.daemon')
     def GetNeedWiredProfileChooser(self):
         """ Returns need_profile_chooser.
@@ -737,6 +930,7 @@ class WicdDaemon(dbus.service.Object, object):
         if self.GetWiredAutoConnectMethod() == 2 and \
            not self.GetNeedWiredProfileChooser():
             self.LaunchChooser()
+            self._autoconnect_pending = False
             return True
 
         # Default Profile.
@@ -761,13 +955,21 @@ class WicdDaemon(dbus.service.Object, object):
         wiredb.ConnectWired()
         print "Attempting to autoconnect with wired interface..."
         self.auto_connecting = True
-        time.sleep(1.5)
+        self._autoconnect_pending = False
+        # Give the connection 1.5 seconds to start before checking on
+        # it every 3 seconds.
+        gobject.timeout_add(1500, self._start_monitoring_wired_autoconnect,
+                            fresh)
+        return True
+
+    def _start_monitoring_wired_autoconnect(self, fresh):
+        """ Starts calling _monitor_wired_autoconnect on a timer. """
         try:
             gobject.timeout_add_seconds(3, self._monitor_wired_autoconnect, 
                                         fresh)
         except AttributeError:
             gobject.timeout_add(3000, self._monitor_wired_autoconnect, fresh)
-        return True
+        return False
 
     def _monitor_wired_autoconnect(self, fresh):
         """ Monitor a wired auto-connection attempt.
@@ -815,6 +1017,10 @@ class WicdDaemon(dbus.service.Object, object):
             self.ConnectResultsSent(wired_thread.connect_result)
             wired_thread.connect_result = ""
         elif wifi_thread and wifi_thread.connect_result:
+            if wifi_thread.connect_result == 'success':
+                # Keep the PSK generated while connecting, so it doesn't
+                # have to be generated again next time.
+                self.wireless_bus._save_network_profile(wifi_thread.network)
             self.ConnectResultsSent(wifi_thread.connect_result)
             wifi_thread.connect_result = ""
 
@@ -839,12 +1045,18 @@ class WicdDaemon(dbus.service.Object, object):
         """ Emits a signa indicating the daemon is starting. """
         pass
 
+    def _handle_sigterm(self, signum, frame):
+        """ Writes the profiles waiting to be saved, then exits. """
+        self.wireless_bus.config.flush()
+        sys.exit(0)
+
     @dbus.service.signal(dbus_interface='org.wicd.daemon', signature='')
     def DaemonClosing(self):
         """ Emits a signal indicating the daemon will be closing. """
         # By default, disconnect network links on close.
         if not self.keep_connection:
             self.Disconnect()
+        self.wireless_bus.config.flush()
 
     @dbus.service.method('org.wicd.daemon', in_signature='uav')
     def EmitStatusChanged(self, state, info):
@@ -866,6 +1078,11 @@ class WicdDaemon(dbus.service.Object, object):
         """ Emits a signal when the current backend changes. """
         pass
 
+    @dbus.service.signal(dbus_interface='org.wicd.daemon', signature='')
+    def InterfacesChanged(self):
+        """ Emits a signal when the wired or wireless interface changes. """
+        pass
+
     def ReadConfig(self):
         """ Reads the manager-settings.conf file.
 
@@ -876,57 +1093,72 @@ class WicdDaemon(dbus.service.Object, object):
         b_wired = self.wired_bus
         b_wifi = self.wireless_bus
         app_conf = self.config
-        # Load the backend.
-        be_def = 'external'
-        self.SetBackend(app_conf.get("Settings", "backend", default=be_def))
-
-        # Load network interfaces.
-        iface = self.wireless_bus.DetectWirelessInterface()
-        if not iface:
-            iface = 'wlan0'
-        self.SetWirelessInterface(app_conf.get("Settings", "wireless_interface",
-                                               default=iface))
-        iface = self.wired_bus.DetectWiredInterface()
-        if not iface:
-            iface = 'eth0'
-        self.SetWiredInterface(app_conf.get("Settings", "wired_interface",
-                                            default=iface))
-
-        self.SetWPADriver(app_conf.get("Settings", "wpa_driver",
-          default="wext"))
-        self.SetAlwaysShowWiredInterface(app_conf.get("Settings",
-                                                "always_show_wired_interface",
-                                                default=False))
-        self.SetUseGlobalDNS(app_conf.get("Settings", "use_global_dns",
-                                          default=False))
-        dns1 = app_conf.get("Settings", "global_dns_1", default='None')
-        dns2 = app_conf.get("Settings", "global_dns_2", default='None')
-        dns3 = app_conf.get("Settings", "global_dns_3", default='None')
-        dns_dom = app_conf.get("Settings", "global_dns_dom", default='None')
-        search_dom = app_conf.get("Settings", "global_search_dom",
-          default='None')
-        self.SetGlobalDNS(dns1, dns2, dns3, dns_dom, search_dom)
-        self.SetAutoReconnect(app_conf.get("Settings", "auto_reconnect",
-                                           default=True))
-        self.SetDebugMode(app_conf.get("Settings", "debug_mode", default=False))
-        self.SetWiredAutoConnectMethod(app_conf.get("Settings",
-                                                    "wired_connect_mode",
-                                                    default=1))
-        self.SetSignalDisplayType(app_conf.get("Settings", 
-                                               "signal_display_type",
-                                               default=0))
-        self.SetShouldVerifyAp(app_conf.get("Settings", "should_verify_ap",
-                                            default=1))
-        self.SetDHCPClient(app_conf.get("Settings", "dhcp_client", default=0))
-        self.SetLinkDetectionTool(app_conf.get("Settings", "link_detect_tool",
-                                               default=0))
-        self.SetFlushTool(app_conf.get("Settings", "flush_tool", default=0))
-        self.SetSudoApp(app_conf.get("Settings", "sudo_app", default=0))
-        self.SetPreferWiredNetwork(app_conf.get("Settings", "prefer_wired", 
-                                                default=False))
-        self.SetShowNeverConnect(app_conf.get("Settings", "show_never_connect", 
-                                                default=True))
-        app_conf.write()
+        # Defaults are written for every missing option, so only write
+        # the file once at the end.
+        with app_conf.batch():
+            # Load the backend.
+            be_def = 'external'
+            self.SetBackend(app_conf.get("Settings", "backend",
+                                         default=be_def))
+
+            # Load network interfaces.
+            iface = self.wireless_bus.DetectWirelessInterface()
+            if not iface:
+                iface = 'wlan0'
+            self.SetWirelessInterface(app_conf.get("Settings",
+                                                   "wireless_interface",
+                                                   default=iface))
+            iface = self.wired_bus.DetectWiredInterface()
+            if not iface:
+                iface = 'eth0'
+            self.SetWiredInterface(app_conf.get("Settings", "wired_interface",
+                                                default=iface))
+
+            self.SetWPADriver(app_conf.get("Settings", "wpa_driver",
+              default="wext"))
+            self.SetAlwaysShowWiredInterface(app_conf.get("Settings",
+                                            "always_show_wired_interface",
+                                            default=False))
+            self.SetUseGlobalDNS(app_conf.get("Settings", "use_global_dns",
+                                              default=False))
+            dns1 = app_conf.get("Settings", "global_dns_1", default='None')
+            dns2 = app_conf.get("Settings", "global_dns_2", default='None')
+            dns3 = app_conf.get("Settings", "global_dns_3", default='None')
+            dns_dom = app_conf.get("Settings", "global_dns_dom",
+                                   default='None')
+            search_dom = app_conf.get("Settings", "global_search_dom",
+              default='None')
+            self.SetGlobalDNS(dns1, dns2, dns3, dns_dom, search_dom)
+            self.SetAutoReconnect(app_conf.get("Settings", "auto_reconnect",
+                                               default=True))
+            self.SetDebugMode(app_conf.get("Settings", "debug_mode",
+                                           default=False))
+            self.SetWiredAutoConnectMethod(app_conf.get("Settings",
+                                                        "wired_connect_mode",
+                                                        default=1))
+            self.SetSignalDisplayType(app_conf.get("Settings", 
+                                                   "signal_display_type",
+                                                   default=0))
+            self.SetShouldVerifyAp(app_conf.get("Settings", "should_verify_ap",
+                                                default=1))
+            self.SetPersistentWpaSupplicant(app_conf.get("Settings",
+                                                "persistent_wpa_supplicant",
+                                                default=0))
+            self.SetDHCPClient(app_conf.get("Settings", "dhcp_client",
+                                            default=0))
+            self.SetLinkDetectionTool(app_conf.get("Settings",
+                                                   "link_detect_tool",
+                                                   default=0))
+            self.SetFlushTool(app_conf.get("Settings", "flush_tool",
+                                           default=0))
+            self.SetSudoApp(app_conf.get("Settings", "sudo_app", default=0))
+            self.SetPreferWiredNetwork(app_conf.get("Settings",
+                                                    "prefer_wired",
+                                                    default=False))
+            self.SetShowNeverConnect(app_conf.get("Settings",
+                                                  "show_never_connect",
+                                                  default=True))
+            app_conf.write()
 
         if os.path.isfile(wireless_conf):
             print "Wireless configuration file found..."
@@ -977,8 +1209,52 @@ class WirelessDaemon(dbus.service.Object, object):
         self.wifi = wifi
         self._debug_mode = debug
         self._scanning = False
-        self.LastScan = []
-        self.config = ConfigManager(wireless_conf, debug=debug)
+        self.LastScan = ScanStore()
+        self.config = self._open_profile_store(debug)
+        self.profiles = ProfileIndex(self.config)
+
+    def _open_profile_store(self, debug):
+        """ Opens the store the wireless profiles are kept in.
+
+        The profiles are kept in wireless-settings.conf, unless
+        profile_store is set to sqlite in manager-settings.conf.  The
+        database is filled from wireless-settings.conf when it's first
+        created.  When profile_store is switched back, the profiles are
+        written back to wireless-settings.conf and the database is
+        moved aside, so it's filled again if sqlite is chosen later.
+
+        """
+        if self.daemon.config.get("Settings", "profile_store") == "sqlite":
+            try:
+                from wicd.profilestore import SQLiteProfileStore
+            except ImportError, e:
+                print 'Could not use the SQLite profile store: %s' % e
+            else:
+                new = not os.path.exists(wireless_db)
+                store = SQLiteProfileStore(wireless_db, debug=debug)
+                os.chmod(wireless_db, 0600)
+                if new and os.path.exists(wireless_conf):
+                    print 'Importing wireless profiles from %s...' % \
+                          wireless_conf
+                    store.import_config(wireless_conf)
+                return store
+        elif os.path.exists(wireless_db):
+            self._export_profile_store()
+        # Profiles are saved on every connect, so write them from a
+        # thread instead of holding up the main loop.
+        return ConfigManager(wireless_conf, debug=debug, writer=WriteBehind())
+
+    def _export_profile_store(self):
+        """ Moves the profiles of the SQLite store back to the INI file. """
+        try:
+            from wicd.profilestore import SQLiteProfileStore
+        except ImportError, e:
+            print 'Could not export the SQLite profile store: %s' % e
+            return
+        print 'Exporting wireless profiles to %s...' % wireless_conf
+        SQLiteProfileStore(wireless_db).export_config(wireless_conf)
+        os.chmod(wireless_conf, 0600)
+        os.rename(wireless_db, wireless_db + '.old')
 
     def get_debug_mode(self):
         """ Getter for the debug_mode property. """
@@ -994,15 +1270,33 @@ class WirelessDaemon(dbus.service.Object, object):
         """ Sets the ESSID of a hidden network for use with Scan(). """
         self.hidden_essid = str(misc.Noneify(essid))
 
-    @dbus.service.method('org.wicd.daemon.wireless')
-    def Scan(self, sync=False):
+    @dbus.service.method('org.wicd.daemon.wireless',
+                         async_callbacks=ASYNC_CALLBACKS)
+    def Scan(self, sync=False, reply_handler=None, error_handler=None):
         """ Scan for wireless networks.
 
         Scans for wireless networks, optionally using a (hidden) essid
         set with SetHiddenNetworkESSID.
 
-        The sync keyword argument specifies whether the scan should
-        be done synchronously.
+        The sync keyword argument specifies whether the reply should
+        only be sent once the scan is done.  Either way, the scan runs
+        on the worker pool.
+
+        """
+        if not self._begin_scan():
+            reply_handler(False)
+        elif sync:
+            self.daemon.pool.run(self._sync_scan, (),
+                                 lambda: reply_handler(True), error_handler)
+        else:
+            self._async_scan()
+            reply_handler(True)
+
+    def _begin_scan(self):
+        """ Announces a scan, unless one is already in progress.
+
+        Returns:
+        True if the scan should go ahead, False otherwise.
 
         """
         if self._scanning:
@@ -1012,27 +1306,46 @@ class WirelessDaemon(dbus.service.Object, object):
         if self.debug_mode:
             print 'scanning start'
         self.SendStartScanSignal()
-        if sync:
-            self._sync_scan()
-        else:
-            self._async_scan()
         return True
 
-    @misc.threaded
     def _async_scan(self):
-        """ Run a scan in its own thread. """
-        self._sync_scan()
+        """ Run a scan on the worker pool. """
+        self.daemon.pool.run(self._sync_scan)
 
     def _sync_scan(self):
         """ Run a scan and send a signal when its finished. """
-        scan = self.wifi.Scan(str(self.hidden_essid))
-        self.LastScan = scan
-        if self.debug_mode:
-            print 'scanning done'
-            print 'found ' + str(len(scan)) + ' networks:'
-        for i, network in enumerate(scan):
-            self.ReadWirelessNetworkProfile(i)
-        self.SendEndScanSignal()
+        try:
+            scan = self.wifi.Scan(str(self.hidden_essid))
+            previous = self.LastScan.networks
+            self.LastScan.update(scan)
+            if self.debug_mode:
+                print 'scanning done'
+                print 'found ' + str(len(scan)) + ' networks:'
+            for network in scan:
+                self._read_network_profile(network)
+            self._send_scan_delta(previous, scan)
+        finally:
+            # Without the signal, no scan would be started again.
+            self.SendEndScanSignal()
+
+    def _send_scan_delta(self, previous, scan):
+        """ Emits the ScanDelta signal for two consecutive scans. """
+        added, removed, changed = misc.diff_scans(previous, scan)
+        changed_fields = {}
+        for bssid, fields in changed.iteritems():
+            # Clients need to know about properties that are gone too,
+            # but None can't be sent over D-Bus.
+            for prop, value in fields.iteritems():
+                if value is None:
+                    fields[prop] = ''
+            changed_fields[str(bssid)] = self._network_to_dbus(fields)
+        self.ScanDelta(
+            [self._network_to_dbus(network, with_handle=True)
+             for network in added],
+            [str(bssid) for bssid in removed],
+            dbus.Dictionary(changed_fields, signature='sa{sv}'),
+            [str(network.get('bssid')) for network in scan]
+        )
 
     @dbus.service.method('org.wicd.daemon.wireless')
     def GetIwconfig(self):
@@ -1102,6 +1415,17 @@ class WirelessDaemon(dbus.service.Object, object):
         """ Returns true if rfkill switch is enabled. """
         return self.wifi.GetRfKillStatus()
 
+    @dbus.service.method('org.wicd.daemon.wireless', out_signature='aa{sv}')
+    def GetEncryptionMethods(self):
+        """ Returns the encryption methods for wireless networks.
+
+        These are the active encryption templates, in the format of
+        misc.LoadEncryptionMethods.  Templates are only parsed again
+        when they change.
+
+        """
+        return encryption_methods()
+
     @dbus.service.method('org.wicd.daemon.wireless')
     def GetWirelessProperty(self, networkid, prop):
         """ Retrieves wireless property from the network specified """
@@ -1112,9 +1436,106 @@ class WirelessDaemon(dbus.service.Object, object):
         value = misc.to_unicode(value)
         return value
 
+    @dbus.service.method('org.wicd.daemon.wireless', out_signature='au')
+    def GetScanHandles(self):
+        """ Returns the handles of the networks, in network id order.
+
+        Unlike network ids, the handle of a network stays the same
+        across scans for as long as the network is found, and is never
+        reused for another network.
+
+        """
+        return self.LastScan.handles()
+
+    @dbus.service.method('org.wicd.daemon.wireless', out_signature='u')
+    def GetNetworkHandle(self, networkid):
+        """ Returns the handle of a network, or 0 if it isn't found. """
+        try:
+            return self.LastScan.get_handle(self.LastScan[networkid])
+        except IndexError:
+            return NO_HANDLE
+
+    @dbus.service.method('org.wicd.daemon.wireless', in_signature='u',
+                         out_signature='i')
+    def GetNetworkIDByHandle(self, handle):
+        """ Returns the network id of a handle, or -1 if it is gone. """
+        network = self.LastScan.by_handle(handle)
+        if network is None:
+            return -1
+        return self.LastScan.get_id(network)
+
+    @dbus.service.method('org.wicd.daemon.wireless', in_signature='us')
+    def GetWirelessPropertyByHandle(self, handle, prop):
+        """ Retrieves a property of the network with the given handle. """
+        network = self.LastScan.by_handle(handle)
+        if network is None:
+            return ""
+        return misc.to_unicode(network.get(prop))
+
+    @dbus.service.method('org.wicd.daemon.wireless', in_signature='as',
+                         out_signature='aa{sv}')
+    def GetScanResults(self, props):
+        """ Returns the properties of every network in the last scan.
+
+        This allows clients to fetch the whole scan in one D-Bus round
+        trip, instead of calling GetWirelessProperty for every property
+        of every network.  The position of a network in the returned
+        list is its network id.
+
+        Keyword arguments:
+        props -- list of the properties to return for each network.  If
+                 empty, all the known properties are returned.
+
+        """
+        return [self._network_to_dbus(network, props, 'handle' in props)
+                for network in self.LastScan]
+
+    def _network_to_dbus(self, network, props=None, with_handle=False):
+        """ Converts a LastScan entry into a D-Bus friendly dict.
+
+        Properties whose value is None are left out, so clients
+        should use .get() to read them, which gives the same result
+        GetWirelessProperty would.  If with_handle is True, the handle
+        of the network is added as the 'handle' property.
+
+        """
+        if not props:
+            props = network.keys()
+        ret = {}
+        if with_handle:
+            ret['handle'] = dbus.UInt32(self.LastScan.get_handle(network))
+        for prop in props:
+            if prop == 'handle':
+                continue
+            value = network.get(prop)
+            if value is None:
+                continue
+            if isinstance(value, list):
+                value = dbus.Array([str(v) for v in value], signature='s')
+            else:
+                value = misc.to_unicode(value)
+            ret[str(prop)] = value
+        return dbus.Dictionary(ret, signature='sv')
+
     @dbus.service.method('org.wicd.daemon.wireless')
     def SetWirelessProperty(self, netid, prop, value):
         """ Sets property to value in network specified. """
+        return self._set_network_property(self.LastScan[netid], prop, value)
+
+    @dbus.service.method('org.wicd.daemon.wireless', in_signature='usv')
+    def SetWirelessPropertyByHandle(self, handle, prop, value):
+        """ Sets a property of the network with the given handle.
+
+        Returns False if the network is gone.
+
+        """
+        network = self.LastScan.by_handle(handle)
+        if network is None:
+            return False
+        return self._set_network_property(network, prop, value) is None
+
+    def _set_network_property(self, network, prop, value):
+        """ Sets property to value in the given network. """
         # We don't write script settings here.
         prop = misc.sanitize_config(prop)
         if prop.endswith('script'):
@@ -1123,10 +1544,10 @@ class WirelessDaemon(dbus.service.Object, object):
             return False
         # whitelist some props that need different handling
         if prop in ('key_index', ):
-            self.LastScan[netid][prop] = \
-                misc.to_unicode(misc.Noneify(value, False))
+            value = misc.to_unicode(misc.Noneify(value, False))
         else:
-            self.LastScan[netid][prop] = misc.to_unicode(misc.Noneify(value))
+            value = misc.to_unicode(misc.Noneify(value))
+        self.LastScan.set_property(network, prop, value)
 
     @dbus.service.method('org.wicd.daemon.wireless')
     def DetectWirelessInterface(self):
@@ -1177,9 +1598,9 @@ class WirelessDaemon(dbus.service.Object, object):
     def GetCurrentNetworkID(self, iwconfig=None):
         """ Returns the id of the current network, or -1 if its not found. """
         currentESSID = self.GetCurrentNetwork(iwconfig)
-        for x in xrange(0, len(self.LastScan)):
-            if self.LastScan[x]['essid'] == currentESSID:
-                return x
+        networks = self.LastScan.by_essid(currentESSID)
+        if networks:
+            return self.LastScan.get_id(networks[0])
         if self.debug_mode:
             print 'GetCurrentNetworkID: Returning -1, current network not found'
         return -1
@@ -1199,26 +1620,43 @@ class WirelessDaemon(dbus.service.Object, object):
     @dbus.service.method('org.wicd.daemon.wireless')
     def ConnectWireless(self, nid):
         """ Connects the the wireless network specified by i"""
-        self.SaveWirelessNetworkProfile(nid)
+        self._connect_network(self.LastScan[nid])
+
+    @dbus.service.method('org.wicd.daemon.wireless', in_signature='u')
+    def ConnectWirelessByHandle(self, handle):
+        """ Connects to the wireless network with the given handle.
+
+        Returns False if the network is gone, which can't happen to
+        the wrong network like with ConnectWireless when a scan
+        finishes in between.
+
+        """
+        network = self.LastScan.by_handle(handle)
+        if network is None:
+            print 'Not connecting, network %d is no longer available' % handle
+            return False
+        self._connect_network(network)
+        return True
+
+    def _connect_network(self, network):
+        """ Connects to a network of the last scan. """
+        self._save_network_profile(network)
         # Will returned instantly, that way we don't hold up dbus.
         # CheckIfWirelessConnecting can be used to test if the connection
         # is done.
-        self.wifi.before_script = self.GetWirelessProperty(nid, 'beforescript')
-        self.wifi.after_script = self.GetWirelessProperty(nid, 'afterscript')
-        self.wifi.pre_disconnect_script = self.GetWirelessProperty(nid,
-                                                        'predisconnectscript')
-        self.wifi.post_disconnect_script = self.GetWirelessProperty(nid,
-                                                        'postdisconnectscript')
-        self.wifi.bitrate = self.GetWirelessProperty(nid, 'bitrate')
-        self.wifi.allow_lower_bitrates = self.GetWirelessProperty(nid,
-                                                        'allow_lower_bitrates')
-        print 'Connecting to wireless network ' + \
-            str(self.LastScan[nid]['essid'])
+        get = lambda prop: misc.to_unicode(network.get(prop))
+        self.wifi.before_script = get('beforescript')
+        self.wifi.after_script = get('afterscript')
+        self.wifi.pre_disconnect_script = get('predisconnectscript')
+        self.wifi.post_disconnect_script = get('postdisconnectscript')
+        self.wifi.bitrate = get('bitrate')
+        self.wifi.allow_lower_bitrates = get('allow_lower_bitrates')
+        print 'Connecting to wireless network ' + str(network['essid'])
         # disconnect to make sure that scripts are run
         self.wifi.Disconnect()
         self.daemon.wired_bus.wired.Disconnect()
         self.daemon.SetForcedDisconnect(False)
-        self.wifi.Connect(self.LastScan[nid], debug=self.debug_mode)
+        self.wifi.Connect(network, debug=self.debug_mode)
         self.daemon.UpdateState()
 
     @dbus.service.method('org.wicd.daemon.wireless')
@@ -1256,20 +1694,18 @@ class WirelessDaemon(dbus.service.Object, object):
     @dbus.service.method('org.wicd.daemon.wireless')
     def ReadWirelessNetworkProfile(self, nid):
         """ Reads in wireless profile as the active network """
-        cur_network = self.LastScan[nid]
-        essid_key = "essid:%s" % cur_network["essid"]
-        bssid_key = cur_network["bssid"]
+        return self._read_network_profile(self.LastScan[nid])
 
-        if self.config.get(essid_key, 'use_settings_globally'):
-            section = essid_key
-        elif self.config.has_section(bssid_key):
-            section = bssid_key
-        else:
+    def _read_network_profile(self, cur_network):
+        """ Reads the profile of a network of the last scan. """
+        section, profile = self.profiles.get_profile(cur_network["essid"],
+                                                     cur_network["bssid"])
+        if profile is None:
             return "500: Profile Not Found"
 
-        for x in self.config.options(section):
+        for x, value in profile.iteritems():
             if not cur_network.has_key(x) or x.endswith("script"):
-                cur_network[x] = misc.Noneify(self.config.get(section, x))
+                cur_network[x] = misc.Noneify(value)
         for option in ['use_static_dns', 'use_global_dns', 'encryption',
                        'use_settings_globally']:
             cur_network[option] = bool(cur_network.get(option))
@@ -1278,61 +1714,72 @@ class WirelessDaemon(dbus.service.Object, object):
         if cur_network["hidden"]:
             # check if there is an essid in the config file
             # if there isn't, .get( will return None
-            stored_essid = self.config.get(section, 'essid')
+            stored_essid = profile.get('essid')
             if stored_essid:
                 # set the current network's ESSID to the stored one
-                cur_network['essid'] = stored_essid
+                self.LastScan.set_property(cur_network, 'essid', stored_essid)
 
     @dbus.service.method('org.wicd.daemon.wireless')
     def SaveWirelessNetworkProfile(self, nid):
         """ Writes a wireless profile to disk. """
-        def write_script_ent(prof, script):
-            if not self.config.has_option(prof, script):
-                self.config.set(prof, script, None)
+        self._save_network_profile(self.LastScan[nid])
 
-        cur_network = self.LastScan[nid]
-        bssid_key = cur_network["bssid"]
-        essid_key = "essid:%s" % cur_network["essid"]
+    def _save_network_profile(self, cur_network):
+        """ Writes the profile of a network of the last scan to disk.
 
-        self.config.remove_section(bssid_key)
-        self.config.add_section(bssid_key)
+        Nothing is written if the saved profile is already the same.
 
-        # We want to write the essid in addition to bssid
-        # sections if global settings are enabled.
-        self.config.remove_section(essid_key)
-        if cur_network.get("use_settings_globally", False):
-            self.config.add_section(essid_key)
+        """
+        bssid_key = cur_network["bssid"]
+        essid_key = "essid:%s" % cur_network["essid"]
 
+        profile = {}
         for x in cur_network:
             # There's no reason to save these to a configfile...
             if x not in ['quality', 'strength', 'bitrates', 'has_profile']:
-                self.config.set(bssid_key, x, cur_network[x])
-                if cur_network.get("use_settings_globally", False):
-                    self.config.set(essid_key, x, cur_network[x])
-
-        write_script_ent(bssid_key, "beforescript")
-        write_script_ent(bssid_key, "afterscript")
-        write_script_ent(bssid_key, "predisconnectscript")
-        write_script_ent(bssid_key, "postdisconnectscript")
-
-        if cur_network.get("use_settings_globally", False):
-            write_script_ent(essid_key, "beforescript")
-            write_script_ent(essid_key, "afterscript")
-            write_script_ent(essid_key, "predisconnectscript")
-            write_script_ent(essid_key, "postdisconnectscript")
+                profile[x] = cur_network[x]
+        for script in ['beforescript', 'afterscript', 'predisconnectscript',
+                       'postdisconnectscript']:
+            profile.setdefault(script, None)
+
+        with self.config.batch():
+            self.config.set_section(bssid_key, profile)
+
+            # We want to write the essid in addition to bssid
+            # sections if global settings are enabled.
+            if cur_network.get("use_settings_globally", False):
+                self.config.set_section(essid_key, profile)
+            else:
+                self.config.remove_section(essid_key)
 
-        self.config.write()
+            self.config.write()
 
     @dbus.service.method('org.wicd.daemon.wireless')
     def SaveWirelessNetworkProperty(self, nid, option):
         """ Writes a particular wireless property to disk. """
+        self._save_network_property(self.LastScan[nid], option)
+
+    @dbus.service.method('org.wicd.daemon.wireless', in_signature='us')
+    def SaveWirelessNetworkPropertyByHandle(self, handle, option):
+        """ Writes a property of the network with the given handle to disk.
+
+        Returns False if the network is gone.
+
+        """
+        network = self.LastScan.by_handle(handle)
+        if network is None:
+            return False
+        self._save_network_property(network, option)
+        return True
+
+    def _save_network_property(self, cur_network, option):
+        """ Writes a property of a network of the last scan to disk. """
         option = misc.sanitize_config(option)
         if option.endswith("script"):
             print 'You cannot save script information to disk through ' + \
                   'the daemon.'
             return
         config = self.config
-        cur_network = self.LastScan[nid]
         essid_key = "essid:" + cur_network["essid"]
 
         config.set(cur_network["bssid"], option, str(cur_network[option]))
@@ -1396,17 +1843,57 @@ class WirelessDaemon(dbus.service.Object, object):
         """ Emits a signal announcing a scan has finished. """
         self._scanning = False
 
+    @dbus.service.signal(dbus_interface='org.wicd.daemon.wireless', \
+        signature='aa{sv}asa{sa{sv}}as')
+    def ScanDelta(self, added, removed, changed, order):
+        """ Emits the differences between the last two scans.
+
+        It is sent right before SendEndScanSignal, so clients can
+        update the networks that changed instead of fetching the whole
+        scan again.  Networks are identified by their BSSID, which
+        stays the same across scans.
+
+        Keyword arguments:
+        added -- the properties of the networks that were not in the
+                 previous scan
+        removed -- the BSSIDs of the networks that are gone
+        changed -- maps the BSSID of the networks whose properties
+                   changed to the changed properties.  Properties that
+                   are no longer set have an empty value.
+        order -- the BSSIDs of all the networks of the scan.  The
+                 position of a BSSID is its network id.
+
+        """
+        pass
+
     def _wireless_autoconnect(self, fresh=True):
-        """ Attempts to autoconnect to a wireless network. """
+        """ Attempts to autoconnect to a wireless network.
+
+        If fresh is True, the networks are scanned for on the worker
+        pool first.
+
+        """
         print "No wired connection present, attempting to autoconnect " + \
               "to wireless network"
         if self.wifi.wireless_interface is None:
             print 'Autoconnect failed because wireless interface returned None'
+            self.daemon._autoconnect_pending = False
             return
-        if fresh:
-            self.Scan(sync=True)
+        if fresh and self._begin_scan():
+            self.daemon.pool.run(self._sync_scan, (),
+                                 self._autoconnect_to_scanned,
+                                 self.daemon._autoconnect_failed)
+        else:
+            self._autoconnect_to_scanned()
 
-        for x, network in enumerate(self.LastScan):
+    def _autoconnect_to_scanned(self):
+        """ Connects to the first automatic network of the last scan. """
+        self.daemon._autoconnect_pending = False
+        if self.daemon.CheckIfConnecting():
+            if self.debug_mode:
+                print 'Already connecting, doing nothing.'
+            return
+        for network in self.LastScan:
             if self.config.has_section(network['bssid']):
                 if self.debug_mode:
                     print network["essid"] + ' has profile'
@@ -1418,8 +1905,11 @@ class WirelessDaemon(dbus.service.Object, object):
                         print network["essid"],'has no never connect value'
                     print 'trying to automatically connect to...' + \
                           network["essid"]
-                    self.ConnectWireless(x)
-                    time.sleep(1)
+                    self._connect_network(network)
+                    # The connection thread only reports itself as
+                    # connecting once it runs.
+                    self.daemon._autoconnect_pending = True
+                    gobject.timeout_add(1000, self.daemon._end_autoconnect)
                     return
         print "Unable to autoconnect, you'll have to manually connect"
 
@@ -1439,6 +1929,9 @@ class WiredDaemon(dbus.service.Object, object):
         self._cur_wired_prof_name = ""
         self.WiredNetwork = {}
         self.config = ConfigManager(wired_conf, debug=debug)
+        # The result of the last link check, and whether one is running.
+        self._plugged_in = None
+        self._checking_plugged_in = False
 
     def get_debug_mode(self):
         """ Getter for debug_mode property. """
@@ -1504,6 +1997,15 @@ class WiredDaemon(dbus.service.Object, object):
             print 'SetWiredProperty: WiredNetwork does not exist'
             return False
 
+    @dbus.service.method('org.wicd.daemon.wired', out_signature='aa{sv}')
+    def GetEncryptionMethods(self):
+        """ Returns the encryption methods for wired networks.
+
+        See WirelessDaemon.GetEncryptionMethods.
+
+        """
+        return encryption_methods(wired=True)
+
     @dbus.service.method('org.wicd.daemon.wired')
     def GetWiredProperty(self, prop):
         """ Returns the requested wired property. """
@@ -1528,14 +2030,60 @@ class WiredDaemon(dbus.service.Object, object):
         self.wired.Disconnect()
         self.daemon.UpdateState()
 
-    @dbus.service.method('org.wicd.daemon.wired')
-    def CheckPluggedIn(self):
+    @dbus.service.method('org.wicd.daemon.wired',
+                         async_callbacks=ASYNC_CALLBACKS)
+    def CheckPluggedIn(self, reply_handler, error_handler):
+        """ Returns True if a ethernet cable is present, False otherwise.
+
+        Link detection can take seconds, so it runs on the worker pool.
+
+        """
+        self.daemon.pool.run(self._check_plugged_in, (), reply_handler,
+                             error_handler)
+
+    def _check_plugged_in(self):
         """ Returns True if a ethernet cable is present, False otherwise. """
         if self.wired.wired_interface and self.wired.wired_interface != "None":
-            return self.wired.CheckPluggedIn()
+            self._plugged_in = self.wired.CheckPluggedIn()
+            return self._plugged_in
         else:
             return None
 
+    def _peek_plugged_in(self):
+        """ Returns whether a ethernet cable is present, without waiting.
+
+        The carrier is read from sysfs.  When that isn't possible, as
+        when the interface is down, the result of the last link check
+        is returned, and a new one is started on the worker pool.
+
+        """
+        iface = self.wired.wired_interface
+        if not iface or iface == "None":
+            return None
+        try:
+            carrier = open('/sys/class/net/%s/carrier' % iface)
+            try:
+                return carrier.read().strip() == '1'
+            finally:
+                carrier.close()
+        except IOError:
+            pass
+        if not self._checking_plugged_in:
+            self._checking_plugged_in = True
+            self.daemon.pool.run(self._check_plugged_in, (),
+                                 self._plugged_in_checked,
+                                 self._plugged_in_check_failed)
+        return self._plugged_in
+
+    def _plugged_in_checked(self, result=None):
+        """ Called on the main loop once a link check ended. """
+        self._checking_plugged_in = False
+
+    def _plugged_in_check_failed(self, error):
+        """ Called on the main loop if a link check failed. """
+        print 'Checking for a wired connection failed: %s' % error
+        self._checking_plugged_in = False
+
     @dbus.service.method('org.wicd.daemon.wired')
     def IsWiredUp(self):
         """ Returns a boolean specifying if wired iface is up or down. """
@@ -1646,16 +2194,17 @@ class WiredDaemon(dbus.service.Object, object):
         if self.debug_mode:
             print "saving wired profile %s" % profilename
         profilename = misc.to_unicode(profilename)
-        self.config.remove_section(profilename)
-        self.config.add_section(profilename)
-        for x in self.WiredNetwork:
-            self.config.set(profilename, x, self.WiredNetwork[x])
-
-        write_script_ent(profilename, "beforescript")
-        write_script_ent(profilename, "afterscript")
-        write_script_ent(profilename, "predisconnectscript")
-        write_script_ent(profilename, "postdisconnectscript")
-        self.config.write()
+        with self.config.batch():
+            self.config.remove_section(profilename)
+            self.config.add_section(profilename)
+            for x in self.WiredNetwork:
+                self.config.set(profilename, x, self.WiredNetwork[x])
+
+            write_script_ent(profilename, "beforescript")
+            write_script_ent(profilename, "afterscript")
+            write_script_ent(profilename, "predisconnectscript")
+            write_script_ent(profilename, "postdisconnectscript")
+            self.config.write()
         return "100: Profile Written"
 
     @dbus.service.method('org.wicd.daemon.wired')
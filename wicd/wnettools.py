@@ -9,6 +9,7 @@ network interfaces.
 class BaseInterface() -- Control a network interface.
 class BaseWiredInterface() -- Control a wired network interface.
 class BaseWirelessInterface() -- Control a wireless network interface.
+class InterfaceRegistry() -- The network interfaces of the system.
 
 """
 
@@ -39,9 +40,13 @@ from string import maketrans, translate
 import dbus
 import socket, fcntl
 import shutil
+import urllib
+from threading import Lock
 
 import wpath
 import misc
+import netlink
+import wpasupplicant
 from misc import find_path 
 
 # Regular expressions.
@@ -61,6 +66,20 @@ altwpa_pattern = re.compile('(wpa_ie)', _re_mode)
 wpa1_pattern = re.compile('(WPA Version 1)', _re_mode)
 wpa2_pattern = re.compile('(WPA2)', _re_mode)
 
+# Line patterns used by the single pass iwlist scan parser.  They are
+# the patterns above, applied to a single line of a cell instead of the
+# whole cell.
+cell_essid_pattern = re.compile('.*ESSID:"?(.*?)"', re.I)
+cell_ap_mac_pattern = re.compile('.*Address: (.*)$', re.I)
+cell_channel_pattern = re.compile('.*Channel:?=? ?(\d+)', re.I)
+cell_freq_pattern = re.compile('.*Frequency:(.*)$', re.I)
+cell_mode_pattern = re.compile('.*Mode:([A-Za-z-]*)$', re.I)
+cell_wep_pattern = re.compile('.*Encryption key:(.*)$', re.I)
+cell_strength_pattern = re.compile('.*Quality:?=? ?(\d+)\s*/?\s*(\d*)', re.I)
+cell_altstrength_pattern = re.compile(
+    '.*Signal level:?=? ?(\d+)\s*/?\s*(\d*)', re.I)
+cell_signaldbm_pattern = re.compile('.*Signal level:?=? ?(-\d\d*)', re.I)
+
 #iwconfig-only regular expressions.
 ip_up = re.compile(r'flags=[0.9]*<([^>]*)>', re.S)
 ip_pattern = re.compile(r'inet [Aa]d?dr[^.]*:([^.]*\.[^.]*\.[^.]*\.[0-9]*)',
@@ -97,31 +116,168 @@ def _sanitize_string_strict(string):
     else:
         return string
   
-_cache = {}
+# The most probe results kept, for all interfaces together.
+CACHE_SIZE = 64
+
+_MISSING = object()
+
+
+class InterfaceCache(object):
+    """ The results of interface probes, kept for a few seconds.
+
+    Results are kept per interface, so everything known about an
+    interface can be dropped at once when wicd changes it, and the
+    least recently used ones are dropped when there are more than
+    max_entries.  Keys are tuples, see timedcache.
+
+    """
+    def __init__(self, max_entries=CACHE_SIZE):
+        """ Keyword arguments:
+        max_entries -- the most results to keep
+
+        """
+        self.max_entries = max_entries
+        # iface -> {key : [expiry time, last use, value]}
+        self._ifaces = {}
+        # iface -> how many times it was invalidated
+        self._generations = {}
+        self._size = 0
+        self._uses = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Probes run from the main loop, the worker pool and the
+        # connection threads.
+        self._lock = Lock()
+
+    def lookup(self, iface, key):
+        """ Look up the result of a probe.
+
+        Returns:
+        A tuple (value, generation).  value is _MISSING if there is
+        no fresh result, and generation has to be passed to store()
+        along with the result of the probe.
+
+        """
+        self._lock.acquire()
+        try:
+            generation = self._generations.get(iface, 0)
+            entries = self._ifaces.get(iface)
+            entry = entries and entries.get(key)
+            if entry and entry[0] > time.time():
+                self._uses += 1
+                entry[1] = self._uses
+                self.hits += 1
+                return (entry[2], generation)
+            if entry:
+                del entries[key]
+                self._size -= 1
+            self.misses += 1
+            return (_MISSING, generation)
+        finally:
+            self._lock.release()
+
+    def store(self, iface, key, value, duration, generation):
+        """ Keep the result of a probe for duration seconds.
+
+        The result is thrown away if the interface was invalidated
+        since generation was looked up, as the probe may have run
+        before the change.
+
+        """
+        self._lock.acquire()
+        try:
+            if self._generations.get(iface, 0) != generation:
+                return
+            entries = self._ifaces.setdefault(iface, {})
+            if key not in entries:
+                self._size += 1
+            self._uses += 1
+            entries[key] = [time.time() + duration, self._uses, value]
+            while self._size > self.max_entries:
+                self._evict()
+        finally:
+            self._lock.release()
+
+    def _evict(self):
+        """ Drop the least recently used result. """
+        oldest = None
+        for iface, entries in self._ifaces.iteritems():
+            for key, entry in entries.iteritems():
+                if oldest is None or entry[1] < oldest[2]:
+                    oldest = (iface, key, entry[1])
+        del self._ifaces[oldest[0]][oldest[1]]
+        self._size -= 1
+        self.evictions += 1
+
+    def invalidate(self, iface=None):
+        """ Drop the results for an interface, or for all of them. """
+        self._lock.acquire()
+        try:
+            if iface is None:
+                ifaces = set(self._ifaces) | set(self._generations)
+            else:
+                ifaces = [iface]
+            for name in ifaces:
+                self._generations[name] = self._generations.get(name, 0) + 1
+                self._size -= len(self._ifaces.pop(name, ()))
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return self._size
+
+cache = InterfaceCache()
+
 def timedcache(duration=5):
     """ A caching decorator for use with wnettools methods.
     
     Caches the results of a function for a given number of
-    seconds (defaults to 5).
+    seconds (defaults to 5), in the namespace of the interface in
+    cache.  Calls with arguments that can't be hashed aren't cached.
     
     """
     def _timedcache(f):
         def __timedcache(self, *args, **kwargs):
-            key = str(args) + str(kwargs) + str(f)
-            if hasattr(self, 'iface'):
-                key += self.iface
-            if (key in _cache and 
-                (time.time() - _cache[key]['time']) < duration):
-                return _cache[key]['value']
-            else:
+            key = (f.__name__, args, tuple(sorted(kwargs.items())))
+            try:
+                hash(key)
+            except TypeError:
+                return f(self, *args, **kwargs)
+            iface = getattr(self, 'iface', None)
+            value, generation = cache.lookup(iface, key)
+            if value is _MISSING:
                 value = f(self, *args, **kwargs)
-                _cache[key] = { 'time' : time.time(), 'value' : value }
-                return value
-            
+                cache.store(iface, key, value, duration, generation)
+            return value
+
+        __timedcache.__name__ = f.__name__
+        __timedcache.__dict__ = f.__dict__
+        __timedcache.__doc__ = f.__doc__
+        __timedcache.__module__ = f.__module__
         return __timedcache
     
     return _timedcache
 
+def invalidates_cache(f):
+    """ A decorator for methods that change the state of the interface.
+
+    The cached probe results of the interface are dropped once the
+    method returns, or raises.
+
+    """
+    def wrapper(self, *args, **kwargs):
+        try:
+            return f(self, *args, **kwargs)
+        finally:
+            cache.invalidate(getattr(self, 'iface', None))
+
+    wrapper.__name__ = f.__name__
+    wrapper.__dict__ = f.__dict__
+    wrapper.__doc__ = f.__doc__
+    wrapper.__module__ = f.__module__
+    return wrapper
+
 def GetDefaultGateway():
     """ Attempts to determine the default gateway by parsing route -n. """
     route_info = misc.Run("route -n")
@@ -165,26 +321,178 @@ def isWireless(devname):
         sk.close()
     return we is not None
 
+SYS_NET_DIR = '/sys/class/net'
+# How often the interfaces are listed again when netlink is unavailable.
+REGISTRY_POLL_INTERVAL = 2
+
+ARPHRD_ETHER = 1
+
+IFACE_WIRED = 'wired'
+IFACE_WIRELESS = 'wireless'
+IFACE_OTHER = 'other'
+
+def _read_sys_int(path):
+    """ Returns the number in a sysfs file, or None. """
+    try:
+        f = open(path)
+        try:
+            return int(f.read().strip())
+        finally:
+            f.close()
+    except (IOError, ValueError):
+        return None
+
+
+class InterfaceRegistry(object):
+    """ The network interfaces of the system, and what kind they are.
+
+    The interfaces are listed from sysfs once, and after that kept
+    current with the RTM_NEWLINK and RTM_DELLINK notifications the
+    kernel sends, so looking them up costs no more than reading the
+    pending notifications.  Each interface is classified once, when
+    it's first seen.  Without netlink, sysfs is listed again when the
+    list is older than REGISTRY_POLL_INTERVAL seconds.
+
+    """
+    def __init__(self, sys_dir=SYS_NET_DIR, use_netlink=True):
+        """ Keyword arguments:
+        sys_dir -- where the interfaces are listed
+        use_netlink -- whether to follow the netlink notifications
+
+        """
+        self.sys_dir = sys_dir
+        # ifindex -> (name, kind)
+        self._links = {}
+        self._listed = None
+        self.listings = 0
+        self._events = None
+        self._lock = Lock()
+        if use_netlink:
+            # Subscribe before listing, so no change can be missed.
+            try:
+                self._events = netlink.RtnlEventSocket(netlink.RTMGRP_LINK)
+            except (socket.error, AttributeError), e:
+                print 'Netlink unavailable, polling %s for interfaces: %s' % \
+                    (sys_dir, str(e))
+
+    def _classify(self, name, dev_type):
+        """ Returns the kind of an interface, one of the IFACE_*. """
+        sys_path = os.path.join(self.sys_dir, name)
+        if os.path.isdir(os.path.join(sys_path, 'wireless')) or \
+           os.path.isdir(os.path.join(sys_path, 'phy80211')) or \
+           isWireless(str(name)):
+            return IFACE_WIRELESS
+        if dev_type == ARPHRD_ETHER:
+            return IFACE_WIRED
+        return IFACE_OTHER
+
+    def _list(self):
+        """ List the interfaces from sysfs. """
+        links = {}
+        try:
+            names = os.listdir(self.sys_dir)
+        except OSError, e:
+            print "Couldn't list the network interfaces: %s" % str(e)
+            names = []
+        for name in names:
+            sys_path = os.path.join(self.sys_dir, name)
+            index = _read_sys_int(os.path.join(sys_path, 'ifindex'))
+            if index is None:
+                # Not an interface, like bonding_masters.
+                continue
+            known = self._links.get(index)
+            if known and known[0] == name:
+                links[index] = known
+            else:
+                dev_type = _read_sys_int(os.path.join(sys_path, 'type'))
+                links[index] = (name, self._classify(name, dev_type))
+        self._links = links
+        self._listed = time.time()
+        self.listings += 1
+
+    def _handle_events(self):
+        """ Apply the pending link notifications. """
+        relist = False
+        for event in self._events.read_events():
+            if event['type'] == netlink.EVENT_OVERRUN:
+                # Notifications were lost.
+                relist = True
+            elif event['type'] == netlink.RTM_DELLINK:
+                self._links.pop(event['index'], None)
+                cache.invalidate(event['ifname'])
+            elif event['type'] == netlink.RTM_NEWLINK and event['ifname']:
+                known = self._links.get(event['index'])
+                if known and known[0] == event['ifname']:
+                    continue
+                if known:
+                    # Renamed; that doesn't make it another kind.
+                    kind = known[1]
+                else:
+                    kind = self._classify(event['ifname'], event['dev_type'])
+                self._links[event['index']] = (event['ifname'], kind)
+        if relist:
+            self._list()
+
+    def _update(self):
+        """ Bring the list of interfaces up to date. """
+        if self._listed is None:
+            self._list()
+        elif self._events:
+            self._handle_events()
+        elif time.time() - self._listed > REGISTRY_POLL_INTERVAL:
+            self._list()
+
+    def interfaces(self, kind=None):
+        """ Returns the names of the interfaces of a kind, or of all of
+        them, in the order they were created. """
+        self._lock.acquire()
+        try:
+            self._update()
+            indices = self._links.keys()
+            indices.sort()
+            return [self._links[index][0] for index in indices
+                    if kind is None or self._links[index][1] == kind]
+        finally:
+            self._lock.release()
+
+    def exists(self, name):
+        """ Returns True if the interface exists. """
+        self._lock.acquire()
+        try:
+            self._update()
+            for link_name, kind in self._links.itervalues():
+                if link_name == name:
+                    return True
+            return False
+        finally:
+            self._lock.release()
+
+    def close(self):
+        """ Stop following the netlink notifications. """
+        if self._events:
+            self._events.close()
+            self._events = None
+
+_registry = None
+def get_registry():
+    """ Returns the registry of the network interfaces. """
+    global _registry
+    if _registry is None:
+        _registry = InterfaceRegistry()
+    return _registry
+
 def GetWirelessInterfaces():
     """ Get available wireless interfaces.
 
-    Attempts to get an interface first by parsing /proc/net/wireless,
-    and should that fail, by parsing iwconfig.
     Returns:
-    The first interface available.
+    The names of the wireless interfaces, see InterfaceRegistry.
 
     """
-    dev_dir = '/sys/class/net/'
-    ifnames = [iface for iface in os.listdir(dev_dir) if isWireless(str(iface))]
-    return ifnames
+    return get_registry().interfaces(IFACE_WIRELESS)
 
 def GetWiredInterfaces():
     """ Returns a list of wired interfaces on the system. """
-    basedir = '/sys/class/net/'
-    return [iface for iface in os.listdir(basedir)
-            if os.path.isdir(basedir + iface) and not 'wireless'
-            in os.listdir(basedir + iface) and
-            open(basedir + iface + "/type").readlines()[0].strip() == "1"]
+    return get_registry().interfaces(IFACE_WIRED)
 
 def NeedsExternalCalls():
     """ Returns True if the backend needs to use an external program. """
@@ -220,8 +528,7 @@ def neediface(default_response):
     """
     def wrapper(func):
         def newfunc(self, *args, **kwargs):
-            if not self.iface or \
-               not os.path.exists('/sys/class/net/%s' % self.iface):
+            if not self.iface or not get_registry().exists(self.iface):
                 return default_response
             return func(self, *args, **kwargs)
         newfunc.__dict__ = func.__dict__
@@ -247,6 +554,8 @@ class BaseInterface(object):
         self.flush_tool = None
         self.link_detect = None       
         self.dhcp_object = None
+        # The network whose lease the DHCP client is started with.
+        self.dhcp_lease_key = None
 
         self.ethtool_cmd = None
         self.miitool_cmd = None
@@ -333,9 +642,9 @@ class BaseInterface(object):
         
         client_dict = {
             "dhclient" : 
-                {'connect' : r"%(cmd)s -cf %(dhclientconf)s %(iface)s",
-                 'connect_with_hostname' : r"%(cmd)s -cf %(dhclientconf)s %(iface)s",
-                 'release' : r"%(cmd)s -r %(iface)s",
+                {'connect' : r"%(cmd)s -cf %(dhclientconf)s %(lease)s%(iface)s",
+                 'connect_with_hostname' : r"%(cmd)s -cf %(dhclientconf)s %(lease)s%(iface)s",
+                 'release' : r"%(cmd)s -r %(lease)s%(iface)s",
                  'id' : misc.DHCLIENT, 
                  },
             "pump" : 
@@ -345,14 +654,14 @@ class BaseInterface(object):
                   'id' : misc.PUMP,
                 },
             "dhcpcd" : 
-                {'connect' : r"%(cmd)s --noipv4ll %(iface)s",
-                 'connect_with_hostname' : r"%(cmd)s -h %(hostname)s --noipv4ll %(iface)s ",
+                {'connect' : r"%(cmd)s %(lease)s--noipv4ll %(iface)s",
+                 'connect_with_hostname' : r"%(cmd)s -h %(hostname)s %(lease)s--noipv4ll %(iface)s ",
                  'release' : r"%(cmd)s -k %(iface)s",
                  'id' : misc.DHCPCD,
                 },
             "udhcpc":
-                {'connect' : r"%(cmd)s -n -i %(iface)s",
-                 'connect_with_hostname' : r"%(cmd)s -n -i %(iface)s -H %(hostname)s ",
+                {'connect' : r"%(cmd)s -n %(lease)s-i %(iface)s",
+                 'connect_with_hostname' : r"%(cmd)s -n %(lease)s-i %(iface)s -H %(hostname)s ",
                  'release' : r"killall -SIGUSR2 %(cmd)s",
                  'id' : misc.UDHCPC,
                 },
@@ -388,20 +697,26 @@ class BaseInterface(object):
             return ""
             
         if flavor == "connect":
+            lease = self._get_lease_option(client_name)
             if hostname:
                 return client_dict[client_name]['connect_with_hostname'] % \
                     { "cmd" : cmd,
                       "iface" : self.iface,
                       "hostname" : hostname,
+                      "lease" : lease,
                       'dhclientconf' : dhclient_conf_path }
             else:
                 return client_dict[client_name]['connect'] % \
                     { "cmd" : cmd,
                       "iface" : self.iface,
+                      "lease" : lease,
                       'dhclientconf' : dhclient_conf_path }
         elif flavor == "release":
+            # dhclient has to be given the lease file of the network,
+            # or it doesn't release the lease it holds.
             return client_dict[client_name]['release'] % \
-                {"cmd": cmd, "iface": self.iface}
+                {"cmd": cmd, "iface": self.iface,
+                 "lease": self._get_lease_option(client_name)}
         else:
             return client_dict[client_name]['id']
     
@@ -472,6 +787,7 @@ class BaseInterface(object):
         self.kdesu_cmd = self._find_program_path("kdesu")
         self.ktsuss_cmd = self._find_program_path("ktsuss")
 
+    @invalidates_cache
     @neediface(False)
     def Up(self):
         """ Bring the network interface up.
@@ -486,6 +802,7 @@ class BaseInterface(object):
         misc.Run(cmd)
         return True
 
+    @invalidates_cache
     @neediface(False)
     def Down(self):
         """ Take down the network interface. 
@@ -509,6 +826,7 @@ class BaseInterface(object):
             print cmd
         return misc.Run(cmd)
 
+    @invalidates_cache
     @neediface("")
     def SetAddress(self, ip=None, netmask=None, broadcast=None):
         """ Set the IP addresses of an interface.
@@ -637,6 +955,62 @@ class BaseInterface(object):
 
         return self._check_dhcp_result(udhcpc_success)
 
+    def _lease_path(self, suffix):
+        """ Returns where the lease of the current network is kept. """
+        key = self.dhcp_lease_key
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return os.path.join(wpath.varlib, 'leases',
+                            urllib.quote(str(key), safe='') + suffix)
+
+    def _get_lease_option(self, client_name):
+        """ Returns the options that make the DHCP client reuse the lease
+        it got on the network last time.
+
+        dhclient gets a lease file of its own for every network, and
+        asks for the lease it holds (INIT-REBOOT) before falling back
+        to discovering a server.  dhcpcd and udhcpc are asked for the
+        address they got last time in their discovery.
+
+        """
+        if not self.dhcp_lease_key:
+            return ''
+        lease_dir = os.path.join(wpath.varlib, 'leases')
+        if not os.path.isdir(lease_dir):
+            try:
+                os.makedirs(lease_dir, 0700)
+            except OSError, e:
+                print 'Could not create %s: %s' % (lease_dir, e)
+                return ''
+        if client_name == 'dhclient':
+            return '-lf %s ' % self._lease_path('.leases')
+        if client_name in ('dhcpcd', 'udhcpc'):
+            try:
+                f = open(self._lease_path('.address'))
+                address = f.read().strip()
+                f.close()
+            except IOError:
+                return ''
+            if misc.IsValidIPv4(address):
+                return '-r %s ' % address
+        return ''
+
+    def _save_lease_address(self):
+        """ Remembers the address DHCP gave us on the current network. """
+        # dhclient keeps its lease file up to date itself.
+        if not self.dhcp_lease_key or \
+           self._get_dhcp_command() == misc.DHCLIENT:
+            return
+        address = self.GetIP()
+        if not address:
+            return
+        try:
+            f = open(self._lease_path('.address'), 'w')
+            f.write(address + '\n')
+            f.close()
+        except IOError, e:
+            print 'Could not save the DHCP address: %s' % e
+
     def _check_dhcp_result(self, success):
         """ Print and return the correct DHCP connection result. 
         
@@ -654,18 +1028,22 @@ class BaseInterface(object):
             print 'DHCP connection failed'
             return 'dhcp_failed'
             
+    @invalidates_cache
     @neediface(False)
-    def StartDHCP(self, hostname):
+    def StartDHCP(self, hostname, lease_key=None):
         """ Start the DHCP client to obtain an IP address.
 
         Keyword Arguments:
         hostname -- the hostname to send to the DHCP server
+        lease_key -- identifies the network, so the lease it gave
+                     last time can be asked for first
         
         Returns:
         A string representing the result of the DHCP command.  See
         _check_dhcp_result for the possible values.
         
         """
+        self.dhcp_lease_key = lease_key
         cmd = self._get_dhcp_command('connect', hostname)
         if self.verbose:
             print cmd
@@ -684,8 +1062,11 @@ class BaseInterface(object):
             print "ERROR: no dhcp client found"
             ret = None
         self.dhcp_object.wait()
+        if ret == 'success':
+            self._save_lease_address()
         return ret
         
+    @invalidates_cache
     @neediface(False)
     def ReleaseDHCP(self):
         """ Release the DHCP lease for this interface. """
@@ -856,6 +1237,7 @@ class BaseInterface(object):
             return self._slow_is_up(ifconfig)
         return bool(int(flags, 16) & 1)
     
+    @invalidates_cache
     @neediface(False)
     def StopWPA(self):
         """ Terminates wpa using wpa_cli"""
@@ -994,6 +1376,7 @@ class BaseWiredInterface(BaseInterface):
         else:
             return False
         
+    @invalidates_cache
     def Authenticate(self, network):
         """ Authenticate with wpa_supplicant. """
         misc.ParseEncryption(network)
@@ -1017,11 +1400,29 @@ class BaseWirelessInterface(BaseInterface):
         BaseInterface.__init__(self, iface, verbose)
         self.wpa_driver = wpa_driver
         self.scan_iface = None
+        # Keep wpa_supplicant running between connections.
+        self.persistent_wpa = False
         
     def SetWpaDriver(self, driver):
         """ Sets the wpa_driver. """
-        self.wpa_driver = _sanitize_string(driver)
+        driver = _sanitize_string(driver)
+        if self.persistent_wpa and driver != self.wpa_driver:
+            # The running wpa_supplicant uses the old driver.
+            self.StopWPA(terminate=True)
+        self.wpa_driver = driver
+
+    def SetPersistentWpa(self, value):
+        """ Sets whether wpa_supplicant is kept running.
+
+        When it is, Authenticate switches the running wpa_supplicant
+        to the new network over its control interface, and StopWPA
+        only disconnects it, instead of starting and killing one for
+        every connection.
+
+        """
+        self.persistent_wpa = bool(value)
 
+    @invalidates_cache
     @neediface(False)
     def SetEssid(self, essid):
         """ Set the essid of the wireless interface.
@@ -1166,6 +1567,7 @@ class BaseWirelessInterface(BaseInterface):
                 ap['encryption'] = False
         return ap
 
+    @invalidates_cache
     @neediface(False)
     def SetMode(self, mode):
         """ Set the mode of the wireless interface.
@@ -1184,6 +1586,7 @@ class BaseWirelessInterface(BaseInterface):
             print cmd
         misc.Run(cmd)
 
+    @invalidates_cache
     @neediface(False)
     def SetChannel(self, channel):
         """ Set the channel of the wireless interface.
@@ -1201,6 +1604,7 @@ class BaseWirelessInterface(BaseInterface):
             print cmd
         misc.Run(cmd)
 
+    @invalidates_cache
     @neediface(False)
     def SetKey(self, key):
         """ Set the encryption key of the wireless interface.
@@ -1214,6 +1618,7 @@ class BaseWirelessInterface(BaseInterface):
             print cmd
         misc.Run(cmd)
 
+    @invalidates_cache
     @neediface(False)
     def SetBitrate(self, bitrate, allow_lower=False):
         ''' Set the desired bitrate for the interface.
@@ -1230,6 +1635,7 @@ class BaseWirelessInterface(BaseInterface):
             cmd = 'iwconfig %s rate %sM fixed' % (self.iface, bitrate)
         misc.Run(cmd)
 
+    @invalidates_cache
     @neediface(False)
     def Associate(self, essid, channel=None, bssid=None):
         """ Associate with the specified wireless network.
@@ -1254,22 +1660,18 @@ class BaseWirelessInterface(BaseInterface):
             misc.Run(cmd)
         
     def GeneratePSK(self, network):
-        """ Generate a PSK using wpa_passphrase. 
+        """ Generate a PSK like wpa_passphrase does. 
 
         Keyword arguments:
         network -- dictionary containing network info
+
+        Returns:
+        The PSK, or None if the key isn't a valid WPA passphrase.
         
         """
-        wpa_pass_path = misc.find_path('wpa_passphrase')
-        if not wpa_pass_path:
-            return None
-        key_pattern = re.compile('network={.*?\spsk=(.*?)\n}.*',
-                                 re.I | re.M  | re.S)
-        cmd = [wpa_pass_path, str(network['essid']), str(network['key'])]
-        if self.verbose:
-            print cmd
-        return misc.RunRegex(key_pattern, misc.Run(cmd))
+        return misc.generate_psk(network['essid'], network['key'])
 
+    @invalidates_cache
     @neediface(False)
     def Authenticate(self, network):
         """ Authenticate with the specified wireless network.
@@ -1278,10 +1680,11 @@ class BaseWirelessInterface(BaseInterface):
         network -- dictionary containing network info
 
         """
-        misc.ParseEncryption(network)
         if self.wpa_driver == RALINK_DRIVER:
+            misc.ParseEncryption(network)
             self._AuthenticateRalinkLegacy(network)
-        else:
+        elif not (self.persistent_wpa and self._ConfigureRunningWpa(network)):
+            misc.ParseEncryption(network)
             if self.wpa_driver == NONE_DRIVER:
                 driver = ''
             else:
@@ -1294,6 +1697,64 @@ class BaseWirelessInterface(BaseInterface):
                 print cmd
             misc.Run(cmd)
 
+    def _ConfigureRunningWpa(self, network):
+        """ Switch a running wpa_supplicant to the given network.
+
+        Returns:
+        True if wpa_supplicant was reconfigured, False if it has to be
+        started, either because it isn't running or because it didn't
+        accept the new configuration, in which case it is terminated.
+
+        """
+        path = wpasupplicant.ctrl_path(self.iface)
+        try:
+            ctrl = wpasupplicant.WpaCtrl(path)
+        except wpasupplicant.WpaCtrlError:
+            return False
+        try:
+            wpasupplicant.configure_networks(ctrl,
+                misc.GenerateEncryptionConfig(network))
+            if self.verbose:
+                print 'Reconfigured the running wpa_supplicant'
+            return True
+        except wpasupplicant.WpaCtrlError, e:
+            print '%s, restarting wpa_supplicant' % e
+            try:
+                ctrl.request('TERMINATE')
+            except wpasupplicant.WpaCtrlError:
+                pass
+        finally:
+            ctrl.close()
+        # The new wpa_supplicant can't start while the old one still
+        # has its control socket.
+        if not wpasupplicant.wait_for_exit(path, sleep=misc.sleep):
+            print 'wpa_supplicant did not exit after TERMINATE'
+        return False
+
+    @invalidates_cache
+    @neediface(False)
+    def StopWPA(self, terminate=False):
+        """ Stops wpa_supplicant.
+
+        If wpa_supplicant is kept running, its networks are removed so
+        it disconnects, unless terminate is True.
+
+        """
+        if self.persistent_wpa and not terminate:
+            try:
+                ctrl = wpasupplicant.WpaCtrl(
+                    wpasupplicant.ctrl_path(self.iface))
+            except wpasupplicant.WpaCtrlError:
+                return
+            try:
+                ctrl.request('REMOVE_NETWORK all')
+                ctrl.request('DISCONNECT')
+            except wpasupplicant.WpaCtrlError, e:
+                print e
+            ctrl.close()
+            return
+        BaseInterface.StopWPA(self)
+
     def _AuthenticateRalinkLegacy(self, network):
         """ Authenticate with the specified wireless network.
 
@@ -1381,6 +1842,11 @@ class BaseWirelessInterface(BaseInterface):
     def _ParseAccessPoint(self, cell, ralink_info):
         """ Parse a single cell from the output of iwlist.
 
+        The cell is read in a single pass, one line at a time, and each
+        line is only matched against the patterns its keywords call
+        for.  When a field appears several times, the last occurrence
+        wins, like with the cell-wide regular expressions.
+
         Keyword arguments:
         cell -- string containing the cell information
         ralink_info -- string contating network information needed
@@ -1390,10 +1856,68 @@ class BaseWirelessInterface(BaseInterface):
         A dictionary containing the cell networks properties.
 
         """
+        essid = bssid = channel = freq = mode = wep = None
+        quality = level = dbm = None
+        wpa1 = altwpa = wpa2 = None
+        # Bit rates are read from the last 'Bit Rates' to the end of
+        # the cell, or from the whole cell if there's no such line.
+        bitrates = []
+
+        lines = cell.split('\n')
+        last = len(lines) - 1
+        for i, line in enumerate(lines):
+            if 'Bit Rates' in line:
+                bitrates = bitrates_pattern.findall(line.split('Bit Rates')[-1])
+            else:
+                bitrates.extend(bitrates_pattern.findall(line))
+
+            lower = line.lower()
+            # The end-of-line patterns only apply to complete lines.
+            complete = i < last
+            if complete and 'essid:' in lower:
+                m = cell_essid_pattern.match(line)
+                if m:
+                    essid = m.group(1)
+            if complete and 'address: ' in lower:
+                bssid = cell_ap_mac_pattern.match(line).group(1)
+            if 'channel' in lower:
+                m = cell_channel_pattern.match(line)
+                if m:
+                    channel = m.group(1)
+            if complete and 'frequency:' in lower:
+                freq = cell_freq_pattern.match(line).group(1)
+            if complete and 'mode:' in lower:
+                m = cell_mode_pattern.match(line)
+                if m:
+                    mode = m.group(1)
+            if complete and 'encryption key:' in lower:
+                wep = cell_wep_pattern.match(line).group(1)
+            if 'quality' in lower:
+                m = cell_strength_pattern.match(line)
+                if m:
+                    quality = m.groups()
+            if 'signal level' in lower:
+                m = cell_altstrength_pattern.match(line)
+                if m:
+                    level = m.groups()
+                m = cell_signaldbm_pattern.match(line)
+                if m:
+                    dbm = m.group(1)
+            # Only the first occurrence of these counts, and it has to
+            # be spelled exactly like this.
+            if wpa1 is None and 'wpa version 1' in lower:
+                start = lower.index('wpa version 1')
+                wpa1 = line[start:start + 13]
+            if altwpa is None and 'wpa_ie' in lower:
+                start = lower.index('wpa_ie')
+                altwpa = line[start:start + 6]
+            if wpa2 is None and 'wpa2' in lower:
+                start = lower.index('wpa2')
+                wpa2 = line[start:start + 4]
+
         ap = {}
-        ap['essid'] = misc.RunRegex(essid_pattern, cell)
         try:
-            ap['essid'] = misc.to_unicode(ap['essid'])
+            ap['essid'] = misc.to_unicode(essid)
         except (UnicodeDecodeError, UnicodeEncodeError):
             print 'Unicode problem with current network essid, ignoring!!'
             return None
@@ -1412,25 +1936,22 @@ class BaseWirelessInterface(BaseInterface):
 
         # Channel - For cards that don't have a channel number,
         # convert the frequency.
-        ap['channel'] = misc.RunRegex(channel_pattern, cell)
-        if ap['channel'] == None:
-            freq = misc.RunRegex(freq_pattern, cell)
-            ap['channel'] = self._FreqToChannel(freq)
+        if channel is None:
+            channel = self._FreqToChannel(freq)
+        ap['channel'] = channel
 
         # Bit Rate
-        bitrates = cell.split('Bit Rates')[-1].replace('\n', '; ')
-        m = re.findall(bitrates_pattern, bitrates)
-        if m:
+        if bitrates:
             # numeric sort
-            ap['bitrates'] = sorted(m, lambda x, y: int(float(x) - float(y)))
+            ap['bitrates'] = sorted(bitrates, key=float)
         else:
             ap['bitrates'] = None
 
         # BSSID
-        ap['bssid'] = misc.RunRegex(ap_mac_pattern, cell)
+        ap['bssid'] = bssid
 
         # Mode
-        ap['mode'] = misc.RunRegex(mode_pattern, cell)
+        ap['mode'] = mode
         if ap['mode'] is None:
             print 'Invalid network mode string, ignoring!'
             return None
@@ -1438,38 +1959,47 @@ class BaseWirelessInterface(BaseInterface):
         # Break off here if we're using a ralink card
         if self.wpa_driver == RALINK_DRIVER:
             ap = self._ParseRalinkAccessPoint(ap, ralink_info, cell)
-        elif misc.RunRegex(wep_pattern, cell) == 'on':
+        elif wep == 'on':
             # Encryption - Default to WEP
             ap['encryption'] = True
             ap['encryption_method'] = 'WEP'
 
-            if misc.RunRegex(wpa1_pattern, cell) == 'WPA Version 1':
+            if wpa1 == 'WPA Version 1':
                 ap['encryption_method'] = 'WPA'
 
-            if misc.RunRegex(altwpa_pattern, cell) == 'wpa_ie':
+            if altwpa == 'wpa_ie':
                 ap['encryption_method'] = 'WPA'
 
-            if misc.RunRegex(wpa2_pattern, cell) == 'WPA2':
+            if wpa2 == 'WPA2':
                 ap['encryption_method'] = 'WPA2'
         else:
             ap['encryption'] = False
 
         # Link Quality
-        # Set strength to -1 if the quality is not found
-        ap['quality'] = self._get_link_quality(cell)
-        if ap['quality'] is None:
-            ap['quality'] = -1
+        # If neither the quality nor the signal level are found, use
+        # 101, which will allow us to stay connected even though we
+        # don't know the strength.
+        if quality is None:
+            quality = level
+        if quality is None:
+            ap['quality'] = 101
+        else:
+            strength, max_strength = quality
+            if max_strength:
+                ap['quality'] = 100 * int(strength) // int(max_strength)
+            else:
+                ap['quality'] = int(strength)
 
         # Signal Strength (only used if user doesn't want link
         # quality displayed or it isn't found)
-        if misc.RunRegex(signaldbm_pattern, cell):
-            ap['strength'] = misc.RunRegex(signaldbm_pattern, cell)
+        if dbm:
+            ap['strength'] = dbm
         elif self.wpa_driver != RALINK_DRIVER:  # This is already set for ralink
             ap['strength'] = -1
 
         return ap
 
-    def ValidateAuthentication(self, auth_time):
+    def ValidateAuthentication(self, auth_time, cancelled=None):
         """ Validate WPA authentication.
 
             Validate that the wpa_supplicant authentication
@@ -1481,6 +2011,9 @@ class BaseWirelessInterface(BaseInterface):
             
             Keyword arguments:
             auth_time -- The time at which authentication began.
+            cancelled -- A function returning True when to stop
+                         waiting.  Defaults to checking the thread's
+                         CancelToken.
             
             Returns:
             True if wpa_supplicant authenticated succesfully,
@@ -1488,14 +2021,39 @@ class BaseWirelessInterface(BaseInterface):
 
         """
         # Right now there's no way to do this for these drivers
-        if self.wpa_driver == RALINK_DRIVER or not self.wpa_cli_cmd:
+        if self.wpa_driver == RALINK_DRIVER:
             return True
 
         MAX_TIME = 35
+        token = misc.get_cancel_token()
+        if not cancelled and token:
+            cancelled = token.cancelled
+        try:
+            ctrl = wpasupplicant.WpaCtrl(wpasupplicant.ctrl_path(self.iface))
+        except wpasupplicant.WpaCtrlError, e:
+            print '%s, falling back to wpa_cli' % e
+        else:
+            try:
+                result = wpasupplicant.validate_authentication(ctrl,
+                    auth_time + MAX_TIME, verbose=self.verbose,
+                    cancelled=cancelled)
+            except wpasupplicant.WpaCtrlError, e:
+                print e
+                result = False
+            finally:
+                ctrl.close()
+            if token:
+                token.check()
+            return result
+
+        if not self.wpa_cli_cmd:
+            return True
         MAX_DISCONNECTED_TIME = 3
         disconnected_time = 0
         forced_rescan = False
         while (time.time() - auth_time) < MAX_TIME:
+            if cancelled and cancelled():
+                return False
             cmd = '%s -i %s status' % (self.wpa_cli_cmd, self.iface)
             output = misc.Run(cmd)
             result = misc.RunRegex(auth_pattern, output)
@@ -1516,7 +2074,7 @@ class BaseWirelessInterface(BaseInterface):
                     MAX_TIME += 5
             else:
                 disconnected_time = 0
-            time.sleep(1)
+            misc.sleep(1)
 
         print 'wpa_supplicant authentication may have failed.'
         return False
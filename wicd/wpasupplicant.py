@@ -0,0 +1,397 @@
+#!/usr/bin/env python
+
+""" wpasupplicant -- wpa_supplicant control interface client for wicd
+
+This module talks to wpa_supplicant over its control interface, the
+unix datagram socket wpa_cli uses, so wicd doesn't have to run wpa_cli
+for every request, and can wait for wpa_supplicant's events instead of
+polling its state.
+
+class WpaCtrl() -- A connection to the control interface of an interface.
+def validate_authentication() -- Waits for wpa_supplicant to authenticate.
+def configure_networks() -- Switches a running wpa_supplicant to a config.
+def wait_for_exit() -- Waits for wpa_supplicant to remove its control socket.
+
+"""
+
+#
+#   Copyright (C) 2007 - 2009 Adam Blackburn
+#   Copyright (C) 2007 - 2009 Dan O'Reilly
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License Version 2 as
+#   published by the Free Software Foundation.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import time
+import errno
+import select
+import socket
+import itertools
+
+# The ctrl_interface directory set in the encryption templates.
+CTRL_IFACE_DIR = '/var/run/wpa_supplicant'
+# Where the sockets wpa_supplicant replies to are created.
+CLIENT_DIR = '/tmp'
+
+EVENT_CONNECTED = 'CTRL-EVENT-CONNECTED'
+EVENT_DISCONNECTED = 'CTRL-EVENT-DISCONNECTED'
+EVENT_SSID_TEMP_DISABLED = 'CTRL-EVENT-SSID-TEMP-DISABLED'
+EVENT_TERMINATING = 'CTRL-EVENT-TERMINATING'
+
+REQUEST_TIMEOUT = 10
+# How long wpa_supplicant gets to exit after TERMINATE.
+TERMINATE_TIMEOUT = 5
+
+_counter = itertools.count()
+
+
+class WpaCtrlError(Exception):
+    """ Raised when wpa_supplicant can't be reached or doesn't reply. """
+    pass
+
+
+def ctrl_path(iface, ctrl_dir=CTRL_IFACE_DIR):
+    """ Returns the path of the control socket of an interface. """
+    return os.path.join(ctrl_dir, iface)
+
+def parse_event(msg):
+    """ Parse an unsolicited message.
+
+    Returns:
+    A tuple (priority, event, text), where event is the first word of
+    the message, like CTRL-EVENT-CONNECTED, or None if msg isn't an
+    unsolicited message.
+
+    """
+    if not msg.startswith('<'):
+        return None
+    end = msg.find('>')
+    if end < 0:
+        return None
+    try:
+        priority = int(msg[1:end])
+    except ValueError:
+        return None
+    text = msg[end + 1:].strip()
+    return (priority, text.split(' ', 1)[0], text)
+
+def parse_status(reply):
+    """ Parse the reply to a STATUS request into a dict. """
+    status = {}
+    for line in reply.splitlines():
+        key, sep, value = line.partition('=')
+        if sep:
+            status[key] = value
+    return status
+
+def parse_config(config):
+    """ Parse a wpa_supplicant config file, as made by ParseEncryption.
+
+    Only the simple syntax of the encryption templates is understood:
+    one name=value per line, and network={ ... } blocks.
+
+    Returns:
+    A tuple (settings, networks).  settings is a list of the
+    (name, value) pairs outside of the network blocks, and networks
+    a list of such lists, one per block.  Values are left as written,
+    quotes included, which is what SET_NETWORK expects.
+
+    """
+    settings = []
+    networks = []
+    current = settings
+    for line in config.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.replace(' ', '') == 'network={':
+            current = []
+            networks.append(current)
+        elif line == '}':
+            current = settings
+        else:
+            name, sep, value = line.partition('=')
+            if sep:
+                current.append((name.strip(), value.strip()))
+    return (settings, networks)
+
+
+class WpaCtrl(object):
+    """ A connection to the control interface of wpa_supplicant.
+
+    Replies to requests and unsolicited messages arrive on the same
+    socket once attached, so messages received while waiting for a
+    reply are queued for recv_event().
+
+    """
+    def __init__(self, path, client_dir=CLIENT_DIR):
+        """ Connect to a control socket.
+
+        Keyword arguments:
+        path -- the control socket, see ctrl_path()
+        client_dir -- where to create the socket replies are sent to
+
+        Raises WpaCtrlError if wpa_supplicant can't be reached.
+
+        """
+        self.path = path
+        self.local = os.path.join(client_dir, 'wicd_ctrl_%d-%d' %
+                                  (os.getpid(), _counter.next()))
+        self.events = []
+        self.attached = False
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            if os.path.exists(self.local):
+                os.remove(self.local)
+            self.sock.bind(self.local)
+            self.sock.connect(path)
+        except (socket.error, OSError), e:
+            self.close()
+            raise WpaCtrlError("Couldn't open ctrl_interface %s: %s" %
+                               (path, e))
+
+    def _recv(self, timeout):
+        """ Returns the next message, or None after timeout seconds. """
+        if timeout is not None:
+            try:
+                ready = select.select([self.sock], [], [], max(timeout, 0))[0]
+            except select.error, e:
+                if e[0] == errno.EINTR:
+                    return ''
+                raise
+            if not ready:
+                return None
+        try:
+            return self.sock.recv(4096)
+        except socket.error, e:
+            raise WpaCtrlError('Reading from %s failed: %s' % (self.path, e))
+
+    def request(self, cmd, timeout=REQUEST_TIMEOUT):
+        """ Send a request and return the reply.
+
+        Raises WpaCtrlError if the request couldn't be sent or
+        wpa_supplicant didn't reply within timeout seconds.
+
+        """
+        try:
+            self.sock.send(cmd)
+        except socket.error, e:
+            raise WpaCtrlError('Sending %s to %s failed: %s' %
+                               (cmd, self.path, e))
+        deadline = time.time() + timeout
+        while True:
+            msg = self._recv(deadline - time.time())
+            if msg is None:
+                raise WpaCtrlError('wpa_supplicant did not reply to %s' % cmd)
+            if parse_event(msg):
+                self.events.append(msg)
+            elif msg:
+                return msg
+
+    def attach(self):
+        """ Ask wpa_supplicant to send us its unsolicited messages. """
+        if self.request('ATTACH').strip() != 'OK':
+            raise WpaCtrlError('wpa_supplicant refused ATTACH')
+        self.attached = True
+
+    def detach(self):
+        """ Stop receiving unsolicited messages. """
+        if self.attached:
+            self.attached = False
+            self.request('DETACH')
+
+    def status(self):
+        """ Returns the parsed reply to a STATUS request. """
+        return parse_status(self.request('STATUS'))
+
+    def recv_event(self, timeout=None):
+        """ Returns the next unsolicited message.
+
+        Returns:
+        The parsed message, see parse_event(), or None if none
+        arrived within timeout seconds.
+
+        """
+        if self.events:
+            return parse_event(self.events.pop(0))
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while True:
+            if deadline is None:
+                msg = self._recv(None)
+            else:
+                msg = self._recv(deadline - time.time())
+            if msg is None:
+                return None
+            event = parse_event(msg)
+            if event:
+                return event
+
+    def fileno(self):
+        """ Returns the file descriptor, for use with select/gobject. """
+        return self.sock.fileno()
+
+    def close(self):
+        """ Close the connection. """
+        try:
+            if self.attached:
+                self.detach()
+        except WpaCtrlError:
+            pass
+        self.sock.close()
+        if os.path.exists(self.local):
+            os.remove(self.local)
+
+
+def validate_authentication(ctrl, deadline, max_disconnected_time=3,
+                            verbose=False, cancelled=None):
+    """ Waits for wpa_supplicant to finish authenticating.
+
+    Returns as soon as wpa_supplicant reports the connection, or that
+    it disabled the network because authentication failed.  If it
+    stays disconnected for max_disconnected_time seconds, a rescan is
+    forced once and the deadline pushed back by 5 seconds, like
+    wpa_cli based validation does.
+
+    Keyword arguments:
+    ctrl -- a WpaCtrl
+    deadline -- time.time() after which to give up
+    max_disconnected_time -- seconds to wait before forcing a rescan
+    verbose -- print the events received
+    cancelled -- a function returning True when to stop waiting
+
+    Returns:
+    True if wpa_supplicant authenticated succesfully, False otherwise.
+
+    Raises WpaCtrlError if wpa_supplicant stops answering.
+
+    """
+    # Attach before checking the state, so no event can be missed.
+    ctrl.attach()
+    state = ctrl.status().get('wpa_state')
+    if verbose:
+        print 'wpa_supplicant state is %s' % state
+    if not state:
+        return False
+    if state == 'COMPLETED':
+        return True
+    disconnected_since = None
+    forced_rescan = False
+    while time.time() < deadline:
+        if cancelled and cancelled():
+            return False
+        event = ctrl.recv_event(min(1, deadline - time.time()))
+        if event:
+            if verbose:
+                print 'wpa_supplicant event: %s' % event[2]
+            if event[1] == EVENT_CONNECTED:
+                return True
+            if event[1] == EVENT_SSID_TEMP_DISABLED:
+                print 'wpa_supplicant disabled the network: %s' % event[2]
+                return False
+            if event[1] == EVENT_TERMINATING:
+                return False
+            if event[1] != EVENT_DISCONNECTED:
+                continue
+        else:
+            state = ctrl.status().get('wpa_state')
+            if state == 'COMPLETED':
+                return True
+            if state != 'DISCONNECTED':
+                disconnected_since = None
+                continue
+        if disconnected_since is None:
+            disconnected_since = time.time()
+        elif not forced_rescan and \
+             time.time() - disconnected_since > max_disconnected_time:
+            # Force a rescan to get wpa_supplicant moving again.
+            print 'wpa_supplicant rescan forced...'
+            forced_rescan = True
+            ctrl.request('SCAN')
+            deadline += 5
+    print 'wpa_supplicant authentication may have failed.'
+    return False
+
+def _expect_ok(ctrl, cmd, what=None):
+    """ Send a request that wpa_supplicant should answer with OK.
+
+    what is used in the error instead of the request, so secrets
+    sent with SET_NETWORK don't end up in the logs.
+
+    """
+    reply = ctrl.request(cmd).strip()
+    if reply != 'OK':
+        raise WpaCtrlError('wpa_supplicant refused %s: %s' %
+                           (what or cmd, reply))
+
+def configure_networks(ctrl, config):
+    """ Switch a running wpa_supplicant to the networks of a config.
+
+    The networks wpa_supplicant knows about are replaced by the ones
+    of config, and the first one is selected, which is what starting
+    wpa_supplicant with config as its config file would do, without
+    restarting it.
+
+    Keyword arguments:
+    ctrl -- a WpaCtrl
+    config -- the text of a config file, see parse_config()
+
+    Raises WpaCtrlError if wpa_supplicant rejects any of it, in which
+    case it should be restarted with the config file instead.
+
+    """
+    settings, networks = parse_config(config)
+    for name, value in settings:
+        if name == 'ap_scan':
+            _expect_ok(ctrl, 'AP_SCAN %s' % value)
+        elif name != 'ctrl_interface':
+            _expect_ok(ctrl, 'SET %s %s' % (name, value))
+    _expect_ok(ctrl, 'REMOVE_NETWORK all')
+    ids = []
+    for network in networks:
+        net_id = ctrl.request('ADD_NETWORK').strip()
+        if not net_id.isdigit():
+            raise WpaCtrlError('wpa_supplicant refused ADD_NETWORK: %s' %
+                               net_id)
+        for name, value in network:
+            _expect_ok(ctrl, 'SET_NETWORK %s %s %s' % (net_id, name, value),
+                       'SET_NETWORK %s %s' % (net_id, name))
+        ids.append(net_id)
+    if ids:
+        _expect_ok(ctrl, 'SELECT_NETWORK %s' % ids[0])
+        for net_id in ids[1:]:
+            _expect_ok(ctrl, 'ENABLE_NETWORK %s' % net_id)
+
+def wait_for_exit(path, timeout=TERMINATE_TIMEOUT, sleep=time.sleep):
+    """ Waits for wpa_supplicant to remove its control socket.
+
+    wpa_supplicant removes the socket when it exits, and a new instance
+    can't be started for the interface before it's gone.
+
+    Keyword arguments:
+    path -- the control socket, see ctrl_path()
+    timeout -- seconds to wait at most
+    sleep -- the function used to sleep between checks
+
+    Returns:
+    True if the socket is gone, False if it's still there after timeout
+    seconds.
+
+    """
+    deadline = time.time() + timeout
+    while os.path.exists(path):
+        if time.time() >= deadline:
+            return False
+        sleep(0.1)
+    return True